@@ -0,0 +1,499 @@
+#! /usr/bin/env python
+"""
+Headless benchmark for the Brandmateriel engine.
+
+Builds a Game on the SDL dummy video driver, feeds it a scripted input
+stream and runs Game.do_step for a fixed number of frames without any frame
+rate cap. Frame rate, frame time percentiles and peak memory are reported per
+map and per view setting, and, with --dtypes, per dtype policy (see
+src/engine/dtypes.py). Memory is reported as the traced peak, the mean peak of
+temporary allocations within a frame, the bytes queued for drawing per frame
+and the bytes held by the map.
+
+With --record, the input of the timed run is recorded to a file; with
+--replay, a recorded session (from bench.py or from the game, with the
+"record" config entry) is played back instead of the script, frame for
+frame and with the recorded frame times, so that it simulates exactly the
+same game, however fast it is drawn.
+
+With --load, map construction is timed instead, on synthetic heightmaps of
+the given sizes.
+
+Examples:
+
+    python bench.py --frames 300 --maps legacy magpie --views 12x9 24x18
+    python bench.py --load 128 512 2048
+    python bench.py --maps magpie --dtypes compact precise
+    python bench.py --maps magpie --views 16x12 --replay session.npz
+"""
+
+from __future__ import print_function
+
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy as np
+import pygame
+import src.game as g
+import src.engine as e
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+MAPS = ["legacy", "magpie"]
+VIEWS = [[12, 9], [16, 12], [20, 15], [24, 18]]
+LOAD_SIZES = [128, 256, 512, 1024]
+
+# Height over the ground that scripted_inputs keeps the lander at:
+ALTITUDE = 4.0
+
+
+@contextlib.contextmanager
+def silence():
+    """
+    Ye olde silencer
+    """
+    save_stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        yield
+    finally:
+        sys.stdout = save_stdout
+
+
+def scripted_inputs(frame, game):
+    """
+    Returns the actions (see Game.actions) to set before the given frame of
+    game.
+
+    The lander flies itself, judging by the latest snapshot: it turns to
+    the nearest house that is still standing, tilts towards it (which aims
+    its cannon at the house and drives it there), fires once in range, and
+    thrusts whenever it would otherwise sink below ALTITUDE over the ground,
+    so that terrain, houses, shots, exhaust and shrapnel all get exercised
+    without the lander crashing.
+
+    Actions are set rather than input events posted, since the mouse
+    buttons that thrust and fire only act with the input grabbed, and the
+    dummy video driver never grabs it.
+    """
+
+    snapshot = game.snapshot
+    if snapshot is None:
+        return {"thrust": True, "fire": False}
+
+    x, y, z = snapshot.position
+    ground = max(0, game.world.patches_at(int(x), int(y))[:, 2].max())
+    actions = {"thrust": z + snapshot.velocity[2] * 0.5 - ground < ALTITUDE,
+               "fire": False}
+
+    houses = snapshot.houses
+    standing = ~houses.exploding.astype(bool)
+    if standing.any():
+        # The nearest house, across the edges of the map:
+        shape = np.array(game.world.shape)
+        offsets = houses.positions[standing] - snapshot.position
+        offsets[:, : 2] = (offsets[:, : 2] + shape / 2) % shape - shape / 2
+        dx, dy, dz = offsets[np.argmin(np.hypot(*offsets[:, : 2].T))]
+        distance = np.hypot(dx, dy)
+
+        actions["yaw"] = np.arctan2(-dx, dy) % (2 * np.pi)
+        actions["pitch"] = np.clip(np.arctan2(-dz, distance), 0, np.pi / 4)
+        actions["fire"] = distance < 12
+
+    return actions
+
+
+def make_config(map_name, view, resolution, options=None):
+    with open(os.path.join(ROOT, "config", "default.conf"), 'r') as f:
+        config = json.load(f)
+
+    config["map"] = map_name
+    config["view"] = list(view)
+    config["resolution"] = list(resolution)
+    config.update(options or {})
+
+    return config
+
+
+def make_game(map_name, view, resolution, fps, seed, options=None):
+    config = make_config(map_name, view, resolution, options)
+
+    config.setdefault("seed", seed)
+
+    with silence():
+        game = g.Game(config, os.path.join(ROOT, "assets", "maps",
+                                           "{0}.npy".format(map_name)),
+                      os.path.join(ROOT, "assets", "fonts",
+                                   "PressStart2P.ttf"),
+                      8, fps)
+
+    pygame.event.clear()
+
+    return game
+
+
+def play(game, window, frames, warmup=0):
+    """
+    Runs the game for warmup + frames frames, and returns the durations of
+    the last frames frames in seconds.
+
+    Raises RuntimeError if the game is over in any of the timed frames,
+    which would time the game over screen rather than the game.
+    """
+
+    times = np.zeros(frames)
+
+    for frame in range(warmup + frames):
+        if game.replay is None:
+            game.actions.update(scripted_inputs(frame, game))
+
+        start = clock()
+        with silence():
+            game.do_step(window)
+        pygame.display.flip()
+        stop = clock()
+
+        if frame >= warmup:
+            times[frame - warmup] = stop - start
+            if game.snapshot.gameover:
+                raise RuntimeError("game over in frame {0}".format(frame))
+
+    return times
+
+
+def trace(game, window, frames):
+    """
+    Runs the game for frames frames with allocations traced, and returns the
+    peak traced memory, the mean peak of allocations within a frame (over
+    what was allocated at its start) and the mean number of bytes in the
+    render queue per frame.
+    """
+
+    peaks = np.zeros(frames)
+    frame_peaks = np.zeros(frames)
+    queued = np.zeros(frames)
+
+    tracemalloc.start()
+
+    for frame in range(frames):
+        if game.replay is None:
+            game.actions.update(scripted_inputs(frame, game))
+
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        with silence():
+            game.do_step(window)
+        peaks[frame] = tracemalloc.get_traced_memory()[1]
+        frame_peaks[frame] = peaks[frame] - start
+        queued[frame] = game.render_queue.nbytes
+        pygame.display.flip()
+
+    peak = peaks.max()
+    tracemalloc.stop()
+
+    if not hasattr(tracemalloc, "reset_peak"):
+        frame_peaks[:] = float("nan")
+
+    return peak, frame_peaks.mean(), queued.mean()
+
+
+def run(map_name, view, frames=300, warmup=10, resolution=(640, 480),
+        fps=23.8, seed=0, memory_frames=60, profile=None, options=None):
+    """
+    Runs a single benchmark and returns a dictionary of results.
+
+    options are extra config entries, e.g. {"renderer": "numpy"} or
+    {"dtypes": "precise"}. With {"replay": filename}, the recorded session
+    is played back, all of it, instead of frames frames of the script; with
+    {"record": filename}, the input of the timed run is recorded.
+
+    If profile is a directory, per-stage timings of the timed run are written
+    there as CSV and Chrome trace-event JSON.
+
+    Timing and memory are measured in separate runs from the same seed and
+    input script, since tracing allocations slows the engine down severely.
+    """
+
+    window = pygame.display.set_mode(tuple(resolution), pygame.DOUBLEBUF)
+
+    game = make_game(map_name, view, resolution, fps, seed, options)
+    game.profiler.enabled = profile is not None
+    if game.replay is not None:
+        frames = game.replay.number - warmup
+        memory_frames = min(memory_frames, game.replay.number)
+    times = play(game, window, frames, warmup)
+
+    if game.recording is not None:
+        game.recording.save(game.config["record"])
+
+    if profile is not None:
+        game.export_profile(os.path.join(profile, "{0}-{1}x{2}".format(
+            map_name, *view)))
+
+    world = footprint(game.world)
+
+    if tracemalloc is not None and memory_frames:
+        game = make_game(map_name, view, resolution, fps, seed, options)
+        peak, frame_peak, queued = trace(game, window, memory_frames)
+    else:
+        peak = frame_peak = queued = float("nan")
+
+    return {
+        "dtypes": game.simulation.policy.name,
+        "map": map_name,
+        "view": "{0}x{1}".format(*view),
+        "frames": frames,
+        "fps": frames / times.sum(),
+        "p50": np.percentile(times, 50) * 1000.0,
+        "p95": np.percentile(times, 95) * 1000.0,
+        "p99": np.percentile(times, 99) * 1000.0,
+        "peak": peak / 2.0 ** 20,
+        "frame": frame_peak / 2.0 ** 10,
+        "queue": queued / 2.0 ** 10,
+        "world": world / 2.0 ** 20,
+    }
+
+
+def make_heightmap(size, seed=0):
+    """
+    Returns a smooth random (size + 1) x (size + 1) heightmap in [-2, 2],
+    periodic like the bundled maps.
+    """
+
+    rng = np.random.RandomState(seed)
+    x = np.linspace(0, 2 * np.pi, size + 1)
+    heights = np.zeros((size + 1, size + 1))
+
+    for octave in range(1, 7):
+        kx, ky = rng.randint(1, 2 ** octave + 1, 2)
+        phase = rng.random_sample(2) * 2 * np.pi
+        heights += (np.sin(kx * x + phase[0])[np.newaxis, :] *
+                    np.sin(ky * x + phase[1])[:, np.newaxis]) / octave
+
+    return 2.0 * heights / np.abs(heights).max()
+
+
+def footprint(world):
+    """
+    Returns the number of bytes of array data held by a map.
+    """
+
+    arrays = [a for a in vars(world).values() if isinstance(a, np.ndarray)]
+
+    return sum(a.nbytes for a in arrays
+               if not any(a.base is b for b in arrays))
+
+
+def load(size, repeats=3, seed=0, trimap=True, policy="compact"):
+    """
+    Times construction and reflooding of a Map (and a TriMap) from a
+    synthetic size x size heightmap, construction from the map cache and
+    construction of a CompactMap, and returns a dictionary of results,
+    including the bytes per cell of Map and CompactMap. The best of repeats
+    runs is reported. Maps are built with the dtype policy named policy.
+    """
+
+    policy = e.dtypes.Policy(policy)
+
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "{0}.npy".format(size))
+    np.save(filename, make_heightmap(size, seed))
+
+    def best(function):
+        times = []
+        for n in range(repeats):
+            # Maps reference themselves through their terrain window, so
+            # make sure the previous one is gone before building the next:
+            gc.collect()
+            start = clock()
+            function()
+            times.append(clock() - start)
+        return min(times)
+
+    result = {"dtypes": policy.name, "size": size, "cells": size * size}
+
+    try:
+        result["map"] = best(lambda: e.mapper.Map(filename, policy=policy))
+
+        e.mapper.Map(filename, cache=True, policy=policy)
+        result["cached"] = best(lambda: e.mapper.Map(filename, cache=True,
+                                                     policy=policy))
+
+        world = e.mapper.Map(filename, policy=policy)
+        result["map B/cell"] = footprint(world) / float(size * size)
+        result["reflood"] = best(lambda: world.reflood(0.2, flat_sea=True))
+        del world
+
+        result["compact"] = best(lambda: e.mapper.CompactMap(
+            filename, policy=policy))
+        result["compact B/cell"] = footprint(e.mapper.CompactMap(
+            filename, policy=policy)) / float(size * size)
+
+        result["trimap"] = (best(lambda: e.mapper.TriMap(filename)) if trimap
+                            else float("nan"))
+    finally:
+        shutil.rmtree(directory)
+        gc.collect()
+
+    result["us/cell"] = result["map"] / result["cells"] * 1e6
+
+    return result
+
+
+def parse_view(text):
+    return [int(v) for v in text.lower().split("x")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--frames", type=int, default=300,
+                        help="number of measured frames per run")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="number of unmeasured frames before each run")
+    parser.add_argument("--maps", nargs="+", default=MAPS,
+                        help="maps to benchmark")
+    parser.add_argument("--views", nargs="+", type=parse_view,
+                        default=VIEWS, help="view settings, e.g. 16x12")
+    parser.add_argument("--resolution", type=parse_view, default=[640, 480],
+                        help="screen resolution, e.g. 640x480")
+    parser.add_argument("--memory-frames", type=int, default=60,
+                        help="number of frames in the traced memory run; "
+                        "0 disables memory measurement")
+    parser.add_argument("--profile", default=None,
+                        help="write per-stage timings to this directory")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed for world generation")
+    parser.add_argument("--record", default=None,
+                        help="record the input of the timed run to this "
+                        "file (.npz); with several runs, the dtypes, map "
+                        "and view of each are added to the name")
+    parser.add_argument("--replay", default=None,
+                        help="play back this recorded session instead of "
+                        "the input script")
+    parser.add_argument("--json", default=None,
+                        help="write results as JSON to this file")
+    parser.add_argument("--load", nargs="*", type=int, default=None,
+                        help="time map construction for these heightmap "
+                        "sizes instead (default: {0})".format(
+                            " ".join(str(s) for s in LOAD_SIZES)))
+    parser.add_argument("--no-trimap", action="store_true",
+                        help="skip TriMap when timing map construction")
+    parser.add_argument("--dtypes", nargs="+", default=None,
+                        choices=sorted(e.dtypes.POLICIES),
+                        help="dtype policies to benchmark (default: the "
+                        "\"dtypes\" entry of --config, or compact)")
+    parser.add_argument("--config", type=json.loads, default=None,
+                        help="extra config entries as JSON, e.g. "
+                        "'{\"compact map\": true}'")
+    args = parser.parse_args(argv)
+
+    # Without --dtypes, the policy is whatever the config says:
+    config = args.config or {}
+    policies = args.dtypes or [config.get("dtypes", "compact")]
+
+    if args.load is not None:
+        header = ("{0:>7} {1:>6} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9} {7:>8} "
+                  "{8:>9} {9:>7} {10:>7}".format(
+                      "dtypes", "size", "cells", "map s", "cached s",
+                      "reflood s", "trimap s", "us/cell", "compact s",
+                      "map B", "compact B"))
+        print(header)
+        print("-" * len(header))
+
+        results = []
+        for policy in policies:
+            for size in args.load or LOAD_SIZES:
+                result = load(size, seed=args.seed,
+                              trimap=not args.no_trimap, policy=policy)
+                results.append(result)
+                print("{dtypes:>7} {size:>6} {cells:>9} {map:9.3f} "
+                      "{cached:9.3f} {reflood:9.3f} {trimap:9.3f} "
+                      "{us/cell:8.3f} {compact:9.3f} {map B/cell:7.1f} "
+                      "{compact B/cell:7.1f}".format(**result))
+
+        if args.json is not None:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=4)
+
+        return
+
+    if args.profile is not None:
+        args.profile = os.path.abspath(args.profile)
+        if not os.path.isdir(args.profile):
+            os.makedirs(args.profile)
+
+    for name in ("record", "replay"):
+        if getattr(args, name) is not None:
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    os.chdir(ROOT)
+    pygame.init()
+
+    header = ("{0:>7} {1:>8} {2:>6} {3:>8} {4:>8} {5:>8} {6:>8} {7:>9} "
+              "{8:>10} {9:>10} {10:>9}".format(
+                  "dtypes", "map", "view", "fps", "p50 ms", "p95 ms",
+                  "p99 ms", "peak MiB", "frame KiB", "queue KiB", "map MiB"))
+    print(header)
+    print("-" * len(header))
+
+    results = []
+    several = len(policies) * len(args.maps) * len(args.views) > 1
+
+    for policy in policies:
+        options = dict(config, dtypes=policy)
+        if args.replay is not None:
+            options["replay"] = args.replay
+        for map_name in args.maps:
+            for view in args.views:
+                if args.record is not None and several:
+                    base, extension = os.path.splitext(args.record)
+                    options["record"] = "{0}-{1}-{2}-{3}x{4}{5}".format(
+                        base, policy, map_name, view[0], view[1],
+                        extension or ".npz")
+                elif args.record is not None:
+                    options["record"] = args.record
+                result = run(map_name, view, args.frames, args.warmup,
+                             args.resolution, seed=args.seed,
+                             memory_frames=args.memory_frames,
+                             profile=args.profile, options=options)
+                results.append(result)
+                print("{dtypes:>7} {map:>8} {view:>6} {fps:8.1f} "
+                      "{p50:8.2f} {p95:8.2f} {p99:8.2f} {peak:9.2f} "
+                      "{frame:10.1f} {queue:10.1f} {world:9.2f}".format(
+                          **result))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    pygame.quit()
+
+if __name__ == "__main__":
+    sys.exit(main())
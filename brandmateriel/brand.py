@@ -74,10 +74,11 @@ def main():
                 pygame.mouse.set_visible(False)
                 pygame.mouse.get_rel()
 
+        elapsed = None
         while(mode == "game"):
-            mode = game.do_step(window)
+            mode = game.do_step(window, elapsed)
             pygame.display.flip()
-            fps_clock.tick(fps)
+            elapsed = fps_clock.tick(fps) / 1000.0
 
         while(mode == "hiscore"):
             print( "high-score list is not implemented. returning to menu ..." )
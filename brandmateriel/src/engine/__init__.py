@@ -1,7 +1,15 @@
+from . import broadphase
 from . import camera
+from . import culling
+from . import dtypes
 from . import mapper
 from . import mobs
 from . import particles
+from . import profiler
+from . import raster
+from . import renderqueue
+from . import rng
 from . import shader
 from . import shadow
 from . import triDobjects
+from . import worker
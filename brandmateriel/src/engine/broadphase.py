@@ -0,0 +1,121 @@
+import numpy as np
+from . import dtypes
+
+
+class SpatialHash(object):
+    """
+    The SpatialHash is a broadphase index of objects on a Map: objects are
+    bucketed by the map cells they are in, cell_size x cell_size cells to a
+    bucket, so that finding the objects near some points only looks at the
+    buckets around them, rather than at all objects.
+
+    Buckets wrap around the map like the map itself, and distances are
+    measured the short way round, so objects near an edge are found from
+    the other side of it. Queries are batched: query_pairs takes any number
+    of points and returns all colliding (point, object) pairs at once.
+
+    Storage is the objects sorted by bucket, with the start of every bucket
+    in that order; build it again whenever objects move, are added or are
+    deleted. Positions are kept as geometry arrays of policy.
+    """
+
+    X = U = 0
+    Y = V = 1
+    Z = W = 2
+
+    def __init__(self, shape, cell_size=1, policy=None):
+        self._policy = dtypes.default() if policy is None else policy
+        self._shape = np.array(shape[: 2], dtype=float)
+        self._cell_size = cell_size
+        self._buckets = (max(1, int(np.ceil(shape[self.X] / cell_size))),
+                         max(1, int(np.ceil(shape[self.Y] / cell_size))))
+
+        self.build(np.empty((0, 3)))
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def shape(self):
+        return tuple(self._shape)
+
+    @property
+    def cell_size(self):
+        return self._cell_size
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    @property
+    def number(self):
+        return self._positions.shape[0]
+
+    def _bucket_coordinates(self, positions):
+        cells = np.floor(positions[:, : 2] % self._shape / self._cell_size)
+
+        return (cells[:, self.X].astype(int) % self._buckets[self.X],
+                cells[:, self.Y].astype(int) % self._buckets[self.Y])
+
+    def build(self, positions):
+        """
+        Indexes objects at positions, an (N, 3)-array. Objects are referred
+        to by their index into positions.
+        """
+
+        self._positions = self._policy.geometry(positions)
+
+        bx, by = self._bucket_coordinates(self._positions)
+        keys = bx * self._buckets[self.Y] + by
+
+        self._order = np.argsort(keys, kind="mergesort")
+        self._starts = np.zeros(self._buckets[self.X] * self._buckets[self.Y]
+                                + 1, dtype=int)
+        np.cumsum(np.bincount(keys, minlength=self._starts.size - 1),
+                  out=self._starts[1:])
+
+    def query_pairs(self, points, radius):
+        """
+        Returns the indices of points (an (M, 3)-array) and of objects that
+        are closer than radius to each other, as two arrays of equal length,
+        one entry for every pair. radius must not exceed cell_size.
+        """
+
+        if not (len(points) and self.number):
+            return (np.empty(0, dtype=int), np.empty(0, dtype=int))
+
+        points = self._policy.geometry(points)
+        nx, ny = self._buckets
+
+        bx, by = self._bucket_coordinates(points)
+
+        # Keys of the 3 x 3 buckets around each point, shaped (M, 9), without
+        # repeats on maps only one or two buckets wide:
+        offsets = np.arange(-1, 2)
+        keys = ((bx[:, np.newaxis, np.newaxis] + offsets[:, np.newaxis]) % nx
+                * ny +
+                (by[:, np.newaxis, np.newaxis] + offsets) % ny).reshape(
+                    (len(points), 9))
+        if nx < 3 or ny < 3:
+            keys = np.sort(keys, axis=-1)
+            keys[:, 1:][keys[:, 1:] == keys[:, : -1]] = -1
+
+        queried = keys.ravel()
+        valid = queried >= 0
+        point_indices = np.repeat(np.arange(len(points)), 9)[valid]
+        queried = queried[valid]
+
+        # All candidate pairs, by expanding every bucket into its objects:
+        counts = self._starts[queried + 1] - self._starts[queried]
+        point_indices = np.repeat(point_indices, counts)
+        firsts = np.repeat(self._starts[queried] - np.cumsum(counts) + counts,
+                           counts)
+        object_indices = self._order[firsts + np.arange(counts.sum())]
+
+        deltas = points[point_indices] - self._positions[object_indices]
+        deltas[:, : 2] = ((deltas[:, : 2] + 0.5 * self._shape) % self._shape -
+                          0.5 * self._shape)
+        close = (deltas ** 2).sum(-1) < radius ** 2
+
+        return point_indices[close], object_indices[close]
@@ -1,4 +1,5 @@
 import numpy as np
+from . import dtypes
 
 
 class Screen(object):
@@ -127,10 +128,15 @@ class Camera(object):
           the Camera.
           See the Screen class for details!
 
+    * policy:
+        - the dtype policy (see dtypes) of the screen coordinates and
+          depths.
+
     The Camera has the following methods:
     * get_screen_coordinates(points):
         - returns the screen coordinate of points (an N x 3-array of positions
-          in xyz-space) based on current Camera position and orientation.
+          in xyz-space) based on current Camera position and orientation,
+          and their depths (distances along the viewing direction v).
 
     * look_at_point(point):
         - turn camera to look at point, keeping position and roll constant.
@@ -157,7 +163,9 @@ class Camera(object):
                  orientation=np.array([[1.0, 0.0, 0.0],     # u
                                        [0.0, 1.0, 0.0],     # v
                                        [0.0, 0.0, 1.0]]),   # w
-                 screen=Screen()):
+                 screen=Screen(), policy=None):
+
+        self._policy = dtypes.default() if policy is None else policy
 
         self.position = position
 
@@ -175,6 +183,10 @@ class Camera(object):
     def position(self, val):
         self._position = val
 
+    @property
+    def policy(self):
+        return self._policy
+
     @property
     def orientation(self):
         return self._orientation
@@ -195,6 +207,17 @@ class Camera(object):
     def distance(self):
         return self.screen.distance
 
+    @property
+    def centre(self):
+        """
+        The screen coordinates that points straight ahead of the Camera
+        project to (see get_screen_coordinates).
+        """
+
+        return self._norms * np.array([
+            self.screen.width * 0.5 - self.screen.u,
+            self.screen.height * 0.5 + self.screen.w])
+
     @property
     def x(self):
         return self._position[self.X]
@@ -244,29 +267,32 @@ class Camera(object):
         self._orientation[self.W] = val
 
     def get_screen_coordinates(self, points):
+        policy = self._policy
+
         # Perform projections:
         # projections = np.inner(points.reshape(points.size / 3, 3) -
         #                        self.position, self.orientation)
 
-        projections = np.inner(points - self.position, self.orientation)
+        projections = np.inner(policy.geometry(points) -
+                               policy.geometry(self.position),
+                               policy.geometry(self.orientation))
+
+        # Keep view depths, before they are rescaled away:
+        depths = projections[:, :, self.V].copy()
 
         # Rescale to screen distance:
-        projections *= np.abs(self.distance /
+        projections *= np.abs(policy.float_type()(self.distance) /
                               projections[:, :, np.newaxis, 1])
 
         # Change origin to upper-left corner of screen:
-        projections += np.array([self.screen.width * 0.5 - self.screen.u, 0.0,
-                                 -self.screen.height * 0.5 - self.screen.w])
+        projections += policy.geometry([
+            self.screen.width * 0.5 - self.screen.u, 0.0,
+            -self.screen.height * 0.5 - self.screen.w])
 
         # Convert to left-handed pixel space and return:
-        return np.round(projections[:, :, (self.U, self.W)] * self._norms *
-                        np.array([1, -1])
-                        ).astype(int), projections[:, :, self.V]
-
-        return np.round(np.array(
-            [ projections[:, :, self.U] * self._norms[self.X],
-             -projections[:, :, self.W] * self._norms[self.Y]]).T
-            ).astype(int), projections[:, :, self.V]
+        return policy.screen(projections[:, :, (self.U, self.W)] *
+                             policy.geometry(self._norms * np.array([1, -1]))
+                             ), depths
 
     def look_at_point(self, point):
         roll = self.get_roll()
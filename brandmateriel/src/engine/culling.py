@@ -0,0 +1,120 @@
+import numpy as np
+from . import dtypes
+
+
+class Culler(object):
+    """
+    The Culler picks the patches that can be seen at all, so that only those
+    are lit and drawn. It works on patches as returned by
+    Camera.get_screen_coordinates, and culls a patch if:
+    * behind:
+        - all of its vertices are nearer than near, i.e. behind the camera.
+
+    * screen:
+        - it lies entirely outside the screen. Patches partly behind the
+          camera are never culled this way, since their screen coordinates
+          are mirrored.
+
+    * back:
+        - it faces away from the viewer. Only checked for patches given with
+          normals.
+
+    * fog:
+        - it is at fog_distance or further from the viewer, where the Shader
+          has faded it to black anyway (see Shader.fog_distance).
+
+    Patches are counted under the first of these that applies. Counts add
+    up until reset() is called, normally once per frame.
+
+    Distances are worked out in geometry floats of policy.
+    """
+
+    X = U = 0
+    Y = V = 1
+    Z = W = 2
+
+    REASONS = ("behind", "screen", "back", "fog")
+
+    def __init__(self, resolution, near=0.1, fog_distance=None,
+                 policy=None):
+        self._resolution = tuple(resolution)
+
+        self._policy = dtypes.default() if policy is None else policy
+
+        self._near = near
+
+        self._fog_distance = fog_distance
+
+        self.reset()
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def resolution(self):
+        return self._resolution
+
+    @resolution.setter
+    def resolution(self, val):
+        self._resolution = tuple(val)
+
+    @property
+    def near(self):
+        return self._near
+
+    @near.setter
+    def near(self, val):
+        self._near = val
+
+    @property
+    def fog_distance(self):
+        return self._fog_distance
+
+    @fog_distance.setter
+    def fog_distance(self, val):
+        self._fog_distance = val
+
+    @property
+    def counts(self):
+        return self._counts
+
+    def reset(self):
+        self._counts = dict((reason, 0) for reason in self.REASONS)
+
+    def cull(self, patches, depths, positions, viewer, normals=None):
+        """
+        Returns the indices of the patches that survive culling.
+
+        patches and depths are screen coordinates and per-vertex view depths
+        from Camera.get_screen_coordinates, positions the patch positions and
+        viewer the position of the camera.
+        """
+
+        width, height = self._resolution
+
+        culled = depths.max(-1) <= self._near
+        self._counts["behind"] += int(culled.sum())
+
+        in_front = depths.min(-1) > self._near
+        xs = patches[..., self.X]
+        ys = patches[..., self.Y]
+        outside = in_front * ((xs.max(-1) < 0) + (xs.min(-1) > width - 1) +
+                              (ys.max(-1) < 0) + (ys.min(-1) > height - 1))
+        self._counts["screen"] += int((outside > culled).sum())
+        culled += outside
+
+        policy = self._policy
+        deltas = policy.geometry(positions) - policy.geometry(viewer)
+
+        if normals is not None:
+            back = (deltas * policy.geometry(normals)).sum(-1) > 0
+            self._counts["back"] += int((back > culled).sum())
+            culled += back
+
+        if self._fog_distance is not None:
+            fog = (deltas ** 2).sum(-1) >= self._fog_distance ** 2
+            self._counts["fog"] += int((fog > culled).sum())
+            culled += fog
+
+        return np.where(~culled)[0]
@@ -0,0 +1,117 @@
+"""
+The dtype policies of the engine.
+
+Geometry (patches, positions, normals, velocities and such), screen
+coordinates and colours are allocated with the dtypes of a Policy, which
+maps, cameras, shaders and the like are given on creation and hold on to:
+
+* "compact" (default):
+    - float32 geometry, int32 screen coordinates and uint8 colours. This
+      halves (or, for colours, eighths) the memory and bandwidth of
+      per-frame arrays.
+
+* "precise":
+    - float64 geometry, and int64 screen coordinates and colours, as NumPy
+      would allocate by default.
+
+The classes and functions that allocate arrays take the Policy as a policy
+argument, and use the default, "compact", one if it is left at None. There
+is no global policy to set: two simulations with different policies (see
+Simulation) can live side by side.
+
+Colours that evolve over time (such as those of particles) are state rather
+than output, and are kept as geometry floats. Shaded colours, ready for
+drawing, are colour_type.
+"""
+
+import numpy as np
+
+POLICIES = {
+    "compact": (np.float32, np.int32, np.uint8),
+    "precise": (np.float64, np.int64, np.int64),
+}
+
+
+class Policy(object):
+    """
+    A dtype policy, by name (see POLICIES).
+    """
+
+    def __init__(self, name="compact"):
+        if name not in POLICIES:
+            raise ValueError("unknown dtype policy: {0}".format(name))
+
+        self._name = name
+        (self._float_type, self._screen_type,
+         self._colour_type) = POLICIES[name]
+
+    def __repr__(self):
+        return "Policy({0!r})".format(self._name)
+
+    def __eq__(self, other):
+        return isinstance(other, Policy) and other.name == self._name
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._name)
+
+    @property
+    def name(self):
+        return self._name
+
+    def float_type(self):
+        return self._float_type
+
+    def screen_type(self):
+        return self._screen_type
+
+    def colour_type(self):
+        return self._colour_type
+
+    def empty(self, shape):
+        """
+        Returns an empty geometry array.
+        """
+
+        return np.empty(shape, dtype=self._float_type)
+
+    def zeros(self, shape):
+        """
+        Returns a geometry array of zeros.
+        """
+
+        return np.zeros(shape, dtype=self._float_type)
+
+    def geometry(self, array):
+        """
+        Returns array as float_type, without copying if it already is.
+        """
+
+        return np.asarray(array, dtype=self._float_type)
+
+    def screen(self, array):
+        """
+        Rounds array to screen_type, saturating at the limits of the type.
+        """
+
+        limits = np.iinfo(self._screen_type)
+
+        return np.clip(np.round(array), limits.min, limits.max).astype(
+            self._screen_type)
+
+    def colours(self, array):
+        """
+        Clips array to [0, 255] and converts it to colour_type.
+        """
+
+        return np.clip(array, 0, 255).astype(self._colour_type)
+
+
+def default():
+    """
+    Returns the default policy.
+    """
+
+    return Policy()
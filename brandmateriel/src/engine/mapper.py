@@ -1,4 +1,348 @@
+import os
+import zlib
+import hashlib
+import weakref
 import numpy as np
+from . import dtypes
+
+X = U = 0
+Y = V = 1
+Z = W = 2
+
+CORNERS_X = np.array([0, 1, 1, 0])
+CORNERS_Y = np.array([0, 0, 1, 1])
+
+
+def patch_normals(patches):
+    """
+    Returns normals of quadrilateral patches, an (..., 4, 3)-array.
+
+    This is a little bit arbitrary since the normal is not well defined
+    for patches, but it is arbitrary in a very systematic way and therefore
+    gives a nice noise effect (hopefully).
+    """
+
+    v0s = patches[..., 1, :] - patches[..., 0, :]
+    v1s = patches[..., 2, :] - patches[..., 1, :]
+    v2s = patches[..., 3, :] - patches[..., 2, :]
+    v3s = patches[..., 0, :] - patches[..., 3, :]
+
+    normals = np.cross(v0s, v1s + v3s) + np.cross(v2s, v3s - v1s)
+    normals /= np.sqrt((normals ** 2).sum(-1))[..., np.newaxis]
+
+    return normals
+
+
+def unit(vectors):
+    """
+    Returns vectors, an (..., 3)-array, scaled to unit length.
+    """
+
+    return vectors / np.sqrt((vectors ** 2).sum(-1))[..., np.newaxis]
+
+
+def cell_colours(heights, max_height, noise, sealevel):
+    """
+    Returns RGBA colours (as floats) of map cells of the given heights: sea,
+    beach or land, depending on the distance to sealevel, with noise (random
+    numbers in [0, 1), shaped heights.shape + (2,)) mixed into the red and
+    green of beaches and land.
+    """
+
+    relative = (heights / max_height)[..., np.newaxis]
+    noise = np.concatenate([noise * 153, np.zeros(heights.shape + (2,))], -1)
+
+    land = np.array([51, 102, 26, 255]) + noise * np.concatenate(
+        [relative, 1 - relative, 0 * relative, 0 * relative], -1)
+    sea = np.array([1, 1, 77, 255]) * np.ones_like(noise)
+    beach = np.array([204, 153, 51, 255]) + noise * relative
+
+    height = heights[..., np.newaxis]
+
+    return np.where(height > sealevel + 0.14, land,
+                    np.where(height < sealevel - 0.28, sea, beach))
+
+
+class TerrainWindow(object):
+    """
+    A window of map data, as seen by a view.
+
+    The window covers the cells with indices origin[X]: origin[X] + shape[X]
+    and origin[Y]: origin[Y] + shape[Y] (wrapping around the map edges), and
+    holds patches, positions, normals and colours for them, stored row by row
+    (Y first) just like Map.slice() orders them. Coordinates are unwrapped,
+    so that they are continuous across the map edges.
+
+    The arrays are basic slices of the wrap-padded map data (see
+    Map.padded), so moving the window copies nothing. They are read-only.
+
+    coarse() gives the same data for cells merged stride x stride, from the
+    coarse levels of the map (see Map.level).
+    """
+
+    X = U = 0
+    Y = V = 1
+    Z = W = 2
+
+    def __init__(self, world):
+        self._world = world
+        self._origin = None
+        self._shape = None
+        self._start = None
+        self._shift = None
+        self._patches = None
+        self._positions = None
+        self._normals = None
+        self._colours = None
+
+    @property
+    def origin(self):
+        return self._origin
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def size(self):
+        return self._shape[self.X] * self._shape[self.Y]
+
+    @property
+    def patches(self):
+        return self._patches
+
+    @property
+    def positions(self):
+        return self._positions
+
+    @property
+    def normals(self):
+        return self._normals
+
+    @property
+    def colours(self):
+        return self._colours
+
+    def invalidate(self):
+        self._origin = None
+
+    def update(self, origin, shape):
+        """
+        Moves the window to origin, resizing it to shape if needed.
+        """
+
+        if origin == self._origin and shape == self._shape:
+            return
+
+        world = self._world
+        world.ensure_padding(shape)
+        padding = world.padding
+        xsize, ysize = world.shape
+
+        x0 = origin[self.X] + padding[self.X]
+        y0 = origin[self.Y] + padding[self.Y]
+
+        # Views far outside the map (the player is normally kept on it) are
+        # wrapped back in, and their coordinates shifted back out:
+        shift = world.policy.zeros(3)
+        if x0 < 0 or x0 + shape[self.X] > xsize + 2 * padding[self.X]:
+            centre = origin[self.X] + shape[self.X] // 2
+            shift[self.X] = centre - centre % xsize
+            x0 -= int(shift[self.X])
+        if y0 < 0 or y0 + shape[self.Y] > ysize + 2 * padding[self.Y]:
+            centre = origin[self.Y] + shape[self.Y] // 2
+            shift[self.Y] = centre - centre % ysize
+            y0 -= int(shift[self.Y])
+
+        window = (slice(y0, y0 + shape[self.Y]), slice(x0, x0 + shape[self.X]))
+        patches, positions, normals, colours = world.padded
+
+        self._origin = origin
+        self._shape = shape
+        self._start = (x0, y0)
+        self._shift = shift
+        self._patches = patches[window]
+        self._positions = positions[window]
+        self._normals = normals[window]
+        self._colours = colours[window]
+
+        if shift.any():
+            self._patches = self._patches + shift
+            self._positions = self._positions + shift
+
+        self._lock()
+
+    def coarse(self, stride):
+        """
+        Returns the blocks of stride x stride cells that lie entirely in the
+        window, as the window index (x, y) of the first cell of the first
+        block, and the positions, normals and colours of the blocks (stored
+        row by row, like the window data).
+
+        Blocks are aligned to map coordinates, so they stay put as the window
+        moves (views wrapped back onto the map may be aligned differently).
+        """
+
+        (x0, y0), positions, normals, colours = self._world.level(stride)
+        xstart, ystart = self._start
+
+        bx = (x0 - xstart) % stride
+        by = (y0 - ystart) % stride
+        nbx = (self._shape[self.X] - bx) // stride
+        nby = (self._shape[self.Y] - by) // stride
+        cx = (xstart + bx - x0) // stride
+        cy = (ystart + by - y0) // stride
+
+        blocks = (slice(cy, cy + nby), slice(cx, cx + nbx))
+        positions = positions[blocks]
+        if self._shift.any():
+            positions = positions + self._shift
+
+        return (bx, by), positions, normals[blocks], colours[blocks]
+
+    def _lock(self):
+        for array in (self._patches, self._positions, self._normals,
+                      self._colours):
+            array.flags.writeable = False
+
+
+class SynthesisedTerrainWindow(TerrainWindow):
+    """
+    A TerrainWindow for maps that keep no padded arrays (see CompactMap):
+    window data is synthesised with the map's per-cell accessors whenever
+    the window moves.
+    """
+
+    def update(self, origin, shape):
+        """
+        Moves the window to origin, resizing it to shape if needed.
+        """
+
+        if origin == self._origin and shape == self._shape:
+            return
+
+        world = self._world
+
+        x = np.arange(origin[self.X], origin[self.X] + shape[self.X])
+        y = np.arange(origin[self.Y], origin[self.Y] + shape[self.Y])
+        x = x[np.newaxis, :]
+        y = y[:, np.newaxis]
+
+        self._origin = origin
+        self._shape = shape
+        self._patches = world.patches_at(x, y)
+        self._positions = world.positions_at(x, y)
+        self._normals = world.normals_at(x, y)
+        self._colours = world.colours_at(x, y)
+
+        self._lock()
+
+    def coarse(self, stride):
+        """
+        Returns blocks like TerrainWindow.coarse, but averaged from the
+        window data, since there are no precomputed levels to read.
+        """
+
+        bx = -self._origin[self.X] % stride
+        by = -self._origin[self.Y] % stride
+        nbx = (self._shape[self.X] - bx) // stride
+        nby = (self._shape[self.Y] - by) // stride
+
+        def blocks(array):
+            array = array[by: by + nby * stride, bx: bx + nbx * stride]
+            return array.reshape((nby, stride, nbx, stride) +
+                                 array.shape[2:]).mean(3).mean(1)
+
+        return ((bx, by), blocks(self._positions),
+                unit(blocks(self._normals)),
+                self._world.policy.colours(blocks(self._colours)))
+
+
+class MapCache(object):
+    """
+    An on-disk cache of the data a Map derives from a heightmap file.
+
+    Arrays are stored as .npy files, in one directory per heightmap file
+    contents, sealevel and flat_sea:
+
+        <directory>/<map name>.<key>/<array name>.npy
+
+    and loaded memory-mapped and read-only, so that a cached map costs no
+    computation and is only read from disk as it is used. directory defaults
+    to "cache" next to the heightmap file.
+
+    Arrays are cached per dtype policy, that of the map (see dtypes).
+
+    Bump VERSION whenever the way map data is derived changes.
+    """
+
+    VERSION = 2
+
+    def __init__(self, filename, directory=None, policy=None):
+        if directory is None:
+            directory = os.path.join(os.path.dirname(filename), "cache")
+
+        self._directory = directory
+        self._policy = dtypes.default() if policy is None else policy
+        self._name = os.path.splitext(os.path.basename(filename))[0]
+
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+
+        self._digest = digest.hexdigest()
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def path(self, sealevel, flat_sea):
+        """
+        Returns the directory for the given sealevel and flat_sea.
+        """
+
+        key = hashlib.sha1("{0} {1} {2!r} {3} {4}".format(
+            self._digest, self.VERSION, float(sealevel), bool(flat_sea),
+            self._policy.name).encode()).hexdigest()[: 16]
+
+        return os.path.join(self._directory, "{0}.{1}".format(self._name,
+                                                              key))
+
+    def load(self, sealevel, flat_sea, names):
+        """
+        Returns a list of the named arrays, or None unless all are cached.
+        """
+
+        path = self.path(sealevel, flat_sea)
+
+        try:
+            return [np.load(os.path.join(path, "{0}.npy".format(name)),
+                            mmap_mode='r') for name in names]
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, sealevel, flat_sea, names, arrays):
+        """
+        Stores the named arrays. Every file is written under a temporary name
+        first and then renamed, so that readers never see partial files.
+        Failure to write (a read-only installation, say) is not an error.
+        """
+
+        path = self.path(sealevel, flat_sea)
+
+        try:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+            for name, array in zip(names, arrays):
+                filename = os.path.join(path, "{0}.npy".format(name))
+                temporary = "{0}.{1}.tmp".format(filename, os.getpid())
+                with open(temporary, 'wb') as f:
+                    np.save(f, array)
+                os.rename(temporary, filename)
+        except (IOError, OSError):
+            print("could not write map cache {0}".format(path))
 
 
 class Map(object):
@@ -22,13 +366,34 @@ class Map(object):
     * colours:
         - per-patch colour triplet, randomly assigned based on distance to
           sealevel and such.
+
+    Besides the native arrays (indexed [x, y]), the map keeps wrap-padded
+    copies of patches, positions, normals and colours (indexed [y, x]),
+    extended on every side by half the largest view, with coordinates
+    continued across the edges. Any view of the map is then a basic slice
+    of those, with no index arithmetic and no rewrapping of coordinates.
+
+    If cache is given (True for the default directory, or a directory), all
+    of the above is stored in a MapCache on first load, and memory-mapped
+    from there on later loads. Cached arrays are read-only.
+
+    For level of detail (see lod_lists), coarse levels of the padded
+    positions, normals and colours, with cells merged 2 x 2, 4 x 4 and so
+    on, are built on first use.
+
+    Patches, positions and normals are geometry arrays of policy, and
+    colours have its colour type.
     """
 
     X = U = 0
     Y = V = 1
     Z = W = 2
 
-    def __init__(self, filename='demodata.npy', sealevel=0, flat_sea=True):
+    def __init__(self, filename='demodata.npy', sealevel=0, flat_sea=True,
+                 max_view=(24, 24), cache=None, policy=None):
+        self._policy = dtypes.default() if policy is None else policy
+        self._windows = weakref.WeakSet()
+
         if filename is None:
             self._raw_map = np.zeros([10, 13])
         else:
@@ -38,21 +403,23 @@ class Map(object):
 
         self._flat_sea = flat_sea
 
-        self._make_patches()
+        self._max_view = tuple(max_view)
 
-        self._size = self._patches.size / 12
+        if cache and filename is not None:
+            self._cache = MapCache(filename, None if cache is True else cache,
+                                   self._policy)
+        else:
+            self._cache = None
 
-        self._calc_positions()
+        self._build()
 
-        if self._flat_sea:
-            self._flood()
+        self._size = self._patches.size / 12
 
-        self._calc_normals()
+        self._window = self.new_window()
 
-        self._colourise()
-
-        if not self._flat_sea:
-            self._flood()
+    @property
+    def policy(self):
+        return self._policy
 
     @property
     def sealevel(self):
@@ -70,12 +437,113 @@ class Map(object):
     def raw_map(self):
         return self._raw_map
 
-    def slice(self, position, view):
+    @property
+    def heightfield(self):
+        """
+        Returns the raw map as corner heights: heightfield[x, y] is the
+        height of the corner at x - 0.5, y - 0.5.
+        """
+
+        return self._raw_map[:, :: -1].T
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def padding(self):
+        return self._padding
+
+    @property
+    def padded(self):
+        """
+        Returns the wrap-padded patches, positions, normals and colours.
+        """
+
+        return (self._padded_patches, self._padded_positions,
+                self._padded_normals, self._padded_colours)
+
+    def ensure_padding(self, view):
+        """
+        Makes sure views of size view fit in the padded arrays.
+        """
+
+        if (view[self.X] > self._max_view[self.X] or
+                view[self.Y] > self._max_view[self.Y]):
+            self._max_view = (max(view[self.X], self._max_view[self.X]),
+                              max(view[self.Y], self._max_view[self.Y]))
+            self._pad()
+
+    def level(self, stride):
+        """
+        Returns the coarse level of the padded data with stride x stride
+        cells merged into one: the padded index (x, y) of the first merged
+        cell, and the merged positions, normals and colours (indexed [y, x]).
+        Merged cells are aligned to multiples of stride in map coordinates.
+        """
+
+        if stride not in self._levels:
+            px, py = self._padding
+            x0 = px % stride
+            y0 = py % stride
+
+            def merge(array):
+                ny = (array.shape[0] - y0) // stride
+                nx = (array.shape[1] - x0) // stride
+                array = array[y0: y0 + ny * stride, x0: x0 + nx * stride]
+                return array.reshape((ny, stride, nx, stride) +
+                                     array.shape[2:]).mean(3).mean(1)
+
+            self._levels[stride] = (
+                (x0, y0), merge(self._padded_positions),
+                unit(merge(self._padded_normals)),
+                self._policy.colours(merge(self._padded_colours)))
+
+        return self._levels[stride]
+
+    def bounds(self, position, view):
+        """
+        Returns the (inclusive) integer index bounds of the cells in view.
+        """
+
         xmin = np.round(position[self.X] - view[self.X] * 0.5).astype(int)
         xmax = np.round(position[self.X] + view[self.X] * 0.5).astype(int)
         ymin = np.round(position[self.Y] - view[self.Y] * 0.5).astype(int)
         ymax = np.round(position[self.Y] + view[self.Y] * 0.5).astype(int)
 
+        return xmin, xmax, ymin, ymax
+
+    def new_window(self):
+        """
+        Returns a new TerrainWindow on the map, invalidated along with the
+        map's own whenever the map data changes. Views that move on their
+        own (such as those of different threads) each need a window.
+        """
+
+        window = TerrainWindow(self)
+        self._windows.add(window)
+
+        return window
+
+    def window(self, position, view, window=None):
+        """
+        Returns the TerrainWindow (by default, the map's own) for the cells
+        in view, updating it first if the view has moved.
+        """
+
+        if window is None:
+            window = self._window
+
+        xmin, xmax, ymin, ymax = self.bounds(position, view)
+
+        window.update((int(xmin), int(ymin)),
+                      (int(xmax - xmin + 1), int(ymax - ymin + 1)))
+
+        return window
+
+    def slice(self, position, view):
+        xmin, xmax, ymin, ymax = self.bounds(position, view)
+
         Y, X = np.mgrid[ymin: ymax + 1, xmin: xmax + 1]
 
         X %= self.shape[self.X]
@@ -89,18 +557,21 @@ class Map(object):
         dimensions decided by view.
         """
 
-        X, Y = self.slice(position, view)
+        the_slice = self.window(position, view).patches.copy()
+
+        return self.impose_view_limits(position, view, the_slice)
+
+    def impose_view_limits(self, position, view, the_slice):
+        """
+        Cuts the outermost patches of a slice (in place) at the edges of the
+        view, interpolating heights along the cut.
+        """
 
         xmin = position[self.X] - view[self.X] * 0.5
         xmax = position[self.X] + view[self.X] * 0.5
         ymin = position[self.Y] - view[self.Y] * 0.5
         ymax = position[self.Y] + view[self.Y] * 0.5
 
-        the_slice = self._patches[X, Y, :]
-
-        # Fix periodicity:
-        the_slice = self.fix_view(position, view, the_slice)
-
         # Impose view limits:
         the_slice[:, 0, (3, 0), self.Z] += ((the_slice[:, 0, (2, 1), self.Z] -
                                              the_slice[:, 0, (3, 0), self.Z])
@@ -135,99 +606,191 @@ class Map(object):
         """
         Returns a slice of the map positions centered on position, with
         dimensions decided by view.
-        """
-
-        X, Y = self.slice(position, view)
-
-        the_slice = self._positions[X, Y, :]
 
-        # Fix periodicity:
-        the_slice = self.fix_view(position, view, the_slice)
+        The slice is a read-only view of the padded map data.
+        """
 
-        return the_slice
+        return self.window(position, view).positions
 
     def patch_positions_slice(self, position, view):
         """
         Returns a slice of the patch positions centered on position, with
         dimensions decided by view.
-        """
-
-        X, Y = self.slice(position, view)
-
-        the_slice = self._positions[X, Y, :]
 
-        # Fix periodicity:
-        the_slice = self.fix_view(position, view, the_slice)
+        The slice is a read-only view of the padded map data.
+        """
 
-        return the_slice
+        return self.window(position, view).positions
 
     def normals_slice(self, position, view):
         """
         Returns a slice of the map normals centered on position, with
         dimensions decided by view.
-        """
 
-        X, Y = self.slice(position, view)
+        The slice is a read-only view of the padded map data.
+        """
 
-        return self._normals[X, Y, :]
+        return self.window(position, view).normals
 
     def colours_slice(self, position, view):
         """
         Returns a slice of the map colours centered on position, with
         dimensions decided by view.
-        """
 
-        X, Y = self.slice(position, view)
+        The slice is a read-only view of the padded map data.
+        """
 
-        return self._colours[X, Y, :]
+        return self.window(position, view).colours
 
-    def patches_list(self, position, view):
+    def patches_list(self, position, view, window=None):
         """
         Returns patches as a list for use in Camera etc.
         """
 
-        the_slice = self.patches_slice(position, view)
-        size = the_slice.shape[0] * the_slice.shape[1]
+        window = self.window(position, view, window)
+        the_slice = self.impose_view_limits(position, view,
+                                            window.patches.copy())
 
-        return the_slice.reshape((size, 4, 3))
+        return the_slice.reshape((window.size, 4, 3))
 
-    def map_positions_list(self, position, view):
+    def map_positions_list(self, position, view, window=None):
         """
         Returns positions as a list for use in Camera etc.
         """
 
-        the_slice = self.map_positions_slice(position, view)
-        size = the_slice.shape[0] * the_slice.shape[1]
+        window = self.window(position, view, window)
 
-        return the_slice.reshape((size, 3))
+        return window.positions.reshape((window.size, 3))
 
-    def patch_positions_list(self, position, view):
+    def patch_positions_list(self, position, view, window=None):
         """
         Returns positions as a list for use in Camera etc.
+
+        The list is read-only.
         """
 
-        the_slice = self.patch_positions_slice(position, view)
-        size = the_slice.shape[0] * the_slice.shape[1]
+        window = self.window(position, view, window)
 
-        return the_slice.reshape((size, 3))
+        return window.positions.reshape((window.size, 3))
 
-    def normals_list(self, position, view):
+    def normals_list(self, position, view, window=None):
         """
         Returns normals as a list for use in Camera etc.
+
+        The list is read-only.
         """
-        the_slice = self.normals_slice(position, view)
-        size = the_slice.shape[0] * the_slice.shape[1]
+        window = self.window(position, view, window)
 
-        return the_slice.reshape((size, 3))
+        return window.normals.reshape((window.size, 3))
 
-    def colours_list(self, position, view):
+    def colours_list(self, position, view, window=None):
         """
         Returns colours as a list for use in Camera etc.
-        """
-        the_slice = self.colours_slice(position, view)
-        size = the_slice.shape[0] * the_slice.shape[1]
 
-        return the_slice.reshape((size, 4))
+        The list is read-only.
+        """
+        window = self.window(position, view, window)
+
+        return window.colours.reshape((window.size, 4))
+
+    def lod_lists(self, position, view, viewer, distances, direction=None,
+                  window=None):
+        """
+        Returns patches, positions, normals and colours as lists, like the
+        *_list methods, but with level of detail: cells further than
+        distances[0] from viewer are merged 2 x 2, those further than
+        distances[1] 4 x 4 and so on. Distances are measured along direction
+        if given (such as the view direction of a camera, which makes them
+        view depths), and in the xy-plane otherwise.
+
+        Merged cells are aligned blocks from the coarse levels (see
+        TerrainWindow.coarse), and the outermost cells, which are cut at the
+        view limits, are never merged. Seams between levels are closed by
+        moving the corners of finer cells that lie on the edge of a coarser
+        cell onto that edge.
+        """
+
+        window = self.window(position, view, window)
+        patches = self.impose_view_limits(position, view,
+                                          window.patches.copy())
+        ny, nx = patches.shape[: 2]
+
+        # Corner grid of the window:
+        xs = np.r_[patches[0, :, 0, self.X], patches[0, -1, 1, self.X]]
+        ys = np.r_[patches[:, 0, 0, self.Y], patches[-1, 0, 3, self.Y]]
+        heights = np.empty((ny + 1, nx + 1), dtype=patches.dtype)
+        heights[: -1, : -1] = patches[..., 0, self.Z]
+        heights[: -1, -1] = patches[:, -1, 1, self.Z]
+        heights[-1, : -1] = patches[-1, :, 3, self.Z]
+        heights[-1, -1] = patches[-1, -1, 2, self.Z]
+
+        # Level of every cell, and the blocks that are far enough to merge:
+        levels = np.zeros((ny, nx), dtype=int)
+        blocks = []
+        for level, distance in enumerate(distances, 1):
+            stride = 2 ** level
+            (bx, by), positions, normals, colours = window.coarse(stride)
+            j, i = np.mgrid[by: by + positions.shape[0] * stride: stride,
+                            bx: bx + positions.shape[1] * stride: stride]
+            if direction is None:
+                far = np.sqrt(((positions[..., : 2] -
+                                viewer[: 2]) ** 2).sum(-1)) >= distance
+            else:
+                far = ((positions - viewer) * direction).sum(-1) >= distance
+            far = np.where((i >= 1) * (i + stride < nx) *
+                           (j >= 1) * (j + stride < ny) * far)
+            j = j[far]
+            i = i[far]
+            for dj in range(stride):
+                for di in range(stride):
+                    levels[j + dj, i + di] = level
+            blocks.append((stride, j, i, positions[far], normals[far],
+                           colours[far]))
+
+        # Keep the blocks that no coarser block covers:
+        for n, (stride, j, i, positions, normals, colours) in enumerate(
+                blocks):
+            keep = levels[j, i] == n + 1
+            blocks[n] = (stride, j[keep], i[keep], positions[keep],
+                         normals[keep], colours[keep])
+
+        # Close seams, coarsest first, so that corners of finer blocks on
+        # coarser edges are in place before the finer edges are done:
+        for stride, j, i, _, _, _ in reversed(blocks):
+            for k in range(1, stride):
+                t = k / float(stride)
+                for (ja, ia), (jb, ib), (dj, di) in (
+                        ((j, i), (j, i + stride), (0, k)),
+                        ((j + stride, i), (j + stride, i + stride), (0, k)),
+                        ((j, i), (j + stride, i), (k, 0)),
+                        ((j, i + stride), (j + stride, i + stride), (k, 0))):
+                    heights[ja + dj, ia + di] = (
+                        (1 - t) * heights[ja, ia] + t * heights[jb, ib])
+
+        # Assemble single cells and blocks:
+        j, i = np.where(levels == 0)
+        cells = [(1, j, i)]
+        positions = [window.positions[j, i]]
+        normals = [window.normals[j, i]]
+        colours = [window.colours[j, i]]
+        for block in blocks:
+            cells.append(block[: 3])
+            positions.append(block[3])
+            normals.append(block[4])
+            colours.append(block[5])
+
+        patches = []
+        for stride, j, i in cells:
+            corners_i = i[:, np.newaxis] + CORNERS_X * stride
+            corners_j = j[:, np.newaxis] + CORNERS_Y * stride
+            cell_patches = self._policy.empty((i.size, 4, 3))
+            cell_patches[..., self.X] = xs[corners_i]
+            cell_patches[..., self.Y] = ys[corners_j]
+            cell_patches[..., self.Z] = heights[corners_j, corners_i]
+            patches.append(cell_patches)
+
+        return (np.concatenate(patches), np.concatenate(positions),
+                np.concatenate(normals), np.concatenate(colours))
 
     @property
     def patches(self):
@@ -267,6 +830,120 @@ class Map(object):
         """
         return self._colours
 
+    @property
+    def heights(self):
+        """
+        Returns the heights of all cells (the Z of map_positions).
+        """
+
+        return self._positions[:, :, self.Z]
+
+    @property
+    def max_height(self):
+        return self.heights.max()
+
+    def _unwrap(self, x, y):
+        """
+        Returns integer cell indices x and y (which may lie outside the map)
+        broadcast together and wrapped onto the map, and the coordinate
+        shifts that undo the wrapping.
+        """
+
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=int),
+                                   np.asarray(y, dtype=int))
+
+        xwrapped = x % self.shape[self.X]
+        ywrapped = y % self.shape[self.Y]
+
+        shift = self._policy.zeros(x.shape + (3,))
+        shift[..., self.X] = x - xwrapped
+        shift[..., self.Y] = y - ywrapped
+
+        return xwrapped, ywrapped, shift
+
+    def patches_at(self, x, y):
+        """
+        Returns the patches of cells x, y (integer arrays that broadcast
+        together), with coordinates continued across the map edges for cells
+        outside the map.
+        """
+
+        x, y, shift = self._unwrap(x, y)
+
+        return self._patches[x, y] + shift[..., np.newaxis, :]
+
+    def positions_at(self, x, y):
+        """
+        Returns the positions of cells x, y, like patches_at.
+        """
+
+        x, y, shift = self._unwrap(x, y)
+
+        return self._positions[x, y] + shift
+
+    def heights_at(self, x, y):
+        """
+        Returns the heights of cells x, y (wrapped onto the map).
+        """
+
+        return self._positions[np.asarray(x, dtype=int) % self.shape[self.X],
+                               np.asarray(y, dtype=int) % self.shape[self.Y],
+                               self.Z]
+
+    def normals_at(self, x, y):
+        """
+        Returns the normals of cells x, y (wrapped onto the map).
+        """
+
+        return self._normals[np.asarray(x, dtype=int) % self.shape[self.X],
+                             np.asarray(y, dtype=int) % self.shape[self.Y]]
+
+    def surface_at(self, x, y):
+        """
+        Returns the heights and normals of the terrain (flooded, as it is
+        drawn) at points x, y (wrapped onto the map), interpolated bilinearly
+        between the corners of the cells they are in. Unlike heights_at and
+        normals_at, these are continuous across cells.
+        """
+
+        heightfield = self.heightfield
+        xsize, ysize = self.shape
+
+        u = np.asarray(x) + 0.5
+        v = np.asarray(y) + 0.5
+        i = np.floor(u)
+        j = np.floor(v)
+        fx = self._policy.geometry(u - i)
+        fy = self._policy.geometry(v - j)
+        i = i.astype(int) % xsize
+        j = j.astype(int) % ysize
+
+        sealevel = self._policy.float_type()(self._sealevel)
+        h00 = np.maximum(heightfield[i, j], sealevel)
+        h10 = np.maximum(heightfield[i + 1, j], sealevel)
+        h01 = np.maximum(heightfield[i, j + 1], sealevel)
+        h11 = np.maximum(heightfield[i + 1, j + 1], sealevel)
+
+        dx = (h10 - h00) * (1 - fy) + (h11 - h01) * fy
+        dy = (h01 - h00) * (1 - fx) + (h11 - h10) * fx
+
+        heights = h00 + dx * fx + (h01 - h00) * fy
+
+        normals = self._policy.empty(heights.shape + (3,))
+        normals[..., self.X] = -dx
+        normals[..., self.Y] = -dy
+        normals[..., self.Z] = 1
+
+        return heights, unit(normals)
+
+    def colours_at(self, x, y):
+        """
+        Returns the colours of cells x, y (wrapped onto the map).
+        """
+
+        return self._colours[np.asarray(x, dtype=int) % self.shape[self.X],
+                             np.asarray(y, dtype=int) % self.shape[self.Y]]
+
     def fix_view(self, position, view, positions):
         xmin = position[self.X] - view[self.X] * 0.5
         xmax = position[self.X] + view[self.X] * 0.5
@@ -314,6 +991,96 @@ class Map(object):
                         (positions[:, self.Y] >= ymin) *
                         (positions[:, self.Y] <= ymax))[0]
 
+    def _pad(self):
+        """
+        Builds the wrap-padded copies of the map data, stored row by row (Y
+        first) and padded by half the largest view plus two cells, so that
+        views centered anywhere on the map fit.
+        """
+
+        xsize, ysize = self.shape
+        px = self._max_view[self.X] // 2 + 2
+        py = self._max_view[self.Y] // 2 + 2
+
+        self._padding = (px, py)
+        self._levels = {}
+
+        for window in self._windows:
+            window.invalidate()
+
+        names = ["padded_{0}_{1}x{2}".format(name, px, py) for name in
+                 ("patches", "positions", "normals", "colours")]
+        arrays = self._load_cached(names)
+
+        if arrays is not None:
+            (self._padded_patches, self._padded_positions,
+             self._padded_normals, self._padded_colours) = arrays
+            return
+
+        x = np.arange(-px, xsize + px)
+        y = np.arange(-py, ysize + py)
+        X = x % xsize
+        Y = y % ysize
+
+        shift = np.zeros((y.size, x.size, 3), dtype=self._patches.dtype)
+        shift[..., self.X] = (x - X)[np.newaxis, :]
+        shift[..., self.Y] = (y - Y)[:, np.newaxis]
+
+        window = (X[np.newaxis, :], Y[:, np.newaxis])
+
+        self._padded_patches = self._patches[window] + shift[:, :,
+                                                             np.newaxis, :]
+        self._padded_positions = self._positions[window] + shift
+        self._padded_normals = self._normals[window]
+        self._padded_colours = self._colours[window]
+
+        for array in self.padded:
+            array.flags.writeable = False
+
+        self._save_cached(names, self.padded)
+
+    def _build(self):
+        """
+        Derives patches, positions, normals and colours from the raw map, or
+        loads them from the cache, and pads them.
+        """
+
+        names = ["patches", "positions", "normals", "colours"]
+        arrays = self._load_cached(names)
+
+        if arrays is not None:
+            (self._patches, self._positions, self._normals,
+             self._colours) = arrays
+        else:
+            self._make_patches()
+
+            self._calc_positions()
+
+            if self._flat_sea:
+                self._flood()
+
+            self._calc_normals()
+
+            self._colourise()
+
+            if not self._flat_sea:
+                self._flood()
+
+            self._save_cached(names, (self._patches, self._positions,
+                                      self._normals, self._colours))
+
+        self._pad()
+
+    def _load_cached(self, names):
+        if self._cache is None:
+            return None
+
+        return self._cache.load(self._sealevel, self._flat_sea, names)
+
+    def _save_cached(self, names, arrays):
+        if self._cache is not None:
+            self._cache.save(self._sealevel, self._flat_sea, names, arrays)
+
     def _make_patches(self):
         """
         Create patches made up of four points (corners of squares in the
@@ -322,17 +1089,17 @@ class Map(object):
 
         # Ininitalise patches:
         xsize, ysize = self.shape
-        patches = np.zeros((xsize, ysize, 4, 3))
+        patches = self._policy.zeros((xsize, ysize, 4, 3))
+
+        # Corner indices of all patches, shaped (xsize, 1, 4) and
+        # (1, ysize, 4):
+        xinds = np.arange(xsize)[:, np.newaxis, np.newaxis] + CORNERS_X
+        yinds = np.arange(ysize)[np.newaxis, :, np.newaxis] + CORNERS_Y
 
         # Fill patches:
-        # These for-loops could be removed:
-        for x in range(xsize):
-            for y in range(ysize):
-                xinds = np.array([x, x + 1, x + 1, x])
-                yinds = np.array([y, y, y + 1, y + 1])
-                patches[x, y, :, 0] = xinds - 0.5
-                patches[x, y, :, 1] = yinds - 0.5
-                patches[x, y, :, 2] = self.raw_map[yinds, xsize - xinds]
+        patches[..., 0] = xinds - 0.5
+        patches[..., 1] = yinds - 0.5
+        patches[..., 2] = self.raw_map[yinds, xsize - xinds]
 
         self._patches = patches
 
@@ -343,27 +1110,21 @@ class Map(object):
 
         Currently debug wit just green and blue.
         """
-        colours = np.zeros([self._patches.shape[0], self._patches.shape[1], 4],
-                           dtype=int)
-
-        max_height = self._positions[:, :, self.Z].max()
-        for x in range(colours.shape[self.X]):
-            for y in range(colours.shape[self.Y]):
-                height = self._positions[x, y, self.Z]
-                if height > self.sealevel + 0.14:
-                    colours[x, y] = np.array([51, 102, 26, 255]) + np.array(
-                        [np.random.random() * height / max_height,
-                         np.random.random() * (1 - height / max_height),
-                         0, 0]) * 153
-                elif height < self.sealevel - 0.28:
-                    colours[x, y] = np.array([1, 1, 77, 255])
-                else:
-                    colours[x, y] = np.array([204, 153, 51, 255]) + np.array(
-                        [np.random.random() * height / max_height,
-                         np.random.random() * height / max_height,
-                         0, 0]) * 153
+        heights = self.heights
+        noise = self._colour_random().random_sample(heights.shape + (2,))
 
-        self._colours = colours
+        self._colours = self._policy.colours(
+            cell_colours(heights, heights.max(), noise, self.sealevel))
+
+    def _colour_random(self):
+        """
+        Returns the random generator for colour noise. It is seeded by the
+        raw map (as float32), so that colours are a function of the map
+        alone, and the same whether cached or not, or for a CompactMap.
+        """
+
+        return np.random.RandomState(zlib.crc32(np.ascontiguousarray(
+            self._raw_map, dtype=np.float32).tobytes()) & 0xffffffff)
 
     def _calc_positions(self):
         """
@@ -379,17 +1140,7 @@ class Map(object):
         gives a nice noise effect (hopefully).
         """
 
-        normals = np.zeros([self._patches.shape[0], self._patches.shape[1], 3])
-
-        v0s = self._patches[:, :, 1] - self._patches[:, :, 0]
-        v1s = self._patches[:, :, 2] - self._patches[:, :, 1]
-        v2s = self._patches[:, :, 3] - self._patches[:, :, 2]
-        v3s = self._patches[:, :, 0] - self._patches[:, :, 3]
-
-        normals = np.cross(v0s, v1s + v3s) + np.cross(v2s, v3s - v1s)
-        normals /= np.sqrt((normals ** 2).sum(-1))[:, :, np.newaxis]
-
-        self._normals = normals
+        self._normals = patch_normals(self._patches)
 
     def _flood(self):
         """
@@ -413,19 +1164,266 @@ class Map(object):
 
         self._flat_sea = flat_sea
 
-        self._make_patches()
+        self._build()
 
-        self._calc_positions()
 
-        if self.flat_sea:
-            self._flood()
+class CompactMap(Map):
+    """
+    A Map that stores little more than its heightfield, for maps far larger
+    than the bundled ones.
 
-        self._calc_normals()
+    Where Map keeps patches, positions, normals, colours and padded copies of
+    all of them (some 200 to 400 bytes per cell, depending on the dtypes
+    policy), CompactMap keeps:
+    * the raw map, as float32, which doubles as the heightfield of patch
+      corners.
 
-        self._colourise()
+    * colours:
+        - RGB per cell, as uint8.
 
-        if not self.flat_sea:
-            self._flood()
+    * normals (if packed_normals):
+        - per cell, packed into int8. Otherwise they are computed from the
+          corners when asked for.
+
+    That is 7 (or 10) bytes per cell. Patches and positions are synthesised
+    from the heightfield for the cells asked for only: those in view (see
+    SynthesisedTerrainWindow), or those under objects (see Map.patches_at
+    and friends). Flooding is applied on the fly too.
+
+    The native-shape properties (patches, map_positions and so on)
+    synthesise the whole map, and are meant for small maps only.
+    """
+
+    BLOCK = 1 << 16
+
+    def __init__(self, filename='demodata.npy', sealevel=0, flat_sea=True,
+                 packed_normals=False, policy=None):
+        self._policy = dtypes.default() if policy is None else policy
+        self._windows = weakref.WeakSet()
+
+        if filename is None:
+            self._raw_map = np.zeros([10, 13], dtype=np.float32)
+        else:
+            self._raw_map = np.ascontiguousarray(np.load(filename),
+                                                 dtype=np.float32)
+
+        self._sealevel = sealevel
+
+        self._flat_sea = flat_sea
+
+        self._packed_normals = packed_normals
+
+        self._cache = None
+
+        self._window = self.new_window()
+
+        self._build()
+
+        self._size = self.shape[self.X] * self.shape[self.Y]
+
+    @property
+    def packed_normals(self):
+        return self._packed_normals
+
+    @property
+    def padding(self):
+        return None
+
+    @property
+    def padded(self):
+        return None
+
+    def new_window(self):
+        window = SynthesisedTerrainWindow(self)
+        self._windows.add(window)
+
+        return window
+
+    def ensure_padding(self, view):
+        pass
+
+    @property
+    def heights(self):
+        """
+        Returns the heights of all cells.
+        """
+
+        h = self._heightfield
+
+        return 0.25 * (h[: -1, : -1] + h[1:, : -1] + h[1:, 1:] + h[: -1, 1:])
+
+    @property
+    def max_height(self):
+        return self._max_height
+
+    @property
+    def patches(self):
+        """
+        Returns patches in native shape, synthesised for the whole map.
+        """
+
+        return self.patches_at(*self._cells())
+
+    @property
+    def map_positions(self):
+        """
+        Returns positions in native shape, synthesised for the whole map.
+        """
+
+        return self.positions_at(*self._cells())
+
+    @property
+    def patch_positions(self):
+        """
+        Returns positions in native shape, synthesised for the whole map.
+        """
+
+        return self.positions_at(*self._cells())
+
+    @property
+    def normals(self):
+        """
+        Returns normals in native shape, synthesised for the whole map.
+        """
+
+        return self.normals_at(*self._cells())
+
+    @property
+    def colours(self):
+        """
+        Returns colours in native shape, synthesised for the whole map.
+        """
+
+        return self.colours_at(*self._cells())
+
+    def _cells(self, start=0, stop=None):
+        """
+        Returns index arrays of all cells of columns start: stop.
+        """
+
+        if stop is None:
+            stop = self.shape[self.X]
+
+        return (np.arange(start, stop)[:, np.newaxis],
+                np.arange(self.shape[self.Y])[np.newaxis, :])
+
+    def _blocks(self):
+        """
+        Yields index arrays for blocks of columns of about BLOCK cells.
+        """
+
+        xsize, ysize = self.shape
+        step = max(1, self.BLOCK // ysize)
+
+        for start in range(0, xsize, step):
+            yield self._cells(start, min(start + step, xsize))
+
+    def _corner_heights(self, x, y, flooded=True):
+        """
+        Returns the heights of the corners of cells x, y, flooded or not.
+        """
+
+        x = np.asarray(x, dtype=int) % self.shape[self.X]
+        y = np.asarray(y, dtype=int) % self.shape[self.Y]
+
+        heights = self._heightfield[x[..., np.newaxis] + CORNERS_X,
+                                    y[..., np.newaxis] + CORNERS_Y]
+
+        if flooded:
+            heights = np.maximum(heights, np.float32(self._sealevel))
+
+        return heights
+
+    def _synthesise(self, x, y, flooded=True):
+        """
+        Returns patches of cells x, y, with coordinates continued across the
+        map edges.
+        """
+
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=int),
+                                   np.asarray(y, dtype=int))
+
+        patches = self._policy.empty(x.shape + (4, 3))
+        patches[..., self.X] = x[..., np.newaxis] + CORNERS_X - 0.5
+        patches[..., self.Y] = y[..., np.newaxis] + CORNERS_Y - 0.5
+        patches[..., self.Z] = self._corner_heights(x, y, flooded)
+
+        return patches
+
+    def patches_at(self, x, y):
+        return self._synthesise(x, y)
+
+    def positions_at(self, x, y):
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=int),
+                                   np.asarray(y, dtype=int))
+
+        positions = self._policy.empty(x.shape + (3,))
+        positions[..., self.X] = x
+        positions[..., self.Y] = y
+        positions[..., self.Z] = self.heights_at(x, y)
+
+        return positions
+
+    def heights_at(self, x, y):
+        # Positions are calculated before flooding, see Map:
+        return self._corner_heights(x, y, flooded=False).mean(-1)
+
+    def normals_at(self, x, y):
+        if self._packed_normals:
+            return self._normals[
+                np.asarray(x, dtype=int) % self.shape[self.X],
+                np.asarray(y, dtype=int) % self.shape[self.Y]] / \
+                self._policy.float_type()(127)
+
+        # Normals are calculated after flooding only for a flat sea, see Map:
+        return patch_normals(self._synthesise(x, y, self._flat_sea))
+
+    def colours_at(self, x, y):
+        rgb = self._colours[np.asarray(x, dtype=int) % self.shape[self.X],
+                            np.asarray(y, dtype=int) % self.shape[self.Y]]
+
+        colours = np.empty(rgb.shape[: -1] + (4,),
+                           dtype=self._policy.colour_type())
+        colours[..., : 3] = rgb
+        colours[..., 3] = 255
+
+        return colours
+
+    def _build(self):
+        """
+        Derives colours (and normals) from the heightfield, a block of
+        columns at a time, so that no full-size temporary arrays are needed.
+        """
+
+        xsize, ysize = self.shape
+
+        # heightfield[x, y] is the height of the corner at x - 0.5, y - 0.5:
+        self._heightfield = self._raw_map[:, :: -1].T
+
+        self._max_height = max(self.heights_at(x, y).max()
+                               for x, y in self._blocks())
+
+        random = self._colour_random()
+        self._colours = np.empty((xsize, ysize, 3), dtype=np.uint8)
+        if self._packed_normals:
+            self._normals = np.empty((xsize, ysize, 3), dtype=np.int8)
+        else:
+            self._normals = None
+
+        for x, y in self._blocks():
+            columns = slice(x[0, 0], x[-1, 0] + 1)
+            heights = self.heights_at(x, y)
+            noise = random.random_sample(heights.shape + (2,))
+            self._colours[columns] = np.clip(cell_colours(
+                heights, self._max_height, noise, self.sealevel)[..., : 3],
+                0, 255)
+
+            if self._packed_normals:
+                self._normals[columns] = np.round(patch_normals(
+                    self._synthesise(x, y, self._flat_sea)) * 127)
+
+        for window in self._windows:
+            window.invalidate()
 
 
 class TriMap(object):
@@ -657,22 +1655,23 @@ class TriMap(object):
         xsize, ysize = self.shape
         patches = np.zeros((xsize, ysize, 4, 3, 3))
 
-        # Fill patches:
-        # This for-looops could and should be removed:
-        for x in range(xsize):
-            for y in range(ysize):
-                xinds = np.array([x, x + 1, x + 1, x, x])
-                yinds = np.array([y, y, y + 1, y + 1, y])
-                xcentre = xinds[: 4].mean() - 0.5
-                ycentre = yinds[: 4].mean() - 0.5
-                zcentre = self.raw_map[yinds, xsize - xinds].mean()
-                for n in range(4):
-                    patches[x, y, n, :, 0] = np.r_[xinds[n: n + 2] - 0.5,
-                                                   xcentre]
-                    patches[x, y, n, :, 1] = np.r_[yinds[n: n + 2] - 0.5,
-                                                   ycentre]
-                    patches[x, y, n, :, 2] = np.r_[self.raw_map[
-                        yinds[n: n + 2], xsize - xinds[n: n + 2]], zcentre]
+        # Corner indices of all squares, going round and back to the first
+        # corner, shaped (xsize, ysize, 5):
+        xinds = np.arange(xsize)[:, np.newaxis, np.newaxis] + np.array(
+            [0, 1, 1, 0, 0]) + np.zeros((1, ysize, 1), dtype=int)
+        yinds = np.arange(ysize)[np.newaxis, :, np.newaxis] + np.array(
+            [0, 0, 1, 1, 0]) + np.zeros((xsize, 1, 1), dtype=int)
+        zs = self.raw_map[yinds, xsize - xinds]
+
+        # Fill patches, triangle n going from corner n to corner n + 1 and
+        # on to the centre:
+        for k, values in enumerate((xinds - 0.5, yinds - 0.5, zs)):
+            patches[..., 0, k] = values[..., : 4]
+            patches[..., 1, k] = values[..., 1:]
+
+        patches[..., 2, 0] = (xinds[..., : 4].mean(-1) - 0.5)[..., np.newaxis]
+        patches[..., 2, 1] = (yinds[..., : 4].mean(-1) - 0.5)[..., np.newaxis]
+        patches[..., 2, 2] = zs.mean(-1)[..., np.newaxis]
 
         self._patches = patches
 
@@ -686,12 +1685,9 @@ class TriMap(object):
         colours = np.zeros([self._patches.shape[0], self._patches.shape[1], 4,
                             4], dtype=int)
 
-        for x in range(colours.shape[0]):
-            for y in range(colours.shape[1]):
-                if self._map_positions[x, y, 2] > self.sealevel:
-                    colours[x, y, :] = np.array([102, 153, 0, 255])
-                else:
-                    colours[x, y, :] = np.array([0, 0, 77, 255])
+        land = self._map_positions[:, :, 2] > self.sealevel
+        colours[land] = np.array([102, 153, 0, 255])
+        colours[~land] = np.array([0, 0, 77, 255])
 
         self._colours = colours
 
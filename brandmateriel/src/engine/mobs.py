@@ -1,5 +1,7 @@
 import numpy as np
 
+from .triDobjects import rotations
+
 
 class Movable(object):
     """
@@ -10,6 +12,11 @@ class Movable(object):
     Y = V = 1
     Z = W = 2
 
+    # Above CEILING, climbing is damped; hitting the ground faster than
+    # CRASH_SPEED makes the model explode:
+    CEILING = 36.0
+    CRASH_SPEED = 2.5
+
     def __init__(self, model, inertia=1.0, gravity=1.0, friction=1.0,
                  position=np.array([0.0, 0.0, 0.0]),
                  velocity=np.array([0.0, 0.0, 0.0]),
@@ -20,11 +27,12 @@ class Movable(object):
         self._inertia = inertia
         self._gravity = gravity
         self._friction = friction
-        self._position = position
-        self._velocity = velocity
-        self._acceleration = acceleration
+        # Copies, so that objects don't share (default) arrays:
+        self._position = np.array(position, dtype=float)
+        self._velocity = np.array(velocity, dtype=float)
+        self._acceleration = np.array(acceleration, dtype=float)
 
-        self._model.position = position
+        self._model.position = self._position
         self._model.yaw = yaw
         self._model.pitch = pitch
         self._model.roll = roll
@@ -120,25 +128,26 @@ class Movable(object):
         self.acceleration = force / self.inertia
 
     def bounce(self, world):
-        normal = world.normals[int(self.position[self.X]),
-                               int(self.position[self.Y])]
+        normal = world.normals_at(int(self.position[self.X]),
+                                  int(self.position[self.Y]))
         self._velocity -= 2.0 * np.dot(self._velocity, normal) * normal
 
     def impose_boundary_conditions(self, world):
         self.position[self.X] %= world.shape[self.X]
         self.position[self.Y] %= world.shape[self.Y]
 
-        height = max(0, world.patches[int(self.position[self.X]),
-                                      int(self.position[self.Y]),
-                                      :, self.Z].max())
+        height = max(0, world.patches_at(int(self.position[self.X]),
+                                         int(self.position[self.Y]))[
+                                             :, self.Z].max())
 
         if self.model.bounding_box[0, self.Z] < height:
             self.position[self.Z] += (height -
                                       self.model.bounding_box[0, self.Z])
             self.bounce(world)
-            if abs(self.velocity[self.Z]) > 2.5:
+            if abs(self.velocity[self.Z]) > self.CRASH_SPEED:
                 self.model.exploding = True
-        elif self.position[self.Z] > 36.0 and self.velocity[self.Z] > 0:
+        elif (self.position[self.Z] > self.CEILING and
+              self.velocity[self.Z] > 0):
             self.velocity[self.Z] *= 0.9
             if self.acceleration[self.Z] > 0:
                 self.acceleration[self.Z] = 0.0
@@ -149,6 +158,9 @@ class Player(Movable):
     Player object has health, fuel etc.
     """
 
+    # Acceleration of the thruster (per unit of inertia):
+    THRUST = 20.0
+
     def __init__(self, model, inertia=1.0, gravity=5.0, friction=0.5,
                  position=np.array([0.0, 0.0, 0.0]),
                  velocity=np.array([0.0, 0.0, 0.0]),
@@ -160,11 +172,12 @@ class Player(Movable):
         self._inertia = inertia
         self._gravity = gravity
         self._friction = friction
-        self._position = position
-        self._velocity = velocity
-        self._acceleration = acceleration
+        # Copies, so that objects don't share (default) arrays:
+        self._position = np.array(position, dtype=float)
+        self._velocity = np.array(velocity, dtype=float)
+        self._acceleration = np.array(acceleration, dtype=float)
 
-        self._model.position = position
+        self._model.position = self._position
         self._model.yaw = yaw
         self._model.pitch = pitch
         self._model.roll = roll
@@ -290,9 +303,9 @@ class Player(Movable):
 
     def apply_forces(self):
         force = (self.friction + self.gravity * self.inertia +
-                 20 * (
+                 self.THRUST * (
                      self.thrust
-                     and self.position[self.Z] < 36.0
+                     and self.position[self.Z] < self.CEILING
                      and not self.model.exploding
                  ) *
                  self.model.orientation[self.W])
@@ -301,3 +314,157 @@ class Player(Movable):
 
         if self.model.exploding:
             self.model.explode()
+
+
+class Landers(object):
+    """
+    Landers is a batch of N independent players on the same Map, all with
+    the same model, stepped in lockstep with array operations rather than
+    one Player at a time. It follows the physics of Player (and Movable)
+    step for step, for training controllers and tuning physics constants on
+    many players at once.
+
+    State is kept in arrays, one entry (or row) per lander:
+    * positions, velocities, accelerations:
+        - shaped (N, 3).
+
+    * yaws, pitches, rolls:
+        - the orientations, as for TriD objects.
+
+    * thrust:
+        - whether the thruster is engaged; set by the controller.
+
+    * exploding:
+        - whether the lander has crashed. Crashed landers keep moving, but
+          without thrust.
+
+    inertia, gravity and friction, and THRUST, CEILING and CRASH_SPEED,
+    may be scalars or arrays of N values, one per lander.
+    """
+
+    X = U = 0
+    Y = V = 1
+    Z = W = 2
+
+    THRUST = Player.THRUST
+    CEILING = Player.CEILING
+    CRASH_SPEED = Player.CRASH_SPEED
+
+    def __init__(self, model, N, inertia=1.0, gravity=5.0, friction=0.5,
+                 positions=np.array([0.0, 0.0, 0.0]), yaws=0.0, pitches=0.0,
+                 rolls=0.0):
+        self._model = model
+        self._number = N
+
+        self._inertia = inertia
+        self._gravity = gravity
+        self._friction = friction
+
+        self.positions = np.zeros((N, 3)) + positions
+        self.velocities = np.zeros((N, 3))
+        self.accelerations = np.zeros((N, 3))
+
+        self.yaws = np.zeros(N) + yaws
+        self.pitches = np.zeros(N) + pitches
+        self.rolls = np.zeros(N) + rolls
+
+        self.thrust = np.zeros(N, dtype=bool)
+        self.exploding = np.zeros(N, dtype=bool)
+
+        # Patch positions of the model, scaled but not rotated, for the
+        # bottoms of the bounding boxes:
+        self._points = model._scale * model._positions
+
+    @property
+    def model(self):
+        return self._model
+
+    @property
+    def number(self):
+        return self._number
+
+    @property
+    def inertia(self):
+        return self._inertia
+
+    @inertia.setter
+    def inertia(self, val):
+        self._inertia = val
+
+    @property
+    def gravity(self):
+        return self._gravity
+
+    @gravity.setter
+    def gravity(self, val):
+        self._gravity = val
+
+    @property
+    def friction(self):
+        return self._friction
+
+    @friction.setter
+    def friction(self, val):
+        self._friction = val
+
+    @property
+    def orientations(self):
+        """
+        Returns the orientations (U, V and W rows) of all landers, shaped
+        (N, 3, 3).
+        """
+
+        return rotations(self.yaws, self.pitches, self.rolls)
+
+    def _column(self, val):
+        return np.asarray(val, dtype=float)[..., np.newaxis]
+
+    def apply_forces(self):
+        thrusting = (self.thrust * (self.positions[:, self.Z] < self.CEILING) *
+                     ~self.exploding)
+
+        forces = (-self._column(self._friction) * self.velocities +
+                  self._column(self._gravity * self._inertia) *
+                  np.array([0.0, 0.0, -1.0]) +
+                  self._column(self.THRUST * thrusting) *
+                  self.orientations[:, self.W])
+
+        self.accelerations = forces / self._column(self._inertia)
+
+    def move(self, dt=0.03125):
+        self.apply_forces()
+        self.velocities += self.accelerations * dt
+        self.positions += self.velocities * dt
+
+    def impose_boundary_conditions(self, world):
+        positions = self.positions
+        velocities = self.velocities
+
+        positions[:, self.X] %= world.shape[self.X]
+        positions[:, self.Y] %= world.shape[self.Y]
+
+        x = positions[:, self.X].astype(int)
+        y = positions[:, self.Y].astype(int)
+
+        heights = np.maximum(0, world.patches_at(x, y)[..., self.Z].max(-1))
+
+        bottoms = (positions[:, self.Z] + np.einsum(
+            "pk,nk->np", self._points,
+            self.orientations[..., self.Z]).min(-1))
+
+        hit = bottoms < heights
+        positions[hit, self.Z] += (heights - bottoms)[hit]
+
+        normals = world.normals_at(x[hit], y[hit])
+        velocities[hit] -= 2.0 * (velocities[hit] * normals).sum(
+            -1)[:, np.newaxis] * normals
+
+        crash_speed = np.broadcast_to(self.CRASH_SPEED, hit.shape)[hit]
+        self.exploding[np.where(hit)[0][
+            np.abs(velocities[hit, self.Z]) > crash_speed]] = True
+
+        ceiling = ~hit * (positions[:, self.Z] > self.CEILING) * (
+            velocities[:, self.Z] > 0)
+        velocities[ceiling, self.Z] *= 0.9
+        self.accelerations[ceiling * (self.accelerations[:, self.Z] > 0),
+                           self.Z] = 0.0
@@ -1,10 +1,31 @@
+import copy
+
 import numpy as np
+from . import dtypes
 from . import triDobjects as tD
 
 
 class Particle(object):
     """
     Parent class for particles.
+
+    A Particle describes a kind of particle: how it moves, how long it lives,
+    what it looks like and what happens when it hits the ground. The
+    particles themselves are kept by a ParticleEngine.
+
+    * fade:
+        - RGBA factors the colour of a particle is multiplied by every step
+          (or every fade_step seconds, see ParticleEngine).
+
+    * shatters:
+        - if True, the particle is removed when it hits the ground, and turns
+          into shrapnel. Otherwise it bounces, keeping elasticity of its
+          normal velocity, and losing ground_friction of the velocity along
+          the ground.
+
+    * tumble:
+        - the number of steps through the rotation bank (see
+          rotation_bank) a particle takes every move.
     """
 
     X = U = 0
@@ -13,7 +34,8 @@ class Particle(object):
 
     def __init__(self, inertia=1.0, gravity=1.0, friction=0.05, size=0.03,
                  colour=np.array([255, 255, 153, 255]), lifetime=2.0,
-                 elasticity=1.0):
+                 elasticity=1.0, fade=np.array([1.0, 1.0, 1.0, 1.0]),
+                 shatters=False, ground_friction=0.0, tumble=0):
 
         self._inertia = inertia
         self._gravity = gravity
@@ -22,7 +44,10 @@ class Particle(object):
         self._colour = colour
         self._lifetime = lifetime
         self._elasticity = elasticity
-        self._model = tD.TriD(scale=size)
+        self._fade = fade
+        self._shatters = shatters
+        self._ground_friction = ground_friction
+        self._tumble = tumble
 
     @property
     def inertia(self):
@@ -49,11 +74,8 @@ class Particle(object):
         self._friction = val
 
     @property
-    def patches(self):
-        self._model.yaw = np.random.random() * 2 * np.pi
-        self._model.pitch = np.random.random() * 2 * np.pi
-        self._model.roll = np.random.random() * 2 * np.pi
-        return self._model.patches
+    def size(self):
+        return self._size
 
     @property
     def colour(self):
@@ -79,436 +101,668 @@ class Particle(object):
     def elasticity(self, val):
         self._elasticity = val
 
+    @property
+    def fade(self):
+        return self._fade
+
+    @fade.setter
+    def fade(self, val):
+        self._fade = val
+
+    @property
+    def shatters(self):
+        return self._shatters
+
+    @shatters.setter
+    def shatters(self, val):
+        self._shatters = val
+
+    @property
+    def ground_friction(self):
+        return self._ground_friction
+
+    @ground_friction.setter
+    def ground_friction(self, val):
+        self._ground_friction = val
+
+    @property
+    def tumble(self):
+        return self._tumble
+
+    @tumble.setter
+    def tumble(self, val):
+        self._tumble = val
+
+
+SHOT = 0
+SHRAPNEL = 1
+EXHAUST = 2
+STAR = 3
+
+NAMES = ("shots", "shrapnel", "exhaust", "stars")
+
+
+def default_kinds():
+    """
+    Returns the kinds of particles of the game, in the order SHOT, SHRAPNEL,
+    EXHAUST, STAR.
+    """
+
+    return [
+        Particle(shatters=True, tumble=1),
+        Particle(friction=0.5, lifetime=0.5, elasticity=np.sqrt(3) * 0.5,
+                 fade=np.array([1.3, 1.3, 1.3, 1.0]), ground_friction=0.25,
+                 tumble=3),
+        Particle(friction=0.125, lifetime=1.618, elasticity=0.25,
+                 colour=np.array([255, 255, 153, 255]),
+                 fade=np.array([0.96, 0.92, 0.88, 1.0]), shatters=True,
+                 tumble=1),
+        Particle(gravity=0.0, friction=0.0, lifetime=np.inf, elasticity=0.0,
+                 colour=np.array([204, 102, 204, 255])),
+    ]
+
+
+def rotation_bank(random, K=64, policy=None):
+    """
+    Returns the patches of K rotated (unit size) tetrahedra, shaped
+    (K, 4, 3, 3).
+
+    The rotations are random, but follow each other: yaw, pitch and roll
+    each go round a whole number of times (at random phases) over the bank,
+    so that stepping through it, and round, tumbles a tetrahedron smoothly.
+    random is the numpy.random.Generator to draw them from, and the bank
+    is a geometry array of policy.
+    """
+
+    if policy is None:
+        policy = dtypes.default()
+
+    model = tD.TriD(scale=1.0)
+
+    phases = random.random(3) * 2 * np.pi
+    turns = random.integers(1, 4, 3) * random.choice([-1, 1], 3)
 
-class Particles(object):
+    bank = policy.empty((K, 4, 3, 3))
+    for k in range(K):
+        (model.yaw, model.pitch, model.roll) = (phases + turns * 2 * np.pi *
+                                                k / float(K))
+        bank[k] = model.patches
+
+    return bank
+
+
+class ParticleEngine(object):
+    """
+    The ParticleEngine keeps the particles of all kinds in one pool of
+    arrays:
+    * positions, velocities:
+        - in world coordinates.
+
+    * previous:
+        - positions before the last move, wrapped along with positions, for
+          drawing particles in between (see interpolated).
+
+    * ages:
+        - time since spawning; particles older than the lifetime of their
+          kind are removed.
+
+    * colours:
+        - RGBA colour of each particle, kept as floats since they fade.
+
+    * types:
+        - the kind of each particle, an index into kinds.
+
+    * rotations:
+        - the orientation of each particle, an index into a bank of rotated
+          models (see rotation_bank), picked at random when it is added and
+          advanced by the tumble of its kind every move.
+
+    * asleep:
+        - whether a particle has come to rest on the ground. Sleeping
+          particles still age and fade, but are not moved or collided until
+          woken by wake or disturb.
+
+    The arrays start at capacity and double whenever added particles would
+    not fit; removed particles are replaced by live ones from the end.
+
+    If fade_step is given, fades are per fade_step seconds rather than per
+    move, so that colours fade at the same rate whatever the step size.
+
+    Particles that bounce off the ground with less than sleep_speed fall
+    asleep.
+
+    All random numbers (rotations, ages, colours and scattering of added
+    particles) are drawn from random, a numpy.random.Generator; give a
+    seeded one to make particles reproducible.
+
+    All arrays, colours included, are geometry arrays of policy.
+
+    Stars (particles of kind STAR) don't live on the map, but in a box
+    around the focus given to impose_boundary_conditions, between
+    star_heights.
+    """
 
     X = U = 0
     Y = V = 1
     Z = W = 2
 
-    def __init__(self, particle=Particle()):
-        self._particle = particle
-        self._positions = np.empty((0, 3))
-        self._velocities = np.empty((0, 3))
-        self._accelerations = np.empty((0, 3))
-        self._ages = np.empty((0))
-        self._colours = np.empty((0, 4))
-        self._visible = True
+    def __init__(self, random, kinds=None, capacity=256, sleep_speed=0.25,
+                 rotations=64, fade_step=None, policy=None):
+        if kinds is None:
+            kinds = default_kinds()
+
+        if policy is None:
+            policy = dtypes.default()
+
+        self._kinds = kinds
+        self._sleep_speed = sleep_speed
+        self._fade_step = fade_step
+        self._visible = np.ones(len(kinds), dtype=bool)
+        self._star_box = np.ones(2)
+        self._star_heights = (21.0, 42.0)
+        self._random = random
+        self._policy = policy
+        self._bank = rotation_bank(random, rotations, policy)
+
+        self.update_kinds()
+
+        self._size = 0
+        self._allocate(capacity)
+
+    def update_kinds(self):
+        """
+        Gathers the parameters of the kinds into arrays indexed by kind. Call
+        this after changing a kind.
+        """
+
+        kinds = self._kinds
+        geometry = self._policy.geometry
+        self._gravities = geometry([k.gravity for k in kinds])
+        self._frictions = geometry([k.friction / k.inertia for k in kinds])
+        self._lifetimes = geometry([k.lifetime for k in kinds])
+        self._elasticities = geometry([k.elasticity for k in kinds])
+        self._sizes = geometry([k.size for k in kinds])
+        self._fades = geometry([k.fade for k in kinds])
+        self._shatters = np.array([k.shatters for k in kinds])
+        self._ground_frictions = geometry([k.ground_friction for k in kinds])
+        self._tumbles = np.array([k.tumble for k in kinds], dtype=np.int16)
+
+    def _allocate(self, capacity):
+        policy = self._policy
+        positions = policy.zeros((capacity, 3))
+        previous = policy.zeros((capacity, 3))
+        velocities = policy.zeros((capacity, 3))
+        ages = policy.zeros(capacity)
+        colours = policy.zeros((capacity, 4))
+        types = np.zeros(capacity, dtype=np.int8)
+        rotations = np.zeros(capacity, dtype=np.int16)
+        asleep = np.zeros(capacity, dtype=bool)
+
+        if self._size:
+            positions[: self._size] = self._positions[: self._size]
+            previous[: self._size] = self._previous[: self._size]
+            velocities[: self._size] = self._velocities[: self._size]
+            ages[: self._size] = self._ages[: self._size]
+            colours[: self._size] = self._colours[: self._size]
+            types[: self._size] = self._types[: self._size]
+            rotations[: self._size] = self._rotations[: self._size]
+            asleep[: self._size] = self._asleep[: self._size]
+
+        self._positions = positions
+        self._previous = previous
+        self._velocities = velocities
+        self._ages = ages
+        self._colours = colours
+        self._types = types
+        self._rotations = rotations
+        self._asleep = asleep
 
     @property
-    def particle(self):
-        return self._particle
-
-    @particle.setter
-    def particle(self, val):
-        self._particle = val
+    def kinds(self):
+        return self._kinds
 
     @property
-    def number(self):
-        return self.positions.shape[0]
+    def policy(self):
+        return self._policy
 
     @property
-    def visible(self):
-        return self._visible
+    def capacity(self):
+        return self._types.shape[0]
 
-    @visible.setter
-    def visible(self, val):
-        self._visible = val
+    @property
+    def number(self):
+        return self._size
 
     @property
     def positions(self):
-        return self._positions
-
-    @positions.setter
-    def positions(self, val):
-        self._positions = val
+        return self._positions[: self._size]
 
     @property
-    def patch_positions(self):
-        return (self.positions[:, np.newaxis, np.newaxis, :] +
-                self.particle.patches[np.newaxis, :, :, :]).mean(-2).reshape(
-                    self.number * 4, 3)
+    def previous(self):
+        return self._previous[: self._size]
 
     @property
-    def patches(self):
-        return (self.positions[:, np.newaxis, np.newaxis, :] +
-                self.particle.patches[np.newaxis, :, :, :]).reshape(
-                    self.number * 4, 3, 3)
+    def velocities(self):
+        return self._velocities[: self._size]
 
     @property
-    def velocities(self):
-        return self._velocities
+    def ages(self):
+        return self._ages[: self._size]
 
-    @velocities.setter
-    def velocities(self, val):
-        self._velocities = val
+    @property
+    def colours(self):
+        return self._colours[: self._size]
 
     @property
-    def accelerations(self):
-        return self._accelerations
+    def types(self):
+        return self._types[: self._size]
 
-    @accelerations.setter
-    def accelerations(self, val):
-        self._accelerations = val
+    @property
+    def rotations(self):
+        return self._rotations[: self._size]
 
     @property
-    def ages(self):
-        return self._ages
+    def bank(self):
+        return self._bank
 
-    @ages.setter
-    def ages(self, val):
-        self._ages = val
+    @property
+    def asleep(self):
+        return self._asleep[: self._size]
 
     @property
-    def colours(self):
-        return self._colours
+    def sleep_speed(self):
+        return self._sleep_speed
 
-    @colours.setter
-    def colours(self, val):
-        self._colours = val
+    @sleep_speed.setter
+    def sleep_speed(self, val):
+        self._sleep_speed = val
 
     @property
-    def patch_colours(self):
-        return (self._colours * np.ones((4, 1, 1))).reshape(self.number * 4, 4)
+    def star_box(self):
+        return self._star_box
 
-    def move(self, dt=0.03125):
-        self.apply_forces()
-        self.velocities += self.accelerations * dt
-        self.positions += self.velocities * dt
-        self.ages += dt
-
-    def apply_forces(self):
-        forces = (-self.particle.friction * self.velocities +
-                  self.particle.gravity * self.particle.inertia)
-        self.accelerations = forces / self.particle.inertia
-
-    def bounce(self, world, n):
-        normals = world.normals[int(self.positions[n, self.X]),
-                                int(self.positions[n, self.Y])]
-        self.velocities[n] -= ((1 + self.particle.elasticity) * normals *
-                               (self.velocities[n] *
-                                normals).sum(-1)[..., np.newaxis])
-
-    def impose_boundary_conditions(self, world):
-        self.cull_aged()
-
-        self.positions[:, self.X] %= world.shape[self.X]
-        self.positions[:, self.Y] %= world.shape[self.Y]
-
-        heights = world.map_positions[
-            self.positions[:, self.X].astype(int),
-            self.positions[:, self.Y].astype(int), self.Z]
-
-        heights = np.where(heights < 0, 0, heights)
-
-        bouncers = np.where(self.positions[:, self.Z] < heights)[0]
-        for n in bouncers:
-            self.positions[n, self.Z] = heights[n]
-            self.bounce(world, n)
-
-    def add_particle(self, position, velocity, acceleration, age=0.0,
-                     colour=None):
-        self.positions = np.r_[self.positions, position[np.newaxis]]
-        self.velocities = np.r_[self.velocities, velocity[np.newaxis]]
-        self.accelerations = np.r_[self.accelerations,
-                                   acceleration[np.newaxis]]
-        self.ages = np.r_[self.ages, age]
-        if colour is None:
-            self.colours = np.r_[self.colours,
-                                 self.particle.colour[np.newaxis]]
-        else:
-            self.colours = np.r_[self.colours, colour[np.newaxis]]
-
-    def delete_particle(self, n):
-        indices = np.r_[np.arange(n), np.arange(self.positions.shape[0])]
-        self.positions = self.positions[indices]
-        self.velocities = self.velocities[indices]
-        self.accelerations = self.accelerations[indices]
-        self.ages = self.ages[indices]
-        self.colours = self.colours[indices]
-
-    def delete_particles(self, to_delete):
-        indices = np.setdiff1d(np.arange(self.number), to_delete)
-        self.positions = self.positions[indices]
-        self.velocities = self.velocities[indices]
-        self.accelerations = self.accelerations[indices]
-        self.ages = self.ages[indices]
-        self.colours = self.colours[indices]
-
-    def cull_aged(self):
-        if (self.ages > self.particle.lifetime).any():
-            indices = np.where(self.ages > self.particle.lifetime)[0]
-            self.delete_particles(indices)
-
-
-class Shots(Particles):
-    def __init__(self, particle=Particle()):
-        self._particle = particle
-        self._positions = np.empty((0, 3))
-        self._velocities = np.empty((0, 3))
-        self._accelerations = np.empty((0, 3))
-        self._ages = np.empty((0))
-        self._colours = np.empty((0, 4))
-        self._visible = True
-
-    def impose_boundary_conditions(self, world):
-        self.cull_aged()
-
-        if self.number:
-            self.positions[:, self.X] %= world.shape[self.X]
-            self.positions[:, self.Y] %= world.shape[self.Y]
-
-            heights = world.map_positions[
-                self.positions[:, self.X].astype(int),
-                self.positions[:, self.Y].astype(int), self.Z]
-
-            heights = np.where(heights < 0, 0, heights)
-
-            bouncers = np.where(self.positions[:, self.Z] < heights)[0]
-            if bouncers.size:
-                positions = self.positions[bouncers]
-
-                velocities = self.velocities[bouncers]
-
-                mixing = (
-                    np.random.random(bouncers.shape)
-                    * (positions[:, self.Z] <= 0)
-                )
-                colours = np.clip(world.colours[
-                    self.positions[bouncers, self.X].astype(int),
-                    self.positions[bouncers, self.Y].astype(int),
-                ] + 64 * mixing[:, np.newaxis], 0, 255)
-
-                self.delete_particles(bouncers)
-
-                return positions, velocities, colours
-
-    def cull_aged(self):
-        if self.ages[0] > self.particle.lifetime:
-            self.positions = self.positions[1:]
-            self.velocities = self.velocities[1:]
-            self.accelerations = self.accelerations[1:]
-            self.ages = self.ages[1:]
-            self.colours = self.colours[1:]
-
-
-class Shrapnel(Particles):
-    def __init__(self, particle=Particle(friction=0.5, lifetime=0.5,
-                                         elasticity=np.sqrt(3) * 0.5)):
-        self._particle = particle
-        self._positions = np.empty((0, 3))
-        self._velocities = np.empty((0, 3))
-        self._accelerations = np.empty((0, 3))
-        self._ages = np.empty((0))
-        self._colours = np.empty((0, 4))
-        self._visible = True
-
-    def add_particles(self, positions, velocities, colours):
-        N = np.random.randint(5, 8)
+    @property
+    def star_heights(self):
+        return self._star_heights
+
+    def counts(self):
+        """
+        Returns the number of particles of each kind.
+        """
+
+        return np.bincount(self.types, minlength=len(self._kinds))
+
+    def indices(self, kind):
+        return np.where(self.types == kind)[0]
+
+    def youngest(self, kind):
+        """
+        Returns the age of the youngest particle of kind, or infinity if
+        there are none.
+        """
+
+        ages = self.ages[self.types == kind]
+
+        return ages.min() if ages.size else np.inf
+
+    def is_visible(self, kind):
+        return self._visible[kind]
+
+    def set_visible(self, kind, val):
+        self._visible[kind] = val
+
+    def shown(self):
+        """
+        Returns the indices of the particles of visible kinds.
+        """
+
+        return np.where(self._visible[self.types])[0]
+
+    def reserve(self, n):
+        """
+        Makes sure there is room for n more particles.
+        """
+
+        if self._size + n > self.capacity:
+            capacity = self.capacity
+            while self._size + n > capacity:
+                capacity *= 2
+            self._allocate(capacity)
+
+    def add(self, kind, positions, velocities, ages=None, colours=None):
+        """
+        Adds particles of kind with positions and velocities of shape (N, 3).
+        ages default to zero, colours to the colour of the kind.
+        """
+
+        n = len(positions)
+
+        if not n:
+            return
+
+        self.reserve(n)
+
+        the_slice = slice(self._size, self._size + n)
+
+        self._positions[the_slice] = positions
+        self._previous[the_slice] = self._positions[the_slice]
+        self._velocities[the_slice] = velocities
+        self._ages[the_slice] = 0.0 if ages is None else ages
+        self._colours[the_slice] = (self._kinds[kind].colour
+                                    if colours is None else colours)
+        self._types[the_slice] = kind
+        self._rotations[the_slice] = self._random.integers(
+            0, self._bank.shape[0], n)
+        self._asleep[the_slice] = False
+
+        self._size += n
+
+    def add_shot(self, position, velocity):
+        self.add(SHOT, position[np.newaxis], velocity[np.newaxis])
+
+    def add_exhaust(self, positions, velocities):
+        """
+        Adds exhaust with random ages and colours.
+        """
+
+        N = positions.shape[0]
+        kind = self._kinds[EXHAUST]
+
+        self.add(EXHAUST, positions, velocities,
+                 self._random.random(N) * kind.lifetime,
+                 (0.5 + self._random.random((N, 4))) *
+                 kind.colour[np.newaxis])
+
+    def add_shrapnel(self, positions, velocities, colours):
+        """
+        Adds 5 to 7 pieces of shrapnel for every position, with velocities
+        and colours scattered around the given ones.
+        """
+
+        N = self._random.integers(5, 8)
         positions = (positions + np.zeros(np.r_[N, positions.shape])).reshape(
             (positions.shape[0] * N, 3))
-        velocities = (velocities * (1.0 / np.sqrt(N)) + 2 * (np.random.random(
-            np.r_[N, velocities.shape]) - 0.5)).reshape(
+        velocities = (velocities * (1.0 / np.sqrt(N)) + 2 * (
+            self._random.random(np.r_[N, velocities.shape]) - 0.5)).reshape(
                 (velocities.shape[0] * N, 3))
-        colours = (colours * (0.125 + 0.5 * np.random.random(
+        colours = (colours * (0.125 + 0.5 * self._random.random(
             np.r_[N, colours.shape]))).reshape((colours.shape[0] * N, 4))
 
-        self._positions = np.r_[self._positions, positions]
-        self._colours = np.r_[self._colours, colours]
-        self._velocities = np.r_[self._velocities, velocities]
-        self._accelerations = np.r_[self._accelerations,
-                                    np.zeros(positions.shape)]
-        self._ages = np.r_[self._ages, np.random.random(positions.shape[0]) *
-                           self.particle.lifetime]
+        self.add(SHRAPNEL, positions, velocities,
+                 self._random.random(positions.shape[0]) *
+                 self._kinds[SHRAPNEL].lifetime, colours)
 
-    def move(self, dt=0.03125):
-        self.apply_forces()
-        self.velocities += self.accelerations * dt
-        self.positions += self.velocities * dt
-        self.ages += dt
-        self.colours *= np.array([1.3, 1.3, 1.3, 1.0])
-
-
-class Exhaust(Particles):
-    def __init__(self, particle=Particle(
-            friction=0.125, lifetime=1.618, elasticity=0.25,
-            colour=np.array([255, 255, 153, 255]))):
-        self._particle = particle
-        self._positions = np.empty((0, 3))
-        self._velocities = np.empty((0, 3))
-        self._accelerations = np.empty((0, 3))
-        self._ages = np.empty((0))
-        self._colours = np.empty((0, 4))
-        self._visible = True
-
-    def impose_boundary_conditions(self, world):
-        self.cull_aged()
-
-        if self.number:
-            self.positions[:, self.X] %= world.shape[self.X]
-            self.positions[:, self.Y] %= world.shape[self.Y]
-
-            heights = world.map_positions[
-                self.positions[:, self.X].astype(int),
-                self.positions[:, self.Y].astype(int), self.Z]
-
-            heights = np.where(heights < 0, 0, heights)
-
-            bouncers = np.where(self.positions[:, self.Z] < heights)[0]
-            if bouncers.size:
-                positions = self.positions[bouncers]
-
-                velocities = self.velocities[bouncers]
-
-                mixing = (
-                    np.random.random(bouncers.shape)
-                    * (positions[:, self.Z] <= 0)
-                )
-                colours = np.clip(world.colours[
-                    self.positions[bouncers, self.X].astype(int),
-                    self.positions[bouncers, self.Y].astype(int),
-                ] + 64 * mixing[:, np.newaxis], 0, 255)
-
-                self.delete_particles(bouncers)
-
-                return positions, velocities, colours
-
-    def add_particle(self, position, velocity, acceleration, age=0.0,
-                     colour=None):
-        self.positions = np.r_[self.positions, position[np.newaxis]]
-        self.velocities = np.r_[self.velocities, velocity[np.newaxis]]
-        self.accelerations = np.r_[self.accelerations,
-                                   acceleration[np.newaxis]]
-        self.ages = np.r_[self.ages, age + np.random.random() *
-                          self.particle.lifetime]
-
-        if colour is None:
-            self.colours = np.r_[self.colours,
-                                 (0.5 + np.random.random((1, 4))) *
-                                 self.particle.colour[np.newaxis]]
-        else:
-            self.colours = np.r_[self.colours, colour[np.newaxis]]
+    def add_stars(self, N, box, mean_speed=1.0, min_height=21.0,
+                  max_height=42.0):
+        """
+        Adds N stars spread over box (in the xy-plane) and between min_height
+        and max_height, which become the star box and heights.
+        """
 
-    def add_particles(self, positions, velocities, accelerations,
-                      colours=None):
-        N = positions.shape[0]
-        self.positions = np.r_[self.positions, positions]
-        self.velocities = np.r_[self.velocities, velocities]
-        self.accelerations = np.r_[self.accelerations, accelerations]
-        self.ages = np.r_[self.ages, np.random.random(N) *
-                          self.particle.lifetime]
-
-        if colours is None:
-            self.colours = np.r_[self.colours,
-                                 (0.5 + np.random.random((N, 4))) *
-                                 self.particle.colour[np.newaxis]]
-        else:
-            self.colours = np.r_[self.colours, colours]
+        self._star_box = np.array(box[: 2], dtype=float)
+        self._star_heights = (min_height, max_height)
 
-    def move(self, dt=0.03125):
-        self.apply_forces()
-        self.velocities += self.accelerations * dt
-        self.positions += self.velocities * dt
-        self.ages += dt
-        self.colours *= np.array([0.96, 0.92, 0.88, 1.0])
+        x = self._random.random(N) * box[self.X]
+        y = self._random.random(N) * box[self.Y]
+        z = self._random.random(N) * (max_height - min_height) + min_height
 
+        self.add(STAR, np.c_[x, y, z],
+                 (2.0 * self._random.random((N, 3)) - 1.0) * mean_speed,
+                 colours=(0.5 + self._random.random((N, 4))) *
+                 self._kinds[STAR].colour[np.newaxis])
 
-class Stars(Particles):
-    """
-    TODO:
-        * Change  world --> view.
-        * map coordinates to ((0, 0); (view.max())
-        * make a return, which offsets by player X and Y.
-    """
+    def snapshot(self):
+        """
+        Returns a copy of the engine holding copies of the particles alive
+        now, which draws (see shown, interpolated, patches and so on) as
+        this one does now, however this one moves on. Its particle arrays
+        are read-only: a snapshot is for drawing, say on another thread,
+        not for moving.
+        """
 
-    def __init__(self, N, view, mean_speed=1.0, min_height=21.0,
-                 max_height=42.0, particle=Particle(
-            gravity=0.0, friction=0.0, lifetime=1.618, elasticity=0.0,
-            colour=np.array([204, 102, 204, 255]))):
-        self._particle = particle
-        self._positions = np.empty((0, 3))
-        self._velocities = np.empty((0, 3))
-        self._accelerations = np.empty((0, 3))
-        self._ages = np.empty((0))
-        self._colours = np.empty((0, 4))
-        self._min_height = min_height
-        self._max_height = max_height
-        self._view = view
-        self._offset = np.zeros(3)
-        self.add_particles(N, mean_speed)
-        self._visible = True
+        snapshot = copy.copy(self)
 
-    @property
-    def min_height(self):
-        return self._min_height
+        for name in ("_positions", "_previous", "_velocities", "_ages",
+                     "_colours", "_types", "_rotations", "_asleep"):
+            array = getattr(self, name)[: self._size].copy()
+            array.flags.writeable = False
+            setattr(snapshot, name, array)
 
-    @min_height.setter
-    def min_height(self, val):
-        self._min_height = val
+        snapshot._visible = self._visible.copy()
 
-    @property
-    def max_height(self):
-        return self._max_height
+        return snapshot
+
+    def remove(self, indices):
+        """
+        Removes the particles with the given (unique) indices, filling the
+        holes with the last live particles.
+        """
+
+        if not len(indices):
+            return
+
+        size = self._size - len(indices)
 
-    @max_height.setter
-    def max_height(self, val):
-        self._max_height = val
+        removed = np.zeros(self._size, dtype=bool)
+        removed[indices] = True
+        holes = np.where(removed[: size])[0]
+        fillers = size + np.where(~removed[size:])[0]
 
-    def add_particles(self, N, mean_speed=1.0, colour=None):
-        x = np.random.random(N) * self._view[self.X]
-        y = np.random.random(N) * self._view[self.Y]
-        z = (np.random.random(N) * (self._max_height - self._min_height) +
-             self._min_height)
+        for array in (self._positions, self._previous, self._velocities,
+                      self._ages,
+                      self._colours, self._types, self._rotations,
+                      self._asleep):
+            array[holes] = array[fillers]
 
-        positions = np.c_[x, y, z]
+        self._size = size
+
+    def wake(self, indices):
+        self.asleep[indices] = False
 
-        velocities = (2.0 * np.random.random((N, 3)) - 1.0) * mean_speed
+    def disturb(self, position, radius):
+        """
+        Wakes the particles within radius of position.
+        """
 
-        self._positions = np.r_[self._positions, positions]
-        self.velocities = np.r_[self.velocities, velocities]
-        self.accelerations = np.empty((self.number, 3))
-        self.ages = np.empty(self.number)
+        sleeping = np.where(self.asleep)[0]
 
-        if colour is None:
-            self.colours = np.r_[self.colours,
-                                 (0.5 + np.random.random((N, 4))) *
-                                 self.particle.colour[np.newaxis]]
+        if sleeping.size:
+            near = ((self.positions[sleeping] - position) ** 2).sum(-1) < \
+                radius ** 2
+            self.wake(sleeping[near])
+
+    def move(self, dt=0.03125):
+        """
+        Ages all particles and fades their colours, and tumbles and moves
+        those that are awake.
+        """
+
+        types = self.types
+
+        fades = self._fades
+        if self._fade_step is not None:
+            fades = fades ** (dt / self._fade_step)
+
+        self.previous[...] = self.positions
+        self.ages[...] += dt
+        self.colours[...] *= fades[types]
+        self.rotations[...] = ((self.rotations + self._tumbles[types] *
+                                ~self.asleep) % self._bank.shape[0])
+
+        if self.asleep.any():
+            awake = np.where(~self.asleep)[0]
+            types = types[awake]
+            velocities = self.velocities[awake]
+            velocities += (self._gravities[types] -
+                           self._frictions[types, np.newaxis] * velocities) * dt
+            self.velocities[awake] = velocities
+            self.positions[awake] += velocities * dt
         else:
-            self.colours = np.r_[self.colours, colour * np.ones((N, 4))]
-
-    def move(self, velocity, dt=0.03125):
-        self._positions += (self.velocities - velocity[np.newaxis]) * dt
-
-    def impose_boundary_conditions(self):
-        if self.number:
-            self._positions[:, self.X] = (self._positions[:, self.X] %
-                                          self._view[self.X])
-            self._positions[:, self.Y] = (self._positions[:, self.Y] %
-                                          self._view[self.X])
-            self._positions[:, self.Z] = ((self._positions[:, self.Z] -
-                                           self._min_height) %
-                                          (self._max_height - self._min_height)
-                                          + self._min_height)
-
-    def impose_boundary_conditions_old(self, world):
-        if self.number:
-            self._positions[:, self.X] %= world.shape[self.X]
-            self._positions[:, self.Y] %= world.shape[self.Y]
-            self._positions[:, self.Z] = ((self.positions[:, self.Z] -
-                                           self._min_height) %
-                                          (self._max_height - self._min_height)
-                                          + self._min_height)
+            velocities = self.velocities
+            velocities += (self._gravities[types] -
+                           self._frictions[types, np.newaxis] * velocities) * dt
+            self.positions[...] += velocities * dt
 
-    @property
-    def offset(self):
-        return self._offset
+    def impose_boundary_conditions(self, world, focus):
+        """
+        Removes aged particles, wraps particles around the map (and stars
+        around focus), and handles particles that hit the ground, all in one
+        pass: those that shatter turn into shrapnel, the others bounce.
 
-    @offset.setter
-    def offset(self, position):
-        self._offset = np.array([position[self.X] - self._view[self.X] * 0.5,
-                                 position[self.Y] - self._view[self.Y] * 0.5,
-                                 0.0])
+        The ground is world.surface_at, the terrain interpolated between
+        cell corners, so that particles slide smoothly across cells.
+        """
 
-    @property
-    def positions(self):
-        return self._positions + self.offset
+        self.remove(np.where(self.ages > self._lifetimes[self.types])[0])
+
+        stars = self.types == STAR
+
+        if stars.any():
+            self._wrap_stars(np.where(stars)[0], focus)
+
+        grounded = np.where(~(stars + self.asleep))[0]
+
+        if not grounded.size:
+            return
+
+        positions = self.positions
+        unwrapped = positions[grounded, : 2]
+        positions[grounded, self.X] %= world.shape[self.X]
+        positions[grounded, self.Y] %= world.shape[self.Y]
+        self.previous[grounded, : 2] += positions[grounded, : 2] - unwrapped
+
+        heights, normals = world.surface_at(positions[grounded, self.X],
+                                            positions[grounded, self.Y])
+
+        hits = np.where(positions[grounded, self.Z] < heights)[0]
+
+        if not hits.size:
+            return
+
+        shatters = self._shatters[self.types[grounded[hits]]]
+
+        bouncers = hits[~shatters]
+        if bouncers.size:
+            self.bounce(grounded[bouncers], heights[bouncers],
+                        normals[bouncers])
+
+        shatterers = hits[shatters]
+        if shatterers.size:
+            self.shatter(grounded[shatterers], world)
+
+    def _wrap_stars(self, stars, focus):
+        box = self._star_box
+        low, high = self._star_heights
+        origin = np.asarray(focus)[: 2] - 0.5 * box
+
+        positions = self.positions
+        unwrapped = positions[stars]
+        positions[stars, : 2] = (positions[stars, : 2] - origin) % box + origin
+        positions[stars, self.Z] = ((positions[stars, self.Z] - low) %
+                                    (high - low) + low)
+        self.previous[stars] += positions[stars] - unwrapped
+
+    def bounce(self, indices, heights, normals):
+        """
+        Puts particles back on the ground, and reflects their velocities in
+        the ground normals: velocities into the ground are reversed and
+        scaled by the elasticity of their kind, velocities along the ground
+        reduced by its ground_friction. Particles left slower than
+        sleep_speed fall asleep.
+        """
+
+        velocities = self._reflect(indices, normals)
+
+        resting = (velocities ** 2).sum(-1) < self._sleep_speed ** 2
+        velocities[resting] = 0
+
+        self.positions[indices, self.Z] = heights
+        self.velocities[indices] = velocities
+        self.asleep[indices] = resting
+
+    def deflect(self, indices, centres, radius):
+        """
+        Pushes particles out of spheres of radius around centres (such as
+        objects they hit), and reflects their velocities like bounce does.
+        """
+
+        normals = self.positions[indices] - self._policy.geometry(centres)
+        lengths = np.sqrt((normals ** 2).sum(-1))[:, np.newaxis]
+        normals = np.where(lengths > 0, normals / np.where(
+            lengths > 0, lengths, 1), np.array([0, 0, 1]))
+
+        self.positions[indices] = centres + radius * normals
+        self.velocities[indices] = self._reflect(indices, normals)
+
+    def _reflect(self, indices, normals):
+        types = self.types[indices]
+        velocities = self.velocities[indices]
+
+        speeds = (velocities * normals).sum(-1)
+        speeds = np.where(speeds < 0, speeds, 0)[:, np.newaxis]
+        tangents = velocities - speeds * normals
+
+        return ((1 - self._ground_frictions[types, np.newaxis]) * tangents -
+                self._elasticities[types, np.newaxis] * speeds * normals)
+
+    def shatter(self, indices, world):
+        """
+        Removes particles, and adds shrapnel coloured like the ground where
+        they hit it (lighter on water, like spray).
+        """
+
+        positions = self.positions[indices].copy()
+        velocities = self.velocities[indices].copy()
+
+        mixing = (
+            self._random.random(indices.shape)
+            * (positions[:, self.Z] <= 0)
+        )
+        colours = np.clip(world.colours_at(
+            np.floor(positions[:, self.X] + 0.5),
+            np.floor(positions[:, self.Y] + 0.5),
+        ) + 64 * mixing[:, np.newaxis], 0, 255)
+
+        self.remove(indices)
+        self.add_shrapnel(positions, velocities, colours)
+
+    def interpolated(self, indices, alpha):
+        """
+        Returns the positions of the particles with the given indices, alpha
+        of the way from their previous positions to their current ones.
+        """
+
+        previous = self.previous[indices]
+
+        return previous + alpha * (self.positions[indices] - previous)
+
+    def patches(self, indices, positions=None):
+        """
+        Returns the patches (four per particle, particle by particle) and
+        patch positions of the particles with the given indices, at
+        positions if given (such as positions fixed for the view).
+
+        Models are gathered from the rotation bank, and scaled to the size
+        of their kind.
+        """
+
+        if positions is None:
+            positions = self.positions[indices]
+
+        sizes = self._sizes[self.types[indices]]
+
+        positions = self._policy.geometry(positions)
+        patches = (positions[:, np.newaxis, np.newaxis, :] +
+                   sizes[:, np.newaxis, np.newaxis, np.newaxis] *
+                   self._bank[self.rotations[indices]]).reshape(
+                       len(indices) * 4, 3, 3)
+
+        return patches, patches.mean(-2)
+
+    def patch_colours(self, indices):
+        """
+        Returns the colours of the patches of the particles with the given
+        indices, in the order of patches.
+        """
+
+        return np.repeat(self.colours[indices], 4, axis=0)
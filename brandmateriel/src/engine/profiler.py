@@ -0,0 +1,242 @@
+import csv
+import json
+import time
+import threading
+from collections import deque
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+
+class Scope(object):
+    """
+    A named timing scope, used as a context manager:
+
+        with profiler.scope("lighting"):
+            ...
+
+    Nested scopes are allowed. Durations of scopes with the same name are
+    summed per frame.
+    """
+
+    __slots__ = ("_profiler", "_name", "_start")
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = clock()
+        return self
+
+    def __exit__(self, *args):
+        self._profiler.record(self._name, self._start, clock())
+        return False
+
+
+class NullScope(object):
+    """
+    Scope that does nothing, returned when profiling is disabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+NULL_SCOPE = NullScope()
+
+
+class Profiler(object):
+    """
+    The Profiler collects per-frame timings of named scopes and per-frame
+    counters (patch counts, particle counts and such).
+
+    Frames are delimited by begin_frame() and end_frame(). Completed frames
+    are kept for export to CSV (one row per frame, one column per scope and
+    counter) and to the Chrome trace-event format (load in chrome://tracing
+    or https://ui.perfetto.dev).
+
+    When disabled, scope() returns a shared no-op scope and count() returns
+    immediately, so instrumented code costs next to nothing.
+
+    Scopes and counters may be recorded from several threads at once (such
+    as the worker thread of pipelined mode); they add up in the same frame.
+    """
+
+    def __init__(self, enabled=False, history=64, max_frames=36000):
+        self._enabled = enabled
+        self._history = history
+        self._max_frames = max_frames
+        self._epoch = clock()
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, val):
+        self._enabled = True if val else False
+
+    @property
+    def frames(self):
+        return self._frames
+
+    @property
+    def names(self):
+        return self._names
+
+    @property
+    def counter_names(self):
+        return self._counter_names
+
+    def reset(self):
+        self._frame = 0
+        self._frame_start = None
+        self._timings = {}
+        self._counters = {}
+        self._names = []
+        self._counter_names = []
+        self._frames = deque(maxlen=self._max_frames)
+        self._events = deque(maxlen=self._max_frames * 32)
+        self._recent = deque(maxlen=self._history)
+
+    def scope(self, name):
+        if self._enabled:
+            return Scope(self, name)
+        else:
+            return NULL_SCOPE
+
+    def record(self, name, start, stop):
+        thread = threading.current_thread().ident
+
+        with self._lock:
+            if name not in self._timings:
+                self._timings[name] = 0.0
+                if name not in self._names:
+                    self._names.append(name)
+
+            self._timings[name] += stop - start
+            self._events.append((name, start, stop, thread))
+
+    def count(self, name, value):
+        if not self._enabled:
+            return
+
+        # NumPy scalars (such as array sizes) do not export to JSON:
+        if hasattr(value, "item"):
+            value = value.item()
+
+        with self._lock:
+            if name not in self._counter_names:
+                self._counter_names.append(name)
+
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def begin_frame(self):
+        if not self._enabled:
+            return
+
+        with self._lock:
+            self._timings = {}
+            self._counters = {}
+            self._frame_start = clock()
+
+    def end_frame(self):
+        if not self._enabled or self._frame_start is None:
+            return
+
+        stop = clock()
+        with self._lock:
+            frame = {
+                "frame": self._frame,
+                "start": self._frame_start - self._epoch,
+                "total": stop - self._frame_start,
+                "timings": self._timings,
+                "counters": self._counters,
+            }
+            self._events.append(("frame", self._frame_start, stop,
+                                 threading.current_thread().ident))
+            self._frames.append(frame)
+            self._recent.append(frame)
+            self._frame += 1
+            self._frame_start = None
+
+    def summary(self):
+        """
+        Returns mean frame time, and a list of (name, mean duration) for
+        scopes and (name, mean value) for counters, averaged over the most
+        recent frames. Durations are in seconds.
+        """
+
+        if not self._recent:
+            return 0.0, [], []
+
+        n = float(len(self._recent))
+        total = sum(f["total"] for f in self._recent) / n
+        timings = [(name, sum(f["timings"].get(name, 0.0)
+                              for f in self._recent) / n)
+                   for name in self._names]
+        counters = [(name, sum(f["counters"].get(name, 0)
+                               for f in self._recent) / n)
+                    for name in self._counter_names]
+
+        return total, timings, counters
+
+    def to_csv(self, filename):
+        """
+        Writes one row per frame, with durations in milliseconds.
+        """
+
+        with open(filename, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(["frame", "start", "total"] + self._names +
+                            self._counter_names)
+            for frame in self._frames:
+                writer.writerow(
+                    [frame["frame"], "{0:.6f}".format(frame["start"]),
+                     "{0:.4f}".format(frame["total"] * 1000.0)] +
+                    ["{0:.4f}".format(frame["timings"].get(name, 0.0) *
+                                      1000.0) for name in self._names] +
+                    [frame["counters"].get(name, 0)
+                     for name in self._counter_names])
+
+    def to_trace(self, filename):
+        """
+        Writes timings and counters in the Chrome trace-event JSON format.
+        Timestamps are in microseconds.
+        """
+
+        events = []
+        for name, start, stop, thread in self._events:
+            events.append({
+                "name": name,
+                "cat": "frame" if name == "frame" else "stage",
+                "ph": "X",
+                "ts": (start - self._epoch) * 1e6,
+                "dur": (stop - start) * 1e6,
+                "pid": 0,
+                "tid": thread,
+            })
+
+        for frame in self._frames:
+            if frame["counters"]:
+                events.append({
+                    "name": "counters",
+                    "ph": "C",
+                    "ts": frame["start"] * 1e6,
+                    "pid": 0,
+                    "args": frame["counters"],
+                })
+
+        with open(filename, 'w') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
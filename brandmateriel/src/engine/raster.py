@@ -0,0 +1,405 @@
+import numpy as np
+
+X = U = 0
+Y = V = 1
+Z = W = 2
+
+# Beyond any screen coordinate (see get_spans):
+FAR = np.float32(1e30)
+
+
+def pad_patches(patches, size=4):
+    """
+    Converts patches (an array of shape (N, k, 2), or a list of (k, 2)-arrays
+    with k <= size) to an array of shape (N, size, 2) and an array of vertex
+    counts.
+
+    Patches with fewer than size vertices are padded by repeating their last
+    vertex, which adds only zero-length edges.
+    """
+
+    if isinstance(patches, np.ndarray):
+        counts = np.ones(patches.shape[0], dtype=int) * patches.shape[1]
+        padded = np.empty((patches.shape[0], size, 2), dtype=patches.dtype)
+        padded[:, : patches.shape[1]] = patches
+        padded[:, patches.shape[1]:] = patches[:, -1:]
+
+        return padded, counts
+
+    counts = np.array([len(patch) for patch in patches], dtype=int)
+    padded = np.empty((len(patches), size, 2), dtype=int)
+
+    for k in np.unique(counts):
+        indices = np.where(counts == k)[0]
+        group = np.array([patches[n] for n in indices])
+        padded[indices, : k] = group
+        padded[indices, k:] = group[:, -1:]
+
+    return padded, counts
+
+
+def get_spans(patches, resolution, values=None, outline=False):
+    """
+    Scan-converts convex polygons.
+
+    patches is an (N, k, 2)-array of vertex screen coordinates, with
+    triangles padded as by pad_patches. Returns, for every screen row covered
+    by every patch, the index of the patch, the row and the first and last
+    pixel of the span, all clipped to the screen. Spans are ordered by patch.
+
+    With outline (and no values), spans also cover the pixels that
+    pygame.draw.polygon draws the edges over with a width of one: those with
+    centres between where an edge enters and leaves the band of the row.
+
+    If values, an (N, k)-array of per-vertex values, is given, the values
+    are interpolated along the edges as well, and the exact (unrounded and
+    unclipped) ends of the spans and the values there are returned too.
+    """
+
+    width, height = resolution
+
+    # Vertices along the first axis, so that reductions over the vertices
+    # and edges of a patch are elementwise between rows of arrays:
+    patches = np.asarray(patches, dtype=np.float32)
+    xs = patches[..., X].T
+    ys = patches[..., Y].T
+
+    ymin = np.ceil(ys.min(0) - 0.5).astype(int)
+    ymax = np.floor(ys.max(0) + 0.5).astype(int)
+    onscreen = ((xs.max(0) >= 0) * (xs.min(0) <= width - 1) *
+                (ymax >= 0) * (ymin <= height - 1))
+    ymin = np.where(ymin < 0, 0, ymin)
+    ymax = np.where(ymax > height - 1, height - 1, ymax)
+    rows = np.where(onscreen, ymax - ymin + 1, 0)
+
+    # One entry per patch and covered row:
+    indices = np.repeat(np.arange(patches.shape[0]), rows)
+    offsets = np.cumsum(rows) - rows
+    row = ymin[indices] + np.arange(indices.size) - offsets[indices]
+
+    # Intersect row with all four edges. Masks are applied arithmetically
+    # (adding FAR to the ends of edges that miss the row) rather than with
+    # np.where, which is several times slower on masks this irregular:
+    x0 = xs[:, indices]
+    y0 = ys[:, indices]
+    x1 = np.roll(x0, -1, axis=0)
+    y1 = np.roll(y0, -1, axis=0)
+    y = np.empty_like(y0)
+    y[...] = row
+    bottom = np.fmin(y0, y1)
+    top = np.fmax(y0, y1)
+    crossing = (y >= bottom) * (y <= top)
+    dy = y1 - y0
+    flat = dy == 0
+    t = (y - y0) / (dy + flat)
+    xa = x0 + t * (x1 - x0)
+    xb = xa + flat * (x1 - xa)
+    far = ~crossing * FAR
+
+    if values is None:
+        left = (np.fmin(xa, xb) + far).min(0)
+        right = (np.fmax(xa, xb) - far).max(0)
+
+        if outline:
+            slope = (x1 - x0) / (dy + flat)
+            xa = x0 + (np.fmin(np.fmax(y - 0.5, bottom), top) - y0) * slope
+            xb = x0 + (np.fmin(np.fmax(y + 0.5, bottom), top) - y0) * slope
+            xb += flat * (x1 - xb)
+            far = ~((y + 0.5 >= bottom) * (y - 0.5 <= top)) * FAR
+            left = np.fmin(np.round(left),
+                           np.ceil((np.fmin(xa, xb) + far).min(0)))
+            right = np.fmax(np.round(right),
+                            np.floor((np.fmax(xa, xb) - far).max(0)))
+    else:
+        v0 = np.asarray(values, dtype=np.float32).T[:, indices]
+        v1 = np.roll(v0, -1, axis=0)
+        va = v0 + t * (v1 - v0)
+        vb = va + flat * (v1 - va)
+
+        # The left and right ends of every edge in the row, with values:
+        swap = xa > xb
+        lows = np.fmin(xa, xb) + far
+        highs = np.fmax(xa, xb) - far
+        value_lows = va + swap * (vb - va)
+        value_highs = vb + swap * (va - vb)
+        n = np.arange(lows.shape[1])
+
+        first = lows.argmin(0)
+        last = highs.argmax(0)
+        left = lows[first, n]
+        right = highs[last, n]
+        value_left = value_lows[first, n]
+        value_right = value_highs[last, n]
+
+    valid = np.where((left <= width - 1) * (right >= 0) * (left <= right))[0]
+    exact_left = left[valid]
+    exact_right = right[valid]
+    left = np.round(exact_left).astype(int)
+    right = np.round(exact_right).astype(int)
+    left = np.where(left < 0, 0, left)
+    right = np.where(right > width - 1, width - 1, right)
+
+    if values is None:
+        return indices[valid], row[valid], left, right
+    else:
+        return (indices[valid], row[valid], left, right, exact_left,
+                exact_right, value_left[valid], value_right[valid])
+
+
+def expand_runs(starts, lengths):
+    """
+    Expands runs of consecutive integers, given by their starts and lengths,
+    and returns the index of the run and the integer for every integer of
+    every run, run by run.
+    """
+
+    run = np.repeat(np.arange(starts.size), lengths)
+    offsets = np.cumsum(lengths) - lengths
+
+    return run, np.arange(run.size) + np.repeat(starts - offsets, lengths)
+
+
+def paint_spans(pixels, rows, left, right, colours):
+    """
+    Paints spans (as returned by get_spans) into a pixel array indexed as
+    pixels[x, y], in the given order, so that later spans cover earlier
+    ones. colours are pixel values, one per span.
+
+    Overlaps are resolved for pieces of rows rather than for pixels: the
+    ends of all spans cut the rows into pieces that every span covers either
+    whole or not at all, and every piece takes the colour of the last span
+    covering it. Every pixel is then written exactly once.
+    """
+
+    if not rows.size:
+        return
+
+    width, height = pixels.shape[: 2]
+
+    # Spans as ranges of pixels numbered row by row:
+    start = rows * width + left
+    stop = rows * width + right + 1
+    cuts, ends = np.unique(np.r_[start, stop], return_inverse=True)
+    first = ends[: rows.size]
+    span, piece = expand_runs(first, ends[rows.size:] - first)
+
+    # The last span covering a piece is the one with the largest index:
+    n = rows.size
+    keys = np.sort(piece * n + span)
+    last = np.r_[keys[1:] // n != keys[: -1] // n, True]
+    piece, span = np.divmod(keys[last], n)
+
+    covered = np.zeros(cuts.size + 1, dtype=bool)
+    covered[piece + 1] = True
+    covered = np.repeat(covered, np.diff(np.r_[0, cuts, width * height]))
+
+    pixels.swapaxes(0, 1)[covered.reshape((height, width))] = np.repeat(
+        colours[span], np.diff(cuts)[piece], axis=0)
+
+
+def pack_colours(colours, shifts, losses=(0, 0, 0)):
+    """
+    Packs RGB(A) colours into integer pixel values, given the per-channel
+    shifts and losses of the target surface (see pygame.Surface.get_shifts
+    and get_losses).
+    """
+
+    colours = np.clip(colours[:, : 3], 0, 255).astype(np.uint32)
+    packed = np.zeros(colours.shape[0], dtype=np.uint32)
+
+    for channel in range(3):
+        packed |= ((colours[:, channel] >> losses[channel]) <<
+                   shifts[channel])
+
+    return packed
+
+
+def fill_patches(pixels, patches, colours, shifts=None, losses=(0, 0, 0),
+                 outline=False):
+    """
+    Fills patches into a pixel array indexed as pixels[x, y]: either an RGB
+    array such as pygame.surfarray.pixels3d of a Surface, or, if the shifts
+    (and losses) of the Surface are given, a packed integer array such as
+    pygame.surfarray.pixels2d. The latter moves a third of the data.
+
+    patches are screen coordinates as returned by Camera
+    .get_screen_coordinates (or a list of such patches with three or four
+    vertices each), colours are RGBA. Patches are painted in the given order,
+    so later patches cover earlier ones (see paint_spans), and patches with
+    zero alpha are skipped. All patches are rasterised together in batched
+    array operations rather than one at a time.
+
+    With outline, the edges of every patch are painted along with it (see
+    get_spans), which closes the seams between neighbouring patches.
+    """
+
+    if not len(patches):
+        return
+
+    colours = np.asarray(colours)
+    visible = np.where(colours[:, 3] != 0)[0]
+
+    if not visible.size:
+        return
+
+    patches, counts = pad_patches(patches)
+    patches = patches[visible]
+
+    if shifts is None:
+        colours = np.clip(colours[visible, : 3], 0, 255).astype(pixels.dtype)
+    else:
+        colours = pack_colours(colours[visible], shifts, losses).astype(
+            pixels.dtype)
+
+    indices, rows, left, right = get_spans(patches, pixels.shape[: 2],
+                                           outline=outline)
+
+    paint_spans(pixels, rows, left, right, colours[indices])
+
+
+def clip_near(patches, depths, near, centre):
+    """
+    Clips convex patches to the part beyond the view depth near.
+
+    patches is an (N, k, 2)-array of screen coordinates, depths the (N, k)
+    view depths of their vertices, and centre the screen coordinates of the
+    point straight ahead of the camera (see Camera.centre). Every patch
+    needs a vertex beyond near. Returns the clipped patches and depths with
+    k + 1 vertices each, padded by repeating the last vertex.
+
+    The clipping is done on the screen: offsets from centre, times depth,
+    vary linearly along an edge, so where an edge crosses near follows from
+    its ends alone.
+    """
+
+    patches = np.asarray(patches, dtype=float)
+    n, k = depths.shape
+
+    beyond = depths > near
+    offsets = (patches - centre) * np.abs(depths)[..., np.newaxis]
+    dz = depths - np.roll(depths, -1, axis=1)
+    t = (depths - near) / np.where(dz == 0, 1, dz)
+    crossings = centre + (offsets + t[..., np.newaxis] * (
+        np.roll(offsets, -1, axis=1) - offsets)) / near
+
+    # Every vertex beyond near, followed by where the edge from it crosses
+    # near, if it does:
+    candidates = np.stack((patches, crossings), axis=2).reshape((n, 2 * k, 2))
+    candidate_depths = np.stack((depths, np.ones((n, k)) * near),
+                                axis=2).reshape((n, 2 * k))
+    kept = np.stack((beyond, beyond != np.roll(beyond, -1, axis=1)),
+                    axis=2).reshape((n, 2 * k))
+
+    order = np.argsort(~kept, axis=1, kind="stable")[:, : k + 1]
+    counts = np.minimum(kept.sum(1), k + 1)
+    rows = np.arange(n)[:, np.newaxis]
+    order = np.where(np.arange(k + 1) < counts[:, np.newaxis], order,
+                     order[rows[:, 0], counts - 1][:, np.newaxis])
+
+    return candidates[rows, order], candidate_depths[rows, order]
+
+
+def fill_patches_zbuffered(pixels, zbuffer, patches, depths, colours,
+                           shifts=None, losses=(0, 0, 0), bias=None,
+                           near=0.1, centre=None):
+    """
+    Fills patches into a pixel array like fill_patches, but resolves
+    visibility per pixel with a depth buffer instead of by drawing order, so
+    patches may be given in any order and need no sorting.
+
+    depths are the per-vertex view depths returned by
+    Camera.get_screen_coordinates. Inverse depth is what varies linearly
+    across the screen, so that is what is interpolated and stored in
+    zbuffer, a float32 array shaped like pixels[..., 0]; a larger value is
+    nearer. Clear zbuffer to zero before the first call of a frame.
+
+    bias, if given, scales the inverse depth per patch, which lets layers
+    such as shadows win over the terrain they lie on. Patches are clipped to
+    the part beyond near (see clip_near, centre defaults to the middle of
+    pixels). Of fragments at the same depth, the one of the later patch
+    wins. No outlines are drawn, since they would need depths of their own.
+    """
+
+    if not len(patches):
+        return
+
+    colours = np.asarray(colours)
+    patches, counts = pad_patches(patches)
+    depths = np.asarray(depths, dtype=float)
+    if depths.shape[1] < 4:
+        depths = np.c_[depths, depths[:, -1:] * np.ones(
+            (1, 4 - depths.shape[1]))]
+
+    visible = np.where((colours[:, 3] != 0) * (depths.max(-1) > near))[0]
+
+    if not visible.size:
+        return
+
+    width, height = pixels.shape[: 2]
+    if centre is None:
+        centre = np.array([width, height]) * 0.5
+
+    patches, depths = clip_near(patches[visible], depths[visible], near,
+                                centre)
+    inverse = 1.0 / depths
+    if bias is not None:
+        inverse *= np.asarray(bias)[visible, np.newaxis]
+
+    if shifts is None:
+        colours = np.clip(colours[visible, : 3], 0, 255).astype(pixels.dtype)
+    else:
+        colours = pack_colours(colours[visible], shifts, losses).astype(
+            pixels.dtype)
+
+    (indices, rows, left, right, exact_left, exact_right, inverse_left,
+     inverse_right) = get_spans(patches, (width, height), inverse)
+
+    if not rows.size:
+        return
+
+    # One fragment for every pixel of every span, numbered row by row (see
+    # paint_spans). Inverse depth is linear along a span, so it is its value
+    # at the first pixel plus a step per pixel:
+    starts = rows * width + left
+    lengths = right - left + 1
+    step = (inverse_right - inverse_left) / np.where(
+        exact_right > exact_left, exact_right - exact_left, 1.0)
+    first = inverse_left + (left - exact_left) * step
+    pixel = expand_runs(starts, lengths)[1]
+    w = (np.repeat(first.astype(np.float32), lengths) +
+         (pixel - np.repeat(starts, lengths)).astype(np.float32) *
+         np.repeat(step.astype(np.float32), lengths))
+    np.maximum(w, 0, out=w)
+
+    # Sort the fragments by pixel, then by inverse depth, then by patch, all
+    # packed into one integer: the bits of a positive float order like the
+    # float. The last fragment of every pixel is then the nearest one, and
+    # of the nearest, the one of the latest patch. Inverse depths lose their
+    # lowest bits if all three do not fit.
+    patch_bits = int(patches.shape[0] - 1).bit_length()
+    pixel_bits = int(width * height - 1).bit_length()
+    depth_bits = min(32, 64 - patch_bits - pixel_bits)
+    keys = pixel.astype(np.uint64) << np.uint64(64 - pixel_bits)
+    keys |= (w.view(np.uint32) >> np.uint32(32 - depth_bits)).astype(
+        np.uint64) << np.uint64(patch_bits)
+    keys |= np.repeat(indices.astype(np.uint64), lengths)
+    keys.sort()
+    pixel = (keys >> np.uint64(64 - pixel_bits)).astype(np.intp)
+    last = np.r_[pixel[1:] != pixel[: -1], True]
+    keys = keys[last]
+    pixel = pixel[last]
+    patch = (keys & np.uint64((1 << patch_bits) - 1)).astype(np.intp)
+    w = (((keys >> np.uint64(patch_bits)) &
+          np.uint64((1 << depth_bits) - 1)).astype(np.uint32) <<
+         np.uint32(32 - depth_bits)).view(np.float32)
+
+    # Depth test against what is in zbuffer already; pixels are in the
+    # order boolean indexing of the (height, width) views takes them in:
+    covered = np.zeros(width * height, dtype=bool)
+    covered[pixel] = True
+    nearer = w >= zbuffer.swapaxes(0, 1)[covered.reshape((height, width))]
+    covered[pixel[~nearer]] = False
+    covered = covered.reshape((height, width))
+
+    zbuffer.swapaxes(0, 1)[covered] = w[nearer]
+    pixels.swapaxes(0, 1)[covered] = colours[patch[nearer]]
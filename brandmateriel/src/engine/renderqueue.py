@@ -0,0 +1,194 @@
+import numpy as np
+from . import dtypes
+
+
+class RenderQueue(object):
+    """
+    The RenderQueue collects everything that is to be drawn in a frame.
+
+    Storage is a set of preallocated arrays, which producers (terrain,
+    houses, player, particles, shadows) write into in place:
+    * vertices:
+        - screen coordinates of the patch corners, padded to four vertices by
+          repeating the last one.
+
+    * counts:
+        - the number of actual vertices of each patch (three or four).
+
+    * depths:
+        - the sort key of each patch: the mean squared distance from the
+          viewer to the patch position.
+
+    * vertex_depths:
+        - the view depth of every vertex, as returned by
+          Camera.get_screen_coordinates, for depth buffered drawing.
+
+    * layers:
+        - the layer of each patch; layers are drawn in order, so that
+          shadows always go on top of terrain, and objects on top of both.
+
+    * colours:
+        - RGBA colour of each patch.
+
+    Capacity is doubled whenever a frame needs more room, so after the first
+    few frames no allocations take place. Vertices have the screen type of
+    policy, depths are geometry arrays and colours have the colour type.
+
+    With a depth buffer, layers are not drawn in order. Instead, inverse
+    depths are scaled by the per-layer DEPTH_BIAS, so that shadows, which lie
+    slightly below the terrain, still win over it.
+    """
+
+    TERRAIN = 0
+    SHADOWS = 1
+    OBJECTS = 2
+
+    DEPTH_BIAS = np.array([1.0, 1.02, 1.0])
+
+    def __init__(self, capacity=1024, policy=None):
+        self._policy = dtypes.default() if policy is None else policy
+        self._size = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        policy = self._policy
+        vertices = np.zeros((capacity, 4, 2), dtype=policy.screen_type())
+        counts = np.zeros(capacity, dtype=np.int8)
+        depths = policy.zeros(capacity)
+        vertex_depths = policy.zeros((capacity, 4)) + 1
+        layers = np.zeros(capacity, dtype=np.int8)
+        colours = np.zeros((capacity, 4), dtype=policy.colour_type())
+
+        if self._size:
+            vertices[: self._size] = self._vertices[: self._size]
+            counts[: self._size] = self._counts[: self._size]
+            depths[: self._size] = self._depths[: self._size]
+            vertex_depths[: self._size] = self._vertex_depths[: self._size]
+            layers[: self._size] = self._layers[: self._size]
+            colours[: self._size] = self._colours[: self._size]
+
+        self._vertices = vertices
+        self._counts = counts
+        self._depths = depths
+        self._vertex_depths = vertex_depths
+        self._layers = layers
+        self._colours = colours
+
+    @property
+    def policy(self):
+        return self._policy
+
+    @property
+    def capacity(self):
+        return self._counts.shape[0]
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """
+        Returns the number of bytes in use by the patches of this frame.
+        """
+
+        return self._size * sum(a.itemsize * a[0].size for a in (
+            self._vertices, self._counts, self._depths, self._vertex_depths,
+            self._layers, self._colours))
+
+    @property
+    def vertices(self):
+        return self._vertices[: self._size]
+
+    @property
+    def counts(self):
+        return self._counts[: self._size]
+
+    @property
+    def depths(self):
+        return self._depths[: self._size]
+
+    @property
+    def vertex_depths(self):
+        return self._vertex_depths[: self._size]
+
+    @property
+    def layers(self):
+        return self._layers[: self._size]
+
+    @property
+    def colours(self):
+        return self._colours[: self._size]
+
+    def clear(self):
+        self._size = 0
+
+    def reserve(self, n):
+        """
+        Makes sure there is room for n more patches.
+        """
+
+        if self._size + n > self.capacity:
+            capacity = self.capacity
+            while self._size + n > capacity:
+                capacity *= 2
+            self._allocate(capacity)
+
+    def push(self, patches, colours, positions, origin, layer=OBJECTS,
+             depths=None):
+        """
+        Appends patches (screen coordinates, as returned by
+        Camera.get_screen_coordinates) with their colours, and sort keys
+        computed from their positions and the viewer position origin.
+
+        depths are the per-vertex view depths from the same call, and are
+        only needed for depth buffered drawing.
+        """
+
+        n, k = patches.shape[: 2]
+
+        if not n:
+            return
+
+        self.reserve(n)
+
+        the_slice = slice(self._size, self._size + n)
+
+        self._vertices[the_slice, : k] = patches
+        self._vertices[the_slice, k:] = patches[:, -1:]
+        self._counts[the_slice] = k
+        self._depths[the_slice] = ((positions - origin) ** 2).mean(-1)
+        self._layers[the_slice] = layer
+        if depths is None:
+            self._vertex_depths[the_slice] = np.sqrt(
+                self._depths[the_slice])[:, np.newaxis]
+        else:
+            self._vertex_depths[the_slice, : k] = depths
+            self._vertex_depths[the_slice, k:] = depths[:, -1:]
+        self._colours[the_slice] = colours
+
+        self._size += n
+
+    def visible(self):
+        """
+        Returns the indices of visible patches, in submission order.
+        """
+
+        return np.where(self.colours[:, 3] != 0)[0]
+
+    def depth_bias(self, indices):
+        return self.DEPTH_BIAS[self._layers[indices]]
+
+    def layer_sizes(self):
+        return np.bincount(self.layers, minlength=self.OBJECTS + 1)
+
+    def order(self):
+        """
+        Returns the indices of visible patches in drawing order: by layer,
+        and far to near within each layer.
+        """
+
+        visible = self.visible()
+        order = np.lexsort((-self._depths[visible], self._layers[visible]))
+
+        return visible[order]
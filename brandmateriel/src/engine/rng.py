@@ -0,0 +1,51 @@
+"""
+Random number generators of the engine.
+
+Every subsystem that needs random numbers (the world, the particles, the
+player, the houses and so on) draws them from a numpy.random.Generator of
+its own, rather than from the global np.random. The generators are all
+derived from one seed, each from the seed and the name of its subsystem,
+so that:
+
+* the same seed gives the same numbers, whatever else is random;
+
+* subsystems don't disturb each other: drawing more or fewer numbers in
+  one (say, more particles on a faster machine) leaves the numbers of the
+  others as they were.
+
+Seeds are non-negative integers (below 2 ** 63, so that they can be saved
+as int64); new_seed makes one at random, for games that should differ, but
+could be replayed.
+"""
+
+import zlib
+
+import numpy as np
+
+
+def new_seed():
+    """
+    Returns a fresh random seed.
+    """
+
+    return int(np.random.default_rng().integers(2 ** 63))
+
+
+def generator(seed, name):
+    """
+    Returns the Generator of subsystem name for seed. The same seed and
+    name always give a generator drawing the same numbers.
+    """
+
+    key = zlib.crc32(name.encode("utf-8")) & 0xffffffff
+
+    return np.random.default_rng(
+        np.random.SeedSequence(seed, spawn_key=(key,)))
+
+
+def generators(seed, names):
+    """
+    Returns a dict of the Generators of subsystems names for seed.
+    """
+
+    return dict((name, generator(seed, name)) for name in names)
@@ -1,4 +1,5 @@
 import numpy as np
+from . import dtypes
 
 
 class LightSource(object):
@@ -107,6 +108,9 @@ class Shader(object):
     least a skeleton for implementing light directionality and such at a later
     stage. The standard Camera object can be used as a light source, unless
     a fixed light source is desired.
+
+    Colours are shaded as geometry floats of policy, and returned as its
+    colour type.
     """
 
     X = U = 0
@@ -116,9 +120,11 @@ class Shader(object):
     def __init__(self, light_source=LightSource(),
                  colour=np.array([1.4142, 1.4142, 1.4142, 1.0]),
                  glare=np.array([51, 51, 51, 255]),
-                 cutoff_distance=None, linear_distance=None):
+                 cutoff_distance=None, linear_distance=None, policy=None):
         self._light_source = light_source
 
+        self._policy = dtypes.default() if policy is None else policy
+
         self._colour = colour
 
         self._glare = glare
@@ -133,6 +139,10 @@ class Shader(object):
         else:
             self._linear_distance = linear_distance
 
+    @property
+    def policy(self):
+        return self._policy
+
     @property
     def light_source(self):
         return self._light_source
@@ -181,21 +191,40 @@ class Shader(object):
     def linear_distance(self, val):
         self._linear_distance = val
 
+    @property
+    def fog_distance(self):
+        """
+        Returns the distance at and beyond which distance shading fades
+        colours to black.
+        """
+
+        return self._linear_distance + self._cutoff_distance
+
     def apply_lighting(self, positions, normals, colours, culling=True,
                        scatter=True, fading=True):
         """
+        Returns shaded colours, as the colour_type of the policy. The
+        arithmetic is done in its float_type.
+
+        With culling, patches facing away from the light source get zero
+        alpha. It is cheaper to drop them before lighting, see Culler.
+
         Questions:
             this is done explicitly by reference, changing original colours;
             is that good or annoying?
         """
-        deltas = positions - self.light_source.position
+        policy = self._policy
+
+        deltas = (policy.geometry(positions) -
+                  policy.geometry(self.light_source.position))
         dists = np.sqrt((deltas ** 2).sum(-1))[:, np.newaxis]
         deltas /= dists
 
         # Apply scatter:
-        colours = (colours + self.glare) * self.colour
+        colours = ((policy.geometry(colours) + policy.geometry(self.glare)) *
+                   policy.geometry(self.colour))
         if scatter:
-            scatter = -(deltas * normals).sum(-1)
+            scatter = -(deltas * policy.geometry(normals)).sum(-1)
             colours *= scatter[:, np.newaxis]
 
         # Apply distance shading:
@@ -214,8 +243,7 @@ class Shader(object):
                                           / (self.linear_distance)))
 
         # Renormalise to allowed colour values:
-        colours = np.where(colours > 255, 255, colours)
-        colours = np.where(colours < 0, 0, colours)
+        colours = policy.colours(colours)
         colours[:, 3] = 255
         if culling:
             colours[np.where(scatter < 0)] = 0
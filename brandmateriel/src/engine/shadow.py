@@ -15,14 +15,14 @@ def get_shadows(patches, world):
     positions = patches.mean(-2)
 
     positions[..., Z] = np.where(positions[..., Z] < 0, 0, positions[..., Z])
-    xind = patches[..., X].astype(int) % world.shape[X]
-    yind = patches[..., Y].astype(int) % world.shape[Y]
+    xind = patches[..., X].astype(int)
+    yind = patches[..., Y].astype(int)
+    ground = world.patches_at(xind, yind)
 
     # This needs to be made more accurate
-    dists2 = ((patches[..., np.newaxis, : Z] -
-               world.patches[xind, yind, :, : Z]) ** 2).sum(-1)
-    patches[..., Z] = (world.patches[xind, yind, :, Z]
-                       / dists2).sum(-1) / (1 / dists2).sum(-1) - 0.0125
+    dists2 = ((patches[..., np.newaxis, : Z] - ground[..., : Z]) ** 2).sum(-1)
+    patches[..., Z] = (ground[..., Z] / dists2).sum(-1) / (1 / dists2).sum(
+        -1) - 0.0125
     patches[..., Z] = np.where(patches[..., Z] < 0, 0, patches[..., Z])
 
     return patches, positions
@@ -38,10 +38,10 @@ def get_small_shadows(patches, world):
     positions = patches.mean(-2)
 
     positions[..., Z] = np.where(positions[..., Z] < 0, 0, positions[..., Z])
-    xind = patches[..., X].astype(int) % world.shape[X]
-    yind = patches[..., Y].astype(int) % world.shape[Y]
+    xind = patches[..., X].astype(int)
+    yind = patches[..., Y].astype(int)
 
-    patches[..., Z] = (world.map_positions[xind, yind, Z].mean(-1)
+    patches[..., Z] = (world.heights_at(xind, yind).mean(-1)
                        )[:, np.newaxis]
     patches[..., Z] = np.where(patches[..., Z] < 0, 0, patches[..., Z])
 
@@ -1,11 +1,20 @@
+import copy
 import datetime as dt
 
 import numpy as np
 
+from . import dtypes
+
 
 class TriD(object):
     """
     Parent class for TriD-objects.
+
+    The rotation of an object, and its patches, normals, positions and such
+    in world coordinates, are cached: they are only worked out again when
+    yaw, pitch, roll or scale have been set to other values, or when the
+    position has changed (in place or not). Cached arrays are read-only;
+    copy them to change them.
     """
 
     X = U = 0
@@ -49,6 +58,8 @@ class TriD(object):
 
         self._roll = roll
 
+        self._invalidate()
+
         self._calc_normals()
 
         self._calc_positions()
@@ -61,9 +72,11 @@ class TriD(object):
 
         self._exploded = False
 
+        self._random = np.random.default_rng()
+
     @property
     def orientation(self):
-        return self._apply_rotation(self._orientation)
+        return self._rotated("orientation", self._orientation)
 
     @property
     def centre_of_mass(self):
@@ -79,26 +92,23 @@ class TriD(object):
 
     @property
     def patches(self):
-        return (self._scale * self._apply_rotation(self._patches) +
-                self.position[np.newaxis, np.newaxis, :])
+        return self._placed("patches", self._patches)
 
     @property
     def normals(self):
-        return self._apply_rotation(self._normals)
+        return self._rotated("normals", self._normals)
 
     @property
     def positions(self):
-        return (self._scale * self._apply_rotation(self._positions) +
-                self.position[np.newaxis, :])
+        return self._placed("positions", self._positions)
 
     @property
     def engine(self):
-        return (self._scale * self._apply_rotation(self._engine) +
-                self.position)
+        return self._placed("engine", self._engine)
 
     @property
     def gun(self):
-        return (self._scale * self._apply_rotation(self._gun) + self.position)
+        return self._placed("gun", self._gun)
 
     @property
     def colours(self):
@@ -118,7 +128,9 @@ class TriD(object):
 
     @yaw.setter
     def yaw(self, val):
-        self._yaw = val
+        if val != self._yaw:
+            self._yaw = val
+            self._invalidate()
 
     @property
     def pitch(self):
@@ -126,7 +138,9 @@ class TriD(object):
 
     @pitch.setter
     def pitch(self, val):
-        self._pitch = val
+        if val != self._pitch:
+            self._pitch = val
+            self._invalidate()
 
     @property
     def roll(self):
@@ -134,7 +148,9 @@ class TriD(object):
 
     @roll.setter
     def roll(self, val):
-        self._roll = val
+        if val != self._roll:
+            self._roll = val
+            self._invalidate()
 
     @property
     def scale(self):
@@ -142,11 +158,37 @@ class TriD(object):
 
     @scale.setter
     def scale(self, val):
-        self._scale = val
+        if val != self._scale:
+            self._scale = val
+            self._invalidate()
 
     @property
     def bounding_box(self):
-        return np.c_[self.positions.min(0), self.positions.max(0)].T
+        cached = self._placed_cache.get("bounding_box")
+        positions = self.positions
+
+        if cached is not None and cached[0] is positions:
+            return cached[1]
+
+        bounding_box = np.c_[positions.min(0), positions.max(0)].T
+        bounding_box.flags.writeable = False
+        self._placed_cache["bounding_box"] = (positions, bounding_box)
+
+        return bounding_box
+
+    def snapshot(self):
+        """
+        Returns a copy of the object that stays as this one is now, however
+        this one moves or explodes.
+        """
+
+        snapshot = copy.copy(self)
+        snapshot._position = np.array(self._position, dtype=float)
+        snapshot._patches = self._patches.copy()
+        snapshot._rotated_cache = dict(self._rotated_cache)
+        snapshot._placed_cache = dict(self._placed_cache)
+
+        return snapshot
 
     def _colourise(self):
         """
@@ -176,24 +218,80 @@ class TriD(object):
 
         self._normals = normals
 
+    def _invalidate(self):
+        """
+        Drops the cached rotation and everything rotated.
+        """
+
+        self._rotation = None
+        self._rotated_cache = {}
+        self._placed_cache = {}
+
+    def _rotation_matrix(self):
+        if self._rotation is None:
+            y = self.yaw
+            p = self.pitch
+            r = self.roll
+
+            Rx = np.array([[1, 0, 0],
+                           [0, np.cos(p), - np.sin(p)],
+                           [0, np.sin(p),   np.cos(p)]])
+
+            Ry = np.array([[ np.cos(r), 0, np.sin(r)],
+                           [        0,  1,        0],
+                           [-np.sin(r), 0, np.cos(r)]])
+
+            Rz = np.array([[np.cos(y), np.sin(y), 0],
+                           [-np.sin(y), np.cos(y), 0],
+                           [0, 0, 1]])
+
+            self._rotation = np.dot(Ry, np.dot(Rx, Rz)).T
+
+        return self._rotation
+
     def _apply_rotation(self, positions):
-        y = self.yaw
-        p = self.pitch
-        r = self.roll
+        return np.inner(positions, self._rotation_matrix())
+
+    def _rotated(self, name, local, scaled=False):
+        """
+        Returns local, an array in the coordinates of the object, rotated
+        (and scaled, if scaled), as cached under name. The cache holds until
+        the rotation or scale change, or another array is given for name.
+        """
 
-        Rx = np.array([[1, 0, 0],
-                       [0, np.cos(p), - np.sin(p)],
-                       [0, np.sin(p),   np.cos(p)]])
+        cached = self._rotated_cache.get(name)
 
-        Ry = np.array([[ np.cos(r), 0, np.sin(r)],
-                       [        0,  1,        0],
-                       [-np.sin(r), 0, np.cos(r)]])
+        if cached is not None and cached[0] is local:
+            return cached[1]
 
-        Rz = np.array([[np.cos(y), np.sin(y), 0],
-                       [-np.sin(y), np.cos(y), 0],
-                       [0, 0, 1]])
+        rotated = self._apply_rotation(local)
+        if scaled:
+            rotated = self._scale * rotated
+        rotated.flags.writeable = False
+        self._rotated_cache[name] = (local, rotated)
 
-        return np.inner(positions, np.dot(Ry, np.dot(Rx, Rz)).T)
+        return rotated
+
+    def _placed(self, name, local):
+        """
+        Returns local rotated, scaled and moved to the position of the
+        object, as cached under name. The cache holds as for _rotated, and
+        until the position changes.
+        """
+
+        rotated = self._rotated(name, local, scaled=True)
+        position = self.position
+        cached = self._placed_cache.get(name)
+
+        if (cached is not None and cached[0] is rotated and
+                (cached[1] == position).all()):
+            return cached[2]
+
+        placed = rotated + position
+        placed.flags.writeable = False
+        self._placed_cache[name] = (rotated, np.array(position), placed)
+
+        return placed
 
     @property
     def exploding(self):
@@ -211,15 +309,29 @@ class TriD(object):
     def exploded(self, val):
         self._exploded = True if val else False
 
+    @property
+    def random(self):
+        """
+        The numpy.random.Generator explosions are drawn from (by default,
+        an unseeded one).
+        """
+
+        return self._random
+
+    @random.setter
+    def random(self, val):
+        self._random = val
+
     def explode(self):
         if self.exploding:
             self._patches += (
-                (np.random.random(self.patches.shape) - 0.5) * 0.05
-                + np.random.random(self.patches.shape[0])[
+                (self._random.random(self.patches.shape) - 0.5) * 0.05
+                + self._random.random(self.patches.shape[0])[
                     :, np.newaxis, np.newaxis
                 ] * np.ones(self.patches.shape)
                 * self.normals[:, np.newaxis, :] * 0.15
             )
+            self._rotated_cache.pop("patches", None)
         else:
             self.exploding = True
 
@@ -812,6 +924,33 @@ class SimpleHouse(TriD):
         self._colourise()
 
 
+def rotations(yaws, pitches, rolls):
+    """
+    Returns the rotation matrices (shaped (N, 3, 3)) of TriD objects with
+    the given yaws, pitches and rolls: rotated vectors are vectors @ R, and
+    the rows of R are the orientation (U, V and W) of the object.
+    """
+
+    cy, sy = np.cos(yaws), np.sin(yaws)
+    cp, sp = np.cos(pitches), np.sin(pitches)
+    cr, sr = np.cos(rolls), np.sin(rolls)
+
+    R = np.empty(np.shape(yaws) + (3, 3))
+
+    # Ry . Rx . Rz, as in TriD._apply_rotation, multiplied out:
+    R[..., 0, 0] = cr * cy - sr * sp * sy
+    R[..., 0, 1] = cr * sy + sr * sp * cy
+    R[..., 0, 2] = sr * cp
+    R[..., 1, 0] = -cp * sy
+    R[..., 1, 1] = cp * cy
+    R[..., 1, 2] = -sp
+    R[..., 2, 0] = -sr * cy - cr * sp * sy
+    R[..., 2, 1] = -sr * sy + cr * sp * cy
+    R[..., 2, 2] = cr * cp
+
+    return R
+
+
 class TriDGroup(object):
     """
     What do I want from a TriDGroup?
@@ -821,26 +960,50 @@ class TriDGroup(object):
     * To get patches/colours/patch positions for a single model
     * To get all patches/colours/pach positions.
     * To get all objects centre positions
+
+    The model is kept once, in its own coordinates; each object is only a
+    position, a yaw, a pitch and a roll, and is transformed when asked for.
+    Exploding objects keep offsets to their patches.
+
+    Object data is returned as geometry arrays of policy.
     """
 
     X = U = 0
     Y = V = 1
     Z = W = 2
 
-    def __init__(self, model=House(), timeout=3):
-        self._model = model
-        N = self._model.patches.shape[0]
-        self._positions = np.empty((0, 3))
-        self._patches = np.empty((0, N, 3, 3))
-        self._patch_positions = np.empty((0, N, 3))
-        self._normals = np.empty((0, N, 3))
-        self._colours = np.empty((0, N, 4))
-        self._bboxes = np.empty((0, 2, 3))
-        self._yaws = np.empty((0))
-        self._pitchs = np.empty((0))
-        self._rolls = np.empty((0))
-        self._exploding = np.empty((0), dtype=object)
+    def __init__(self, model=House(), timeout=3, capacity=64, policy=None):
+        self._policy = dtypes.default() if policy is None else policy
+        self.model = model
+        self._size = 0
+        self._allocate(capacity)
+        self._offsets = {}
         self._timeout = dt.timedelta(seconds=timeout)
+        self._random = np.random.default_rng()
+
+    def _allocate(self, capacity):
+        positions = self._policy.zeros((capacity, 3))
+        yaws = np.zeros(capacity)
+        pitchs = np.zeros(capacity)
+        rolls = np.zeros(capacity)
+        exploding = np.zeros(capacity, dtype=object)
+
+        if self._size:
+            positions[: self._size] = self._positions[: self._size]
+            yaws[: self._size] = self._yaws[: self._size]
+            pitchs[: self._size] = self._pitchs[: self._size]
+            rolls[: self._size] = self._rolls[: self._size]
+            exploding[: self._size] = self._exploding[: self._size]
+
+        self._positions = positions
+        self._yaws = yaws
+        self._pitchs = pitchs
+        self._rolls = rolls
+        self._exploding = exploding
+
+    @property
+    def policy(self):
+        return self._policy
 
     @property
     def model(self):
@@ -849,82 +1012,198 @@ class TriDGroup(object):
     @model.setter
     def model(self, val):
         self._model = val
+        self._colours = self._policy.colours(val.colours)
+
+    @property
+    def capacity(self):
+        return self._yaws.shape[0]
 
     @property
     def number(self):
-        return self.positions.shape[0]
+        return self._size
 
     @property
     def positions(self):
-        return self._positions
+        return self._positions[: self._size]
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes taken by the object data.
+        """
+
+        return (self._positions.nbytes + self._yaws.nbytes +
+                self._pitchs.nbytes + self._rolls.nbytes +
+                self._exploding.nbytes +
+                sum(offsets.nbytes for offsets in self._offsets.values()))
+
+    def _transform(self, local, indices, scaled=True, placed=True):
+        """
+        Returns local, an array of the model in its own coordinates shaped
+        (P, ..., 3), rotated (and scaled, and moved, if scaled and placed)
+        as each of objects indices, in one go: shaped (len(indices), P, ...,
+        3).
+        """
+
+        indices = np.asarray(indices)
+        R = rotations(self._yaws[indices], self._pitchs[indices],
+                      self._rolls[indices])
+
+        # A batched matrix product, (P * ..., 3) @ (N, 3, 3); several
+        # times faster than the same einsum:
+        transformed = np.matmul(local.reshape((-1, 3)), R).reshape(
+            (indices.size,) + local.shape)
+
+        if scaled:
+            transformed *= self._model.scale
+        if placed:
+            shape = (indices.size,) + (1,) * (local.ndim - 1) + (3,)
+            transformed += self._positions[indices].reshape(shape)
+
+        return transformed
 
     def patches(self, indices):
-        N = self._patches.shape[1] * indices.size
-        return self._patches[indices].reshape((N, 3, 3))
+        indices = np.asarray(indices)
+        patches = self._transform(self._model._patches, indices)
+
+        for n, offsets in self._offsets.items():
+            patches[indices == n] += offsets
+
+        return self._policy.geometry(patches.reshape((-1, 3, 3)))
 
     def patch_positions(self, indices):
-        N = self._patch_positions.shape[1] * indices.size
-        return self._patch_positions[indices].reshape((N, 3))
+        return self._policy.geometry(
+            self._transform(self._model._positions, indices).reshape((-1, 3)))
 
     def normals(self, indices):
-        N = self._normals.shape[1] * indices.size
-        return self._normals[indices].reshape((N, 3))
+        return self._policy.geometry(
+            self._transform(self._model._normals, indices, scaled=False,
+                            placed=False).reshape((-1, 3)))
 
     def colours(self, indices):
-        N = self._colours.shape[1] * indices.size
-        return self._colours[indices].reshape((N, 4))
+        return np.tile(self._colours, (np.asarray(indices).size, 1))
 
     def bboxes(self, indices):
-        return self._bboxes[indices]
+        positions = self._transform(self._model._positions, indices)
+
+        return self._policy.geometry(
+            np.stack((positions.min(1), positions.max(1)), axis=1))
+
+    def reserve(self, n):
+        """
+        Makes sure there is room for n more objects.
+        """
+
+        if self._size + n > self.capacity:
+            capacity = max(self.capacity, 1)
+            while self._size + n > capacity:
+                capacity *= 2
+            self._allocate(capacity)
 
     def add_object(self, position, yaw=0.0, pitch=0.0, roll=0.0):
-        self._positions = np.r_[self._positions, position[np.newaxis]]
-        self._yaws = np.r_[self._yaws, yaw]
-        self._pitchs = np.r_[self._pitchs, pitch]
-        self._rolls = np.r_[self._rolls, roll]
-
-        self.model.position = position
-        self.model.yaw = yaw
-        self.model.pitch = pitch
-        self.model.roll = roll
-
-        self._patches = np.r_[self._patches, self.model.patches[np.newaxis]]
-        self._patch_positions = np.r_[self._patch_positions,
-                                      self.model.positions[np.newaxis]]
-        self._normals = np.r_[self._normals, self.model.normals[np.newaxis]]
-        self._colours = np.r_[self._colours, self.model.colours[np.newaxis]]
-        self._bboxes = np.r_[self._bboxes, self.model.bounding_box[np.newaxis]]
-        self._exploding = np.r_[self._exploding, [False]]
+        self.reserve(1)
+
+        n = self._size
+        self._positions[n] = position
+        self._yaws[n] = yaw
+        self._pitchs[n] = pitch
+        self._rolls[n] = roll
+        self._exploding[n] = False
+
+        self._size += 1
 
     def delete_object(self, n):
-        indices = np.arange(self._positions.shape[0]) != n
-        self._positions = self._positions[indices]
-        self._yaws = self._yaws[indices]
-        self._pitchs = self._pitchs[indices]
-        self._rolls = self._rolls[indices]
-        self._patches = self._patches[indices]
-        self._patch_positions = self._patch_positions[indices]
-        self._normals = self._normals[indices]
-        self._colours = self._colours[indices]
-        self._bboxes = self._bboxes[indices]
-        self._exploding = self._exploding[indices]
+        self.delete_objects([n])
+
+    def delete_objects(self, indices):
+        """
+        Deletes the objects with the given (unique) indices, filling the
+        holes with the last objects, as ParticleEngine.remove does.
+        """
+
+        if not len(indices):
+            return
+
+        size = self._size - len(indices)
+
+        deleted = np.zeros(self._size, dtype=bool)
+        deleted[indices] = True
+        holes = np.where(deleted[: size])[0]
+        fillers = size + np.where(~deleted[size:])[0]
+
+        for array in (self._positions, self._yaws, self._pitchs,
+                      self._rolls, self._exploding):
+            array[holes] = array[fillers]
+
+        self._exploding[size: self._size] = False
+        self._size = size
+
+        moved = dict(zip(fillers, holes))
+        self._offsets = dict((moved.get(n, n), offsets)
+                             for n, offsets in self._offsets.items()
+                             if not deleted[n] or n in moved)
 
     @property
     def exploding(self):
-        return self._exploding
+        return self._exploding[: self._size]
 
     @property
     def timeout(self):
         return self._timeout
 
-    def explode_object(self, n):
+    @property
+    def random(self):
+        """
+        The numpy.random.Generator explosions are drawn from (by default,
+        an unseeded one).
+        """
+
+        return self._random
+
+    @random.setter
+    def random(self, val):
+        self._random = val
+
+    def snapshot(self):
+        """
+        Returns a copy of the group, with copies of the object data, that
+        stays as this one is now, however objects are added, deleted or
+        explode. Its object data is read-only.
+        """
+
+        snapshot = copy.copy(self)
+
+        for name in ("_positions", "_yaws", "_pitchs", "_rolls",
+                     "_exploding"):
+            array = getattr(self, name)[: self._size].copy()
+            array.flags.writeable = False
+            setattr(snapshot, name, array)
+
+        snapshot._offsets = {}
+        for n, offsets in self._offsets.items():
+            offsets = offsets.copy()
+            offsets.flags.writeable = False
+            snapshot._offsets[n] = offsets
+
+        return snapshot
+
+    def explode_object(self, n, now=None):
+        """
+        Sets object n exploding at time now (by default, the current date
+        and time), or, if it is exploding already, blows it further apart.
+        """
+
         if self._exploding[n]:
-            self._patches[n] += (
-                (np.random.random(self._patches[n].shape) - 0.5) * 0.15
-                + np.random.random(self._patches[n].shape[0])[
+            shape = self._model._patches.shape
+            normals = self._transform(self._model._normals, [n],
+                                      scaled=False, placed=False)[0]
+            offsets = self._offsets.setdefault(n, np.zeros(shape))
+            offsets += (
+                (self._random.random(shape) - 0.5) * 0.15
+                + self._random.random(shape[0])[
                     :, np.newaxis, np.newaxis
-                ] * np.ones(self._patches[n].shape)
-                * self._normals[n, :, np.newaxis, :] * 0.05
+                ] * np.ones(shape)
+                * normals[:, np.newaxis, :] * 0.05
             )
         else:
-            self._exploding[n] = dt.datetime.now()
+            self._exploding[n] = dt.datetime.now() if now is None else now
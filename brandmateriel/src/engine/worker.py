@@ -0,0 +1,87 @@
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class Worker(object):
+    """
+    The Worker runs jobs on a thread of its own, one at a time, so that the
+    calling thread can get on with something else meanwhile: submit hands
+    it a job (a function and its arguments), and wait waits for the job to
+    finish and returns its result. Exceptions raised by a job are raised
+    again by wait, in the calling thread.
+
+    Jobs run truly in parallel only where they release the GIL, as NumPy
+    does for most array maths.
+
+    The thread is a daemon, so a Worker that is never closed does not keep
+    the program alive.
+    """
+
+    def __init__(self, name="worker"):
+        self._jobs = queue.Queue(1)
+        self._results = queue.Queue(1)
+        self._pending = False
+
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """
+        Whether a job has been submitted and not waited for.
+        """
+
+        return self._pending
+
+    @property
+    def alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+
+            if job is None:
+                return
+
+            function, args = job
+
+            try:
+                self._results.put((True, function(*args)))
+            except Exception as error:
+                self._results.put((False, error))
+
+    def submit(self, function, *args):
+        if self._pending:
+            raise RuntimeError("worker is busy")
+
+        self._pending = True
+        self._jobs.put((function, args))
+
+    def wait(self):
+        if not self._pending:
+            return None
+
+        done, result = self._results.get()
+        self._pending = False
+
+        if not done:
+            raise result
+
+        return result
+
+    def close(self):
+        """
+        Waits for the pending job, if any, and stops the thread.
+        """
+
+        try:
+            self.wait()
+        finally:
+            self._jobs.put(None)
+            self._thread.join()
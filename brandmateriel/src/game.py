@@ -7,16 +7,40 @@ import numpy as np
 import pygame
 from pygame import locals as l
 from . import engine as e
+from .simulation import Simulation, SimulationThread
+from .recording import Recording
 
 KEYBOARD = {l.K_UP: 'up', l.K_k: 'up', l.K_w: 'up',
             l.K_DOWN: 'down', l.K_j: 'down', l.K_s: 'down',
             l.K_LEFT: 'left', l.K_h: 'left', l.K_a: 'left',
             l.K_RIGHT: 'right', l.K_l: 'right', l.K_d: 'right',
             l.K_RETURN: 'start', l.K_SPACE: 'start',
-            l.K_ESCAPE: 'quit', l.K_F1: 'help', l.K_TAB: 'pause'
+            l.K_ESCAPE: 'quit', l.K_F1: 'help', l.K_TAB: 'pause',
+            l.K_F3: 'profile', l.K_F4: 'export'
             }
 
 
+class Viewpoint(object):
+    """
+    What a frame is prepared with: a camera, the light source that follows
+    it, a shader, a culler and a terrain window (see Map.new_window), and
+    where the player was when the camera last moved.
+
+    Each render queue has a viewpoint of its own, so that in pipelined mode
+    the worker thread and the main thread share nothing but snapshots.
+    """
+
+    def __init__(self, camera, light_source, shader, culler, window, focus,
+                 focus_yaw):
+        self.camera = camera
+        self.light_source = light_source
+        self.shader = shader
+        self.culler = culler
+        self.window = window
+        self.focus = focus
+        self.focus_yaw = focus_yaw
+
+
 class Game(object):
     """
     Here be docstring.
@@ -32,81 +56,123 @@ class Game(object):
 
         self._config = config
         self._sensitivity = np.pi / config["control"]
-        self._dt = 1.0 / fps
-
-        print( "initialising world map ... ", end=" " )
-        self.world = e.mapper.Map(world)
+        # The simulation runs in fixed steps of dt, whatever the frame rate;
+        # frame_time is the time a frame takes at the intended frame rate:
+        self._frame_time = 1.0 / fps
+        self._dt = 1.0 / self._config.get("physics rate", 60.0)
+        self._max_steps = self._config.get("max steps", 5)
+        self._accumulator = 0.0
+
+        # With "replay", inputs are played back from a recording, instead of
+        # read from pygame; with "record", they are recorded (see
+        # Recording):
+        self._frame = 0
+        self._replay = None
+        self._recording = None
+        seed = None
+
+        if self._config.get("replay"):
+            self._replay = Recording(self._config["replay"])
+            seed = self._replay.seed
+
+        print( "initialising world ... ", end=" " )
+        self.simulation = Simulation(config, world, self._dt,
+                                     self._frame_time, seed)
+        self.world = self.simulation.world
+        self.player = self.simulation.player
+        self.houses = self.simulation.houses
+        self.particles = self.simulation.particles
         print( "DONE" )
 
+        # Input goes into actions, which are handed to the simulation (see
+        # Simulation); what is drawn follows a snapshot of the simulation:
+        self._actions = {"yaw": self.player.yaw, "pitch": self.player.pitch,
+                         "thrust": False, "fire": False, "rocket": False}
+        self._snapshot = None
+
+        if self._config.get("record"):
+            self._recording = Recording(seed=self.simulation.seed)
+
         print( "loading fonts ... ", end= " ")
         fontsize = int( fontsize * config["resolution"][0] / 320 )
         self._font = pygame.font.Font(font, fontsize)
         print( "DONE" )
 
-        print( "loading game objects ... ", end=" ")
-        if not self._config[" "]:
-            self.player = e.mobs.Player(e.triDobjects.FireFighter(scale=2.0))
-            # self.player = e.mobs.Player(e.triDobjects.Pika(scale=3.0))
-        else:
-            self.player = e.mobs.Player(e.triDobjects.Lander(scale=1.0))
-
-        self.player.position = (np.array([64.0, 64.0, 5.0]))
-        print( "DONE" )
-
         print( "seting up camera ... ", end=" ")
-        self.camera = e.camera.Camera(screen=e.camera.Screen(
-            resolution=config["resolution"]))
+        policy = self.simulation.policy
 
-        if config["camera"] == "fixed":
-            self.update_camera = self.update_fixed_camera
-            D = self._view[self.Y]
-            h = (self.camera.screen.extent[self.Y] * 0.5 -
-                 self.camera.screen.position[self.Z])
-            d = self.camera.distance
-        elif config["camera"] == "rear":
+        if config["camera"] == "rear":
             self.update_camera = self.update_rear_camera
             self.config["view"] = (self._view[0], self._view[0])
             D = self._view[self.Y] * (1 + np.sqrt(2)) * 0.5
-            h = (self.camera.screen.extent[self.Y] * 0.5 -
-                 self.camera.screen.position[self.Z])
-            d = self.camera.distance
         else:
             self.update_camera = self.update_fixed_camera
             D = self._view[self.Y]
-            h = (self.camera.screen.extent[self.Y] * 0.5 -
-                 self.camera.screen.position[self.Z])
-            d = self.camera.distance
-
-        self._culling_height = np.ceil((h * (D / d + 1.0) + np.ceil(
-            self.world.patch_positions[:, :, self.Z].max())))
-        self._star_field_height = self._culling_height
 
-        self.light_source = e.shader.LightSource()
+        self._viewpoint = self.new_viewpoint()
 
-        self.shader = e.shader.Shader(self.light_source,
-                                      cutoff_distance=self._view[self.Y] * 0.5
-                                      + self.camera.distance,
-                                      linear_distance=self._view[self.Y] *
-                                      0.75)
+        h = (self.camera.screen.extent[self.Y] * 0.5 -
+             self.camera.screen.position[self.Z])
+        d = self.camera.distance
 
-        self.update_camera()
+        self._culling_height = np.ceil((h * (D / d + 1.0) + np.ceil(
+            self.world.max_height)))
+        self._star_field_height = self._culling_height
         print( "DONE" )
 
-        print( "initialising game objects ... ", end=" " )
-        self._populate_world()
-        self.shots = e.particles.Shots()
-        self.shrapnel = e.particles.Shrapnel()
-        self.exhaust = e.particles.Exhaust()
-        self.star_field = e.particles.Stars(int(0.25 * self._view[0] ** 2),
-                                            self._view + self.camera.distance
-                                            - 0.5,
-                                            min_height=self._star_field_height)
+        print( "initialising stars ... ", end=" " )
+        self.particles.add_stars(int(0.25 * self._view[0] ** 2),
+                                 self._view + self.camera.distance - 0.5,
+                                 min_height=self._star_field_height)
         print( "DONE" )
 
         self._pause = False
         self._gameover = False
-        self._gameover_timer = None
-        self._points = 0
+
+        self._renderer = self._config.get("renderer", "pygame")
+        # View depths beyond which terrain cells are merged 2 x 2, 4 x 4 and
+        # so on (see Map.lod_lists):
+        self._lod = self._config.get("lod")
+        self.render_queue = e.renderqueue.RenderQueue(policy=policy)
+
+        # In pipelined mode, a worker thread prepares the next frame into the
+        # back queue while the main thread draws this one from render_queue,
+        # at the cost of showing every frame one frame late:
+        self._pipeline = self._config.get("pipeline", False)
+        self._prepared = False
+        self._back_queue = None
+        self._back_viewpoint = None
+        self._worker = None
+        if self._pipeline:
+            try:
+                self._worker = e.worker.Worker("prepare frame")
+                self._back_queue = e.renderqueue.RenderQueue(policy=policy)
+                self._back_viewpoint = self.new_viewpoint()
+            except RuntimeError:
+                print( "worker thread not available; drawing single-threaded" )
+                self._pipeline = False
+        self._shadow_colour = np.array([0, 0, 0, 1])
+        self._zbuffer = None
+
+        self.profiler = e.profiler.Profiler(
+            enabled=self._config.get("profile", False))
+        self._show_profile = self.profiler.enabled
+
+        # With "simulation thread", the simulation steps in real time on a
+        # thread of its own, and frames draw its latest snapshot. Replays
+        # and recordings stay on the main thread, since only there do steps
+        # follow the recorded frames:
+        self._simulation_thread = None
+        self._steps = 0
+        if self._config.get("simulation thread", False):
+            if self._replay is not None:
+                print( "replaying on the main thread" )
+            elif self._recording is not None:
+                print( "recording on the main thread" )
+            else:
+                self._simulation_thread = SimulationThread(self.simulation,
+                                                           self._max_steps)
+                self._simulation_thread.start()
 
         pygame.mouse.get_rel()
 
@@ -120,64 +186,130 @@ class Game(object):
     def config(self, val):
         self._config = val
 
+    @property
+    def replay(self):
+        return self._replay
+
+    @property
+    def recording(self):
+        return self._recording
+
+    @property
+    def actions(self):
+        """
+        Returns the actions (see Simulation) that input goes into, and
+        that do_step hands to the simulation.
+        """
+
+        return self._actions
+
+    @property
+    def snapshot(self):
+        """
+        Returns the latest snapshot of the simulation (see
+        Simulation.snapshot) taken by do_step, or None before the first.
+        """
+
+        return self._snapshot
+
+    @property
+    def simulation_thread(self):
+        return self._simulation_thread
+
     @property
     def focus_position(self):
-        return self.player.position
+        """
+        Returns the position of the player as last drawn.
+        """
+
+        return self._viewpoint.focus
+
+    @property
+    def camera(self):
+        return self._viewpoint.camera
+
+    @property
+    def light_source(self):
+        return self._viewpoint.light_source
+
+    @property
+    def shader(self):
+        return self._viewpoint.shader
+
+    @property
+    def culler(self):
+        return self._viewpoint.culler
 
     @property
     def _view(self):
         return self._config["view"]
 
-    def update_fixed_camera(self):
-        offset = np.array([0, self._view[self.Y] / 2.0 + 9.0, -0.0])
+    def new_viewpoint(self):
+        """
+        Returns a new Viewpoint, looking at the player.
+        """
 
-        self.camera.position = self.focus_position - offset
+        policy = self.simulation.policy
+        camera = e.camera.Camera(screen=e.camera.Screen(
+            resolution=self._config["resolution"]), policy=policy)
 
-        self.camera.position[self.Z] = max(self.camera.position[self.Z], 6.0)
+        light_source = e.shader.LightSource()
 
-        self.light_source.position = self.camera.position + np.array([0, 0, 0])
+        shader = e.shader.Shader(light_source,
+                                 cutoff_distance=self._view[self.Y] * 0.5 +
+                                 camera.distance,
+                                 linear_distance=self._view[self.Y] * 0.75,
+                                 policy=policy)
 
-    def update_rear_camera(self):
-        look_at = self.focus_position.copy()
-        look_at[self.Z] = max(look_at[self.Z], 6.0)
-        offset = self._view[self.Y] / 2.0 + 9.0
+        culler = e.culling.Culler(
+            self._config["resolution"], fog_distance=shader.fog_distance,
+            policy=policy)
+
+        viewpoint = Viewpoint(camera, light_source, shader, culler,
+                              self.world.new_window(),
+                              self.player.position.copy(), self.player.yaw)
+        self.update_camera(viewpoint)
+
+        return viewpoint
+
+    def update_fixed_camera(self, viewpoint):
+        camera = viewpoint.camera
+        offset = np.array([0, self._view[self.Y] / 2.0 + 9.0, -0.0])
+
+        camera.position = viewpoint.focus - offset
 
-        self.camera.position = (look_at - offset *
-                                np.array([-np.sin(self.player.model.yaw),
-                                          np.cos(self.player.model.yaw), 0.0]))
+        camera.position[self.Z] = max(camera.position[self.Z], 6.0)
 
-        self.camera.look_at_point(look_at)
+        light_source = viewpoint.light_source
+        light_source.position = camera.position + np.array([0, 0, 0])
 
-        self.light_source.position = self.camera.position + np.array([0, 0, 0])
+    def update_rear_camera(self, viewpoint):
+        camera = viewpoint.camera
+        look_at = viewpoint.focus.copy()
+        look_at[self.Z] = max(look_at[self.Z], 6.0)
+        offset = self._view[self.Y] / 2.0 + 9.0
 
-    def _populate_world(self):
-        n_houses = 42
-        settlements = e.triDobjects.TriDGroup(
-            model=e.triDobjects.House(scale=0.618),
-            timeout=0.5,
-        )
-        angles = 2 * np.pi * np.random.random(n_houses)
-        candidates = self.world.map_positions.copy()
+        camera.position = (look_at - offset *
+                           np.array([-np.sin(viewpoint.focus_yaw),
+                                     np.cos(viewpoint.focus_yaw), 0.0]))
 
-        for n in range(n_houses):
-            x, y = (np.random.random(2) * self.world.shape).astype(int)
-            X, Y = np.mgrid[x - 1: x + 2, y - 1: y + 2]
-            X %= self.world.shape[self.X]
-            Y %= self.world.shape[self.Y]
+        camera.look_at_point(look_at)
 
-            while((candidates[X, Y, self.Z] <= 0).any()):
-                x, y = (np.random.random(2) * self.world.shape).astype(int)
-                X, Y = np.mgrid[x - 1: x + 2, y - 1: y + 2]
-                X %= self.world.shape[self.X]
-                Y %= self.world.shape[self.Y]
+        light_source = viewpoint.light_source
+        light_source.position = camera.position + np.array([0, 0, 0])
 
-            settlements.add_object(
-                position=np.array([x, y, candidates[x, y, self.Z]]),
-                yaw=angles[n])
+    def close_pipeline(self):
+        """
+        Stops the worker thread of pipelined mode, and goes on
+        single-threaded.
+        """
 
-            candidates[X, Y, self.Z] *= 0
+        if self._worker is not None:
+            self._worker.close()
+            self._worker = None
 
-        self.houses = settlements
+        self._pipeline = False
+        self._prepared = False
 
     def close_game(self):
         """ Close game. """
@@ -186,9 +318,20 @@ class Game(object):
 
         return "quit"
 
+    def stop_simulation_thread(self):
+        """
+        Stops the simulation thread, if any, after the step it is taking;
+        only then may the main thread change the simulation.
+        """
+
+        if self._simulation_thread is not None:
+            self._simulation_thread.stop()
+            self._simulation_thread = None
+
     def return_to_menu(self):
         """ Close game. """
 
+        self.stop_simulation_thread()
         self.player.velocity *= 0.0
         return "menu"
 
@@ -210,23 +353,33 @@ class Game(object):
 
                 elif KEYBOARD[event.key] == 'left':
 
-                    self.player.yaw = ((self.player.yaw + np.pi / 24) %
-                                       (2 * np.pi))
+                    self._actions["yaw"] = ((self._actions["yaw"] +
+                                             np.pi / 24) % (2 * np.pi))
 
                 elif KEYBOARD[event.key] == 'right':
 
-                    self.player.yaw = ((self.player.yaw - np.pi / 24) %
-                                       (2 * np.pi))
+                    self._actions["yaw"] = ((self._actions["yaw"] -
+                                             np.pi / 24) % (2 * np.pi))
 
                 elif KEYBOARD[event.key] == 'up':
 
-                    self.player.pitch = min(self.player.pitch + np.pi / 24,
-                                            np.pi * 0.5)
+                    self._actions["pitch"] = min(
+                        self._actions["pitch"] + np.pi / 24, np.pi * 0.5)
 
                 elif KEYBOARD[event.key] == 'down':
 
-                    self.player.pitch = max(self.player.pitch - np.pi / 24,
-                                            -np.pi * 0.5)
+                    self._actions["pitch"] = max(
+                        self._actions["pitch"] - np.pi / 24, -np.pi * 0.5)
+
+                elif KEYBOARD[event.key] == 'profile':
+
+                    self._show_profile = not self._show_profile
+
+                    self.profiler.enabled = self._show_profile
+
+                elif KEYBOARD[event.key] == 'export':
+
+                    self.export_profile()
 
                 elif KEYBOARD[event.key] == 'pause':
 
@@ -247,19 +400,20 @@ class Game(object):
 
                 motion = np.array(pygame.mouse.get_rel())
 
-                self.player.yaw = (self.player.yaw - motion[self.X] *
-                                   self._sensitivity) % (2 * np.pi)
+                self._actions["yaw"] = (self._actions["yaw"] -
+                                        motion[self.X] *
+                                        self._sensitivity) % (2 * np.pi)
 
-                self.player.pitch = (self.player.pitch - motion[self.Y] *
-                                     self._sensitivity)
+                self._actions["pitch"] = (self._actions["pitch"] -
+                                          motion[self.Y] * self._sensitivity)
 
-                if self.player.pitch < -2.0 * np.pi / 3.0:
+                if self._actions["pitch"] < -2.0 * np.pi / 3.0:
 
-                    self.player.pitch = -2.0 * np.pi / 3.0
+                    self._actions["pitch"] = -2.0 * np.pi / 3.0
 
-                elif self.player.pitch > 3.0 * np.pi / 4.0:
+                elif self._actions["pitch"] > 3.0 * np.pi / 4.0:
 
-                    self.player.pitch = 3.0 * np.pi / 4.0
+                    self._actions["pitch"] = 3.0 * np.pi / 4.0
 
             elif event.type == l.MOUSEBUTTONDOWN:
 
@@ -267,15 +421,15 @@ class Game(object):
 
                     if event.button == 1:
 
-                        self.player.fire = True
+                        self._actions["fire"] = True
 
                     elif event.button == 2:
 
-                        self.player.rocket = True
+                        self._actions["rocket"] = True
 
                     elif event.button == 3:
 
-                        self.player.thrust = True
+                        self._actions["thrust"] = True
 
                 else:
 
@@ -289,264 +443,497 @@ class Game(object):
 
                 if event.button == 1:
 
-                    self.player.fire = False
+                    self._actions["fire"] = False
 
                 elif event.button == 2:
 
-                    self.player.rocket = False
+                    self._actions["rocket"] = False
 
                 elif event.button == 3:
 
-                    self.player.thrust = False
+                    self._actions["thrust"] = False
 
         return flag
 
-    def draw_patches(self, positions, patches, colours, surface):
-        # draw objects and particles:
-        order = np.argsort(-((positions - self.camera.position) ** 2).mean(-1))
-
-        for n in order:
-            if colours[n, 3]:
-                pygame.draw.polygon(surface, colours[n], patches[n])
-                pygame.draw.polygon(surface, colours[n], patches[n], 1)
-
-    def get_particle_patches(self, particles, view):
-        if particles.number and particles.visible:
-            positions = particles.patch_positions.copy()
-            positions = self.world.fix_view(self.focus_position, view,
-                                            positions)
-            in_view = self.world.positions_in_view(self.focus_position, view,
-                                                   positions)
-
-            if in_view.size:
-                positions = positions[in_view]
-                patches = self.world.fix_view(
-                    self.focus_position, view,
-                    particles.patches[in_view])
-
-                if self.camera.position[self.Z] < self._culling_height:
-                    shadows, shadow_positions = e.shadow.get_shadows(
-                        patches.copy(), self.world)
-                    shadows, shadow_depths = \
-                        self.camera.get_screen_coordinates(shadows)
-                    shadow_colours = np.array([[0, 0, 0, 1]]) * np.ones(
-                        (shadows.shape[0], 1))
+    def replay_inputs(self):
+        """
+        Sets the inputs of the current frame from the replay, and returns
+        the time the frame advances the simulation by. Past the end of the
+        replay, inputs are kept and the simulation is not advanced.
+        """
 
-                else:
-                    shadow_positions = np.empty((0, 3))
-                    shadows = np.empty((0, 4, 2))
-                    shadow_colours = np.empty((0, 4))
+        if self._frame >= self._replay.number:
+            return 0.0
 
-                (patches, depths) = self.camera.get_screen_coordinates(patches)
-                colours = particles.patch_colours[in_view]
-                colours = self.shader.apply_lighting(positions, positions,
-                                                     colours, scatter=False)
+        actions = self._actions
+        (elapsed, actions["yaw"], actions["pitch"], actions["thrust"],
+         actions["fire"], actions["rocket"],
+         self._pause) = self._replay.frame(self._frame)
 
-            else:
-                positions = np.empty((0, 3))
-                patches = np.empty((0, 3, 2))
-                colours = np.empty((0, 4))
+        return elapsed
 
-                shadow_positions = np.empty((0, 3))
-                shadows = np.empty((0, 4, 2))
-                shadow_colours = np.empty((0, 4))
+    def record_inputs(self, elapsed):
+        """
+        Records the inputs of the current frame.
+        """
 
-        else:
-            positions = np.empty((0, 3))
-            patches = np.empty((0, 3, 2))
-            colours = np.empty((0, 4))
+        actions = self._actions
+        self._recording.record(elapsed, actions["yaw"], actions["pitch"],
+                               actions["thrust"], actions["fire"],
+                               actions["rocket"], self._pause)
 
-            shadow_positions = np.empty((0, 3))
-            shadows = np.empty((0, 4, 2))
-            shadow_colours = np.empty((0, 4))
+    def export_profile(self, basename=None):
+        """
+        Writes collected profiling data as CSV and as Chrome trace-event JSON.
+        """
 
-        return (positions, patches, colours, shadow_positions, shadows,
-                shadow_colours)
+        if basename is None:
+            basename = "profile-{0}".format(
+                dt.datetime.now().strftime("%Y%m%d-%H%M%S"))
 
-    def do_step(self, surface):
-        flag = self.handle_inputs()
+        self.profiler.to_csv(basename + ".csv")
+        self.profiler.to_trace(basename + ".json")
 
-        # get map in view:
-        if self.camera.position[self.Z] < self._culling_height:
-            map_positions = self.world.patch_positions_list(
-                self.focus_position, self._view)
-            map_normals = self.world.normals_list(self.focus_position,
-                                                  self._view)
-            map_patches, map_depths = self.camera.get_screen_coordinates(
-                self.world.patches_list(self.focus_position, self._view))
-            map_colours = self.world.colours_list(self.focus_position,
-                                                  self._view)
-            map_colours = self.shader.apply_lighting(map_positions,
-                                                     map_normals,
-                                                     map_colours,
-                                                     culling=False)
+        print( "profile written to {0}.csv and {0}.json".format(basename) )
+
+    def draw_profile(self, surface):
+        """
+        Draws mean stage timings and counters over the game.
+        """
+
+        total, timings, counters = self.profiler.summary()
+
+        lines = ["frame {0:6.2f} ms".format(total * 1000.0)]
+        lines.extend("{0:<10.10} {1:6.2f} ms".format(name, t * 1000.0)
+                     for name, t in timings)
+        lines.extend("{0:<10.10} {1:6.0f}".format(name, n)
+                     for name, n in counters)
+
+        colour = (204, 153, 153)
+        height = self._font.get_linesize()
+
+        for n, line in enumerate(lines):
+            text = self._font.render(line, False, colour)
+            surface.blit(text, (height, height * (n + 1)))
+
+    def draw_queue(self, surface, queue=None):
+        """
+        Draws the render queue (by default, render_queue), by layer and far
+        to near within each layer.
+        """
+
+        if queue is None:
+            queue = self.render_queue
+
+        if self._renderer == "zbuffer":
+            with self.profiler.scope("draw"):
+                self.fill_patches_zbuffered(surface, queue)
+            return
+
+        with self.profiler.scope("sort"):
+            order = queue.order()
+
+        with self.profiler.scope("draw"):
+            if self._renderer == "numpy" and order.size:
+                self.fill_patches(surface, queue.vertices[order],
+                                  queue.colours[order])
+            else:
+                vertices = queue.vertices
+                counts = queue.counts
+                colours = queue.colours
+                for n in order:
+                    patch = vertices[n, : counts[n]]
+                    pygame.draw.polygon(surface, colours[n], patch)
+                    pygame.draw.polygon(surface, colours[n], patch, 1)
+
+    def fill_patches_zbuffered(self, surface, queue=None):
+        """
+        Rasterises the whole render queue (by default, render_queue), in
+        submission order, using a per-pixel depth buffer instead of sorting.
+        """
+
+        if queue is None:
+            queue = self.render_queue
+        visible = queue.visible()
+
+        try:
+            pixels = pygame.surfarray.pixels2d(surface)
+        except ValueError:
+            print( "zbuffer renderer not supported by display; using pygame" )
+            self._renderer = "pygame"
+            self.draw_queue(surface, queue)
+            return
+
+        if self._zbuffer is None or self._zbuffer.shape != pixels.shape:
+            self._zbuffer = np.zeros(pixels.shape, dtype=np.float32)
         else:
-            map_positions = np.empty((0, 3))
-            map_normals = np.empty((0, 3))
-            map_patches = np.empty((0, 4, 2))
-            map_colours = np.empty((0, 4))
-
-        # explode houses:
-        if np.any(self.houses.exploding):
-            for ind, t in enumerate(self.houses.exploding):
-                if t:
-                    if (dt.datetime.now() - t > self.houses.timeout):
-                        self.houses.delete_object(ind)
-                        break
-                    else:
-                        self.houses.explode_object(ind)
+            self._zbuffer[...] = 0.0
+
+        if visible.size:
+            e.raster.fill_patches_zbuffered(
+                pixels, self._zbuffer, queue.vertices[visible],
+                queue.vertex_depths[visible], queue.colours[visible],
+                surface.get_shifts(), surface.get_losses(),
+                queue.depth_bias(visible), centre=self.camera.centre)
+
+        del pixels
+
+    def fill_patches(self, surface, patches, colours):
+        """
+        Rasterises patches directly into the pixels of surface, falling back
+        on pygame.draw for surfaces that cannot be referenced as pixel arrays.
+        """
+
+        try:
+            if surface.get_bytesize() == 4:
+                pixels = pygame.surfarray.pixels2d(surface)
+                shifts = surface.get_shifts()
+            else:
+                pixels = pygame.surfarray.pixels3d(surface)
+                shifts = None
+        except ValueError:
+            print( "numpy renderer not supported by display; using pygame" )
+            self._renderer = "pygame"
+            for patch, colour in zip(patches, colours):
+                if colour[3]:
+                    pygame.draw.polygon(surface, colour, patch)
+                    pygame.draw.polygon(surface, colour, patch, 1)
+            return
+
+        e.raster.fill_patches(pixels, patches, colours, shifts,
+                              surface.get_losses(), outline=True)
+
+        del pixels
+
+    def cull(self, viewpoint, patches, depths, positions, normals=None):
+        """
+        Returns the indices of the patches (projected by the camera of
+        viewpoint) that survive culling; see Culler. Normals are needed for
+        back-face culling only.
+        """
+
+        with self.profiler.scope("culling"):
+            return viewpoint.culler.cull(patches, depths, positions,
+                                         viewpoint.camera.position, normals)
+
+    def queue_particles(self, viewpoint, view, queue, particles, alpha):
+        """
+        Projects, lights and queues all particles (a ParticleEngine, or a
+        snapshot of one) in view of viewpoint, alpha of the way from their
+        previous positions, and their shadows.
+        """
+
+        camera = viewpoint.camera
+        shown = particles.shown()
+
+        if not shown.size:
+            return
+
+        centres = self.world.fix_view(viewpoint.focus, view,
+                                      particles.interpolated(shown, alpha))
+        in_view = self.world.positions_in_view(viewpoint.focus, view,
+                                               centres)
+
+        if not in_view.size:
+            return
+
+        patches, positions = particles.patches(shown[in_view],
+                                               centres[in_view])
+
+        if camera.position[self.Z] < self._culling_height:
+            with self.profiler.scope("shadows"):
+                shadows, shadow_positions = e.shadow.get_shadows(
+                    patches.copy(), self.world)
+                shadows, shadow_depths = \
+                    camera.get_screen_coordinates(shadows)
+            visible = self.cull(viewpoint, shadows, shadow_depths,
+                                shadow_positions)
+            queue.push(shadows[visible], self._shadow_colour,
+                       shadow_positions[visible], camera.position,
+                       queue.SHADOWS, shadow_depths[visible])
+
+        with self.profiler.scope("project"):
+            (patches, depths) = camera.get_screen_coordinates(patches)
+
+        visible = self.cull(viewpoint, patches, depths, positions)
+        positions = positions[visible]
+
+        with self.profiler.scope("lighting"):
+            colours = particles.patch_colours(shown[in_view])[visible]
+            colours = viewpoint.shader.apply_lighting(positions, positions,
+                                                      colours, scatter=False)
+
+        queue.push(patches[visible], colours, positions,
+                   camera.position, depths=depths[visible])
+
+    @property
+    def alpha(self):
+        """
+        Returns how far (as a fraction of a step) the time of the frame is
+        past the last simulation step.
+        """
+
+        return self._accumulator / self._dt
+
+    def interpolated_position(self, snapshot, alpha):
+        """
+        Returns the position of the player alpha of the way from its
+        position a step before snapshot to its position in snapshot.
+        """
+
+        shape = np.array(self.world.shape + (np.inf,))
+        delta = snapshot.position - snapshot.previous_position
+        delta[: 2] = (delta[: 2] + shape[: 2] * 0.5) % shape[: 2] - \
+            shape[: 2] * 0.5
+
+        return snapshot.position - (1.0 - alpha) * delta
+
+    def advance(self, elapsed=None):
+        """
+        Advances the simulation by elapsed seconds (by default, one frame at
+        the intended frame rate), in fixed steps of dt. Left-over time is
+        carried over to the next call, and used to interpolate what is
+        drawn. At most max_steps steps are taken; time beyond that is
+        dropped, so that a slow frame slows the game down rather than
+        making the next frame slower still.
+
+        Returns the number of steps taken.
+        """
+
+        if elapsed is None:
+            elapsed = self._frame_time
+
+        self._accumulator += elapsed
+        self.simulation.apply_actions(self._actions)
+
+        steps = 0
+        while self._accumulator >= self._dt:
+            if steps == self._max_steps:
+                self._accumulator %= self._dt
+                break
+            self.simulation.simulate(self._dt)
+            self._accumulator -= self._dt
+            steps += 1
+
+        return steps
+
+    def prepare_frame(self, queue, viewpoint, snapshot, alpha):
+        """
+        Fills queue with everything in view of viewpoint in snapshot (see
+        Simulation.snapshot), projected, lit and culled, with the player
+        alpha of the way from the step before to the snapshot.
+
+        Only the snapshot and viewpoint are read and changed, never the
+        simulation itself, so this can run on the worker thread of
+        pipelined mode while the simulation steps on and the main thread
+        draws with another viewpoint.
+        """
+
+        houses = snapshot.houses
+        particles = snapshot.particles
+        model = snapshot.model
+
+        # Draw the player (and look from where it is) at the time of the
+        # frame:
+        viewpoint.focus = self.interpolated_position(snapshot, alpha)
+        viewpoint.focus_yaw = snapshot.yaw
+        shift = viewpoint.focus - snapshot.position
+        self.update_camera(viewpoint)
+
+        camera = viewpoint.camera
+        shader = viewpoint.shader
+        focus = viewpoint.focus
+
+        queue.clear()
+        viewpoint.culler.reset()
+
+        # get map in view:
+        if camera.position[self.Z] < self._culling_height:
+            with self.profiler.scope("slice"):
+                if self._lod:
+                    (map_patches, map_positions, map_normals,
+                     map_colours) = self.world.lod_lists(
+                        focus, self._view, camera.position, self._lod,
+                        camera.orientation[self.V], viewpoint.window)
+                else:
+                    map_positions = self.world.patch_positions_list(
+                        focus, self._view, viewpoint.window)
+                    map_normals = self.world.normals_list(
+                        focus, self._view, viewpoint.window)
+                    map_patches = self.world.patches_list(
+                        focus, self._view, viewpoint.window)
+                    map_colours = self.world.colours_list(
+                        focus, self._view, viewpoint.window)
+            with self.profiler.scope("project"):
+                map_patches, map_depths = camera.get_screen_coordinates(
+                    map_patches)
+            # Terrain is never back-face culled:
+            visible = self.cull(viewpoint, map_patches, map_depths,
+                                map_positions)
+            map_positions = map_positions[visible]
+            with self.profiler.scope("lighting"):
+                map_colours = shader.apply_lighting(map_positions,
+                                                    map_normals[visible],
+                                                    map_colours[visible],
+                                                    culling=False)
+            queue.push(map_patches[visible], map_colours, map_positions,
+                       camera.position, queue.TERRAIN, map_depths[visible])
 
         # get objects in view:
-        if self.camera.position[self.Z] < self._culling_height:
+        if camera.position[self.Z] < self._culling_height:
             view = self._view
-            houses_positions = self.houses.positions.copy()
-            houses_positions = self.world.fix_view(self.focus_position, view,
+            houses_positions = houses.positions.copy()
+            houses_positions = self.world.fix_view(focus, view,
                                                    houses_positions)
             houses_in_view = self.world.positions_in_view(
-                self.focus_position, view, houses_positions)
+                focus, view, houses_positions)
 
             if houses_in_view.size:
-                houses_positions = self.world.fix_view(
-                    self.focus_position, view,
-                    self.houses.patch_positions(houses_in_view))
-                houses_patches = self.world.fix_view(
-                    self.focus_position, view,
-                    self.houses.patches(houses_in_view))
-
-                (houses_patches, houses_depths) = \
-                    self.camera.get_screen_coordinates(houses_patches)
-                houses_normals = self.houses.normals(houses_in_view)
-                houses_colours = self.houses.colours(houses_in_view)
-                houses_colours = self.shader.apply_lighting(houses_positions,
-                                                            houses_normals,
-                                                            houses_colours)
-
-            else:
-                houses_positions = np.empty((0, 3))
-                houses_patches = np.empty((0, 3, 2))
-                houses_colours = np.empty((0, 4))
-
-        else:
-            houses_positions = np.empty((0, 3))
-            houses_patches = np.empty((0, 3, 2))
-            houses_colours = np.empty((0, 4))
+                with self.profiler.scope("slice"):
+                    houses_positions = self.world.fix_view(
+                        focus, view, houses.patch_positions(houses_in_view))
+                    houses_patches = self.world.fix_view(
+                        focus, view, houses.patches(houses_in_view))
+
+                with self.profiler.scope("project"):
+                    (houses_patches, houses_depths) = \
+                        camera.get_screen_coordinates(houses_patches)
+
+                houses_normals = houses.normals(houses_in_view)
+                visible = self.cull(viewpoint, houses_patches,
+                                    houses_depths, houses_positions,
+                                    houses_normals)
+                houses_positions = houses_positions[visible]
+
+                with self.profiler.scope("lighting"):
+                    houses_colours = houses.colours(houses_in_view)
+                    houses_colours = shader.apply_lighting(
+                        houses_positions, houses_normals[visible],
+                        houses_colours[visible], culling=False)
+
+                queue.push(houses_patches[visible], houses_colours,
+                           houses_positions, camera.position,
+                           depths=houses_depths[visible])
 
         # get player:
-        player_positions = self.player.model.positions
-        player_normals = self.player.model.normals
-        player_patches, player_depth = self.camera.get_screen_coordinates(
-            self.player.model.patches)
-        player_colours = self.player.model.colours.copy()
-        player_colours = self.shader.apply_lighting(player_positions,
-                                                    player_normals,
-                                                    player_colours)
+        with self.profiler.scope("project"):
+            player_positions = model.positions + shift
+            player_normals = model.normals
+            player_patches, player_depth = camera.get_screen_coordinates(
+                model.patches + shift)
+        visible = self.cull(viewpoint, player_patches, player_depth,
+                            player_positions, player_normals)
+        player_positions = player_positions[visible]
+        with self.profiler.scope("lighting"):
+            player_colours = model.colours[visible]
+            player_colours = shader.apply_lighting(
+                player_positions, player_normals[visible], player_colours,
+                culling=False)
+        queue.push(player_patches[visible], player_colours, player_positions,
+                   camera.position, depths=player_depth[visible])
+
         # get shadow:
-        if self.camera.position[self.Z] < self._culling_height:
-            player_shadow, player_shadow_positions = e.shadow.get_shadows(
-                self.player.model.patches.copy(), self.world)
-            player_shadow, shadow_depths = self.camera.get_screen_coordinates(
-                player_shadow)
-            player_shadow_colours = np.array([[0, 0, 0, 1]]) * np.ones(
-                (player_shadow.shape[0], 1))
+        if camera.position[self.Z] < self._culling_height:
+            with self.profiler.scope("shadows"):
+                player_shadow, player_shadow_positions = e.shadow.get_shadows(
+                    model.patches + shift, self.world)
+                player_shadow, shadow_depths = \
+                    camera.get_screen_coordinates(player_shadow)
+            visible = self.cull(viewpoint, player_shadow, shadow_depths,
+                                player_shadow_positions)
+            queue.push(player_shadow[visible], self._shadow_colour,
+                       player_shadow_positions[visible], camera.position,
+                       queue.SHADOWS, shadow_depths[visible])
+
+        particles.set_visible(
+            e.particles.STAR, focus[self.Z] >= particles.star_heights[0] -
+            camera.screen.extent[self.V] * 0.5)
+
+        with self.profiler.scope("particles"):
+            self.queue_particles(viewpoint, self._view + camera.distance -
+                                 0.5, queue, particles, alpha)
+
+        sizes = queue.layer_sizes()
+        self.profiler.count("#terrain", sizes[queue.TERRAIN])
+        self.profiler.count("#objects", sizes[queue.OBJECTS])
+        self.profiler.count("#shadows", sizes[queue.SHADOWS])
+        counts = particles.counts()
+        for kind in (e.particles.SHOT, e.particles.EXHAUST,
+                     e.particles.SHRAPNEL):
+            self.profiler.count("#" + e.particles.NAMES[kind], counts[kind])
+        for reason in viewpoint.culler.REASONS:
+            self.profiler.count("#culled " + reason,
+                                viewpoint.culler.counts[reason])
+
+    def do_step(self, surface, elapsed=None):
+        """
+        Handles inputs, advances the simulation by elapsed seconds (see
+        advance) and draws a frame. With a simulation thread, the simulation
+        advances by itself instead, and the frame draws its latest snapshot.
+
+        When replaying, inputs and elapsed come from the replay instead,
+        and the game returns to the menu at its end; when recording, they
+        are recorded, and the recording is saved on leaving the game.
+        """
+
+        self.profiler.begin_frame()
+
+        with self.profiler.scope("input"):
+            flag = self.handle_inputs()
+
+            if elapsed is None:
+                elapsed = self._frame_time
+
+            if self._replay is not None:
+                elapsed = self.replay_inputs()
+                if self._frame >= self._replay.number and flag == "game":
+                    flag = self.return_to_menu()
+
+            if self._recording is not None:
+                self.record_inputs(elapsed)
+                if flag != "game":
+                    self._recording.save(self._config["record"])
+
+        self._frame += 1
+
+        if self._simulation_thread is not None:
+            thread = self._simulation_thread
+            thread.act(self._actions)
+            thread.paused = self._pause
+            snapshot, alpha = thread.latest()
+            self.profiler.count("#steps", thread.steps - self._steps)
+            self._steps = thread.steps
         else:
-            player_shadow_positions = np.empty((0, 3))
-            player_shadow = np.empty((0, 4, 2))
-            player_shadow_colours = np.empty((0, 4))
-
-        # Handle particles:
-        if self.player.fire and (self.shots.number == 0 or
-                                 self.shots.ages[-1] > self.player.cool_down):
-            self.shots.add_particle(self.player.model.gun,
-                                    self.player.model.orientation[self.V] * 16
-                                    + self.player.velocity, np.zeros(3))
-
-        if self.player.model.exploding:
-            if not self.player.model.exploded:
-                N = np.random.randint(144, 233)
-                self.exhaust.add_particles(
-                    self.player.position * np.ones((N, 3)),
-                    (2 * np.random.random((N, 3)) - 1) * 5
-                    + 0.9 * self.player.velocity * np.ones((N, 3)),
-                    np.zeros((N, 3)))
-                self.player.model.exploded = True
-        elif self.player.thrust:
-            N = np.random.randint(0, 5)
-            self.exhaust.add_particles(
-                self.player.model.engine * np.ones((N, 3)),
-                (2 * np.random.random((N, 3)) - 1) * 2 *
-                self.player.model.orientation[self.U] +
-                (2 * np.random.random((N, 3)) - 1) * 2 *
-                self.player.model.orientation[self.V] +
-                -self.player.model.orientation[self.W] *
-                (7 + 2 * np.random.random((N, 3))) +
-                self.player.velocity * np.ones((N, 3)), np.zeros((N, 3)))
-
-
-        if (self.player.position[self.Z] < self.star_field.min_height -
-                self.camera.screen.extent[self.V] * 0.5):
-            self.star_field.visible = False
+            if not (self._pause or self._gameover) and flag == "game":
+                with self.profiler.scope("simulate"):
+                    self.profiler.count("#steps", self.advance(elapsed))
+            with self.profiler.scope("snapshot"):
+                snapshot = self.simulation.snapshot()
+            alpha = self.alpha
+
+        self._snapshot = snapshot
+
+        if self._pipeline:
+            if not self._prepared:
+                self.prepare_frame(self._back_queue, self._back_viewpoint,
+                                   snapshot, alpha)
+            # A queue and the viewpoint it was prepared with go together:
+            self.render_queue, self._back_queue = (self._back_queue,
+                                                   self.render_queue)
+            self._viewpoint, self._back_viewpoint = (self._back_viewpoint,
+                                                     self._viewpoint)
+            self._worker.submit(self.prepare_frame, self._back_queue,
+                                self._back_viewpoint, snapshot, alpha)
+            self._prepared = True
         else:
-            self.star_field.visible = True
-
-        (shots_positions, shots_patches, shots_colours,
-         shots_shadow_positions, shots_shadows, shots_shadow_colours) = \
-            self.get_particle_patches(self.shots, self._view +
-                                      self.camera.distance - 0.5)
-
-        (exhaust_positions, exhaust_patches, exhaust_colours,
-         exhaust_shadow_positions, exhaust_shadows, exhaust_shadow_colours) = \
-            self.get_particle_patches(self.exhaust, self._view +
-                                      self.camera.distance - 0.5)
-
-        (shrapnel_positions, shrapnel_patches, shrapnel_colours,
-         shrapnel_shadow_positions, shrapnel_shadows,
-         shrapnel_shadow_colours) = self.get_particle_patches(self.shrapnel,
-                                                              self._view)
-
-        (stars_positions, stars_patches, stars_colours,
-         stars_shadow_positions, stars_shadows, stars_shadow_colours) = \
-            self.get_particle_patches(self.star_field, self._view +
-                                      self.camera.distance - 0.5)
-
-        # aggregate draw data:
-        object_positions = np.r_[player_positions, shots_positions,
-                                 exhaust_positions, shrapnel_positions,
-                                 houses_positions, stars_positions]
-        object_patches = list(player_patches[:])
-        object_patches.extend(list(shots_patches[:]))
-        object_patches.extend(list(exhaust_patches[:]))
-        object_patches.extend(list(shrapnel_patches[:]))
-        object_patches.extend(list(houses_patches[:]))
-        object_patches.extend(list(stars_patches[:]))
-        object_colours = np.r_[player_colours, shots_colours, exhaust_colours,
-                               shrapnel_colours, houses_colours, stars_colours]
-
-        shadow_positions = np.r_[player_shadow_positions,
-                                 shots_shadow_positions,
-                                 exhaust_shadow_positions,
-                                 shrapnel_shadow_positions]
-        shadow_patches = list(player_shadow[:])
-        shadow_patches.extend(list(shots_shadows[:]))
-        shadow_patches.extend(list(exhaust_shadows[:]))
-        shadow_patches.extend(list(shrapnel_shadows[:]))
-        shadow_colours = np.r_[player_shadow_colours, shots_shadow_colours,
-                               exhaust_shadow_colours, shrapnel_shadow_colours]
-
-        # sort patches:
+            self.prepare_frame(self.render_queue, self._viewpoint, snapshot,
+                               alpha)
 
         # draw:
-        surface.fill((0, 0, 0))
-
-        # draw landscape:
-        self.draw_patches(map_positions, map_patches, map_colours, surface)
-
-        # draw shadows:
-        self.draw_patches(shadow_positions, shadow_patches, shadow_colours,
-                          surface)
+        with self.profiler.scope("draw"):
+            surface.fill((0, 0, 0))
 
-        # draw objects and particles:
-        self.draw_patches(object_positions, object_patches, object_colours,
-                          surface)
+        self.draw_queue(surface)
 
         if self._pause:
 
@@ -575,7 +962,7 @@ class Game(object):
             surface.blit(text, textpos)
 
             text = self._font.render(
-                "Points: {}".format(self._points), True, colour,
+                "Points: {}".format(snapshot.points), True, colour,
             )
 
             textpos = text.get_rect(
@@ -602,64 +989,21 @@ class Game(object):
 
             pygame.mouse.get_rel()
 
-        else:
-
-            self.player.move(self._dt)
-            self.player.impose_boundary_conditions(self.world)
-
-            if self.shots.number:
-                self.shots.move(self._dt)
-                self.check_shots_hit()
-                shrapnel = self.shots.impose_boundary_conditions(self.world)
-                if shrapnel is not None:
-                    self.shrapnel.add_particles(*shrapnel)
+        if self._pipeline:
+            with self.profiler.scope("wait"):
+                self._worker.wait()
 
-            if self.shrapnel.number:
-                self.shrapnel.impose_boundary_conditions(self.world)
-                self.shrapnel.move(self._dt)
+            if flag != "game":
+                self.close_pipeline()
 
-            if self.exhaust.number:
-                shrapnel = self.exhaust.impose_boundary_conditions(self.world)
-                self.exhaust.move(self._dt)
-                if shrapnel is not None:
-                    self.shrapnel.add_particles(*shrapnel)
+        if flag != "game":
+            self.stop_simulation_thread()
 
-            if self.star_field.number and self.star_field.visible:
-                self.star_field.offset = self.player.position
-                self.star_field.impose_boundary_conditions()
-                self.star_field.move(self.player.velocity *
-                                     np.array([1.0, 1.0, 0.0]), self._dt)
+        self._gameover = snapshot.gameover
 
-            self.update_camera()
+        self.profiler.end_frame()
 
-        if self.player.model.exploding:
-            try:
-                self._gameover = (
-                    self._gameover_timer
-                    < dt.datetime.now() - dt.timedelta(seconds=1)
-                )
-            except TypeError:
-                self._gameover_timer = dt.datetime.now()
+        if self._show_profile:
+            self.draw_profile(surface)
 
         return flag
-
-    def check_shots_hit(self):
-        hits = (((
-            self.shots.positions[:, np.newaxis]
-            - self.houses.positions[np.newaxis, :]
-        ) ** 2).sum(axis=2) < self.houses.model.scale).sum(axis=0)
-
-        for house_index, house_position in enumerate(self.houses.positions):
-            if hits[house_index] and not self.houses.exploding[house_index]:
-                print( "BOOM!" )
-                N = np.random.randint(89, 144)
-                offset = np.ones((N, 3))
-                offset[:, self.Z] = 0
-                self.exhaust.add_particles(
-                    house_position * np.ones((N, 3)),
-                    (2 * np.random.random((N, 3)) - offset) * 5,
-                    np.zeros((N, 3))
-                )
-                self.houses.explode_object(house_index)
-                self._points -= 1
-                break
@@ -0,0 +1,104 @@
+from __future__ import print_function
+
+import numpy as np
+
+
+class Recording(object):
+    """
+    A Recording is what it takes to play a game again exactly: the seed of
+    its simulation (see engine.rng) and, frame by frame, the input state
+    after handling inputs:
+    * elapsed:
+        - the time the frame advanced the simulation by, in seconds.
+
+    * yaw, pitch:
+        - the orientation of the player, in radians.
+
+    * buttons:
+        - bit flags of what was held down or on (THRUST, FIRE, ROCKET and
+          PAUSE).
+
+    That is 25 bytes a frame, kept in one structured array and saved as a
+    compressed .npz file. Load a recording by giving its filename.
+
+    Played back by a Game with the same config, map and frame rate, the
+    simulation sees the same inputs over the same steps, and so does the
+    same, bit for bit, however fast the frames are drawn.
+    """
+
+    FRAME = np.dtype([("elapsed", np.float64),
+                      ("yaw", np.float64),
+                      ("pitch", np.float64),
+                      ("buttons", np.uint8)])
+
+    THRUST = 1
+    FIRE = 2
+    ROCKET = 4
+    PAUSE = 8
+
+    def __init__(self, filename=None, seed=0, capacity=1024):
+        if filename is not None:
+            with np.load(filename) as data:
+                self._seed = int(data["seed"])
+                self._frames = data["frames"].astype(self.FRAME)
+            self._number = self._frames.shape[0]
+        else:
+            self._seed = seed
+            self._frames = np.zeros(capacity, dtype=self.FRAME)
+            self._number = 0
+
+    @property
+    def seed(self):
+        return self._seed
+
+    @property
+    def number(self):
+        return self._number
+
+    @property
+    def frames(self):
+        return self._frames[: self._number]
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes
+
+    def record(self, elapsed, yaw, pitch, thrust=False, fire=False,
+               rocket=False, pause=False):
+        """
+        Appends the input state of a frame.
+        """
+
+        if self._number == self._frames.shape[0]:
+            frames = np.zeros(2 * self._frames.shape[0], dtype=self.FRAME)
+            frames[: self._number] = self._frames
+            self._frames = frames
+
+        frame = self._frames[self._number]
+        frame["elapsed"] = elapsed
+        frame["yaw"] = yaw
+        frame["pitch"] = pitch
+        frame["buttons"] = (self.THRUST * bool(thrust) |
+                            self.FIRE * bool(fire) |
+                            self.ROCKET * bool(rocket) |
+                            self.PAUSE * bool(pause))
+
+        self._number += 1
+
+    def frame(self, n):
+        """
+        Returns the input state of frame n as elapsed, yaw, pitch, thrust,
+        fire, rocket and pause.
+        """
+
+        frame = self._frames[n]
+        buttons = int(frame["buttons"])
+
+        return (float(frame["elapsed"]), float(frame["yaw"]),
+                float(frame["pitch"]), bool(buttons & self.THRUST),
+                bool(buttons & self.FIRE), bool(buttons & self.ROCKET),
+                bool(buttons & self.PAUSE))
+
+    def save(self, filename):
+        np.savez_compressed(filename, seed=np.array(self._seed),
+                            frames=self.frames)
@@ -0,0 +1,521 @@
+from __future__ import print_function
+
+import time
+import threading
+from collections import namedtuple
+
+import numpy as np
+from . import engine as e
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+
+class Snapshot(namedtuple("Snapshot", (
+        "time", "points", "gameover", "position", "previous_position",
+        "velocity", "yaw", "pitch", "roll", "model", "houses",
+        "particles"))):
+    """
+    A Snapshot is the simulation as drawn, at the end of a step, frozen (see
+    Simulation.snapshot):
+    * time, points, gameover:
+        - as of the Simulation.
+
+    * position, previous_position, velocity, yaw, pitch, roll:
+        - of the player; previous_position is its position a step before.
+
+    * model, houses, particles:
+        - snapshots of the player model, the houses and the particles (see
+          TriD.snapshot, TriDGroup.snapshot and ParticleEngine.snapshot).
+
+    Nothing in a snapshot changes once it is taken, so that it can be drawn
+    on one thread while the simulation steps on another.
+    """
+
+    __slots__ = ()
+
+
+class Simulation(object):
+    """
+    The Simulation is the game without drawing or input handling: the world
+    map, the player, the houses and the particles, advanced in fixed steps
+    of dt seconds.
+
+    Game builds one and draws it. On its own, it needs no display and runs
+    as fast as it can; the player is then controlled by the actions given to
+    step, a dict with any of:
+    * thrust, fire, rocket:
+        - booleans.
+
+    * yaw, pitch:
+        - the orientation of the player, in radians.
+
+    Actions left out keep their values from the step before. step returns
+    the state of the simulation after the step (see state).
+
+    frame_time is the time the rates of exhaust and of fading particles are
+    given for (see ParticleEngine), normally the frame time of the game.
+
+    Everything random is drawn from generators derived from seed (see
+    engine.rng), one for each of the world, effects, particles, player and
+    houses; seed defaults to config["seed"], or, if there is none, to a new
+    random seed. The same seed and the same actions give the same
+    simulation.
+    """
+
+    X = U = 0
+    Y = V = 1
+    Z = W = 2
+
+    # Time from the player exploding to the game being over:
+    GAMEOVER_TIME = 1.0
+
+    # Subsystems with random number generators of their own:
+    RANDOM = ("world", "effects", "particles", "player", "houses")
+
+    def __init__(self, config, world, dt=1.0 / 60, frame_time=1.0 / 23.8,
+                 seed=None):
+        if seed is None:
+            seed = config.get("seed")
+        if seed is None:
+            seed = e.rng.new_seed()
+
+        self._config = config
+        self._seed = seed
+        self._random = e.rng.generators(seed, self.RANDOM)
+        self._dt = dt
+        self._frame_time = frame_time
+        self._time = 0.0
+        self._points = 0
+        self._frames = 0
+        self._exploded_at = None
+
+        # Everything the simulation allocates gets its dtype policy:
+        self._policy = e.dtypes.Policy(config.get("dtypes", "compact"))
+
+        if config.get("compact map", False):
+            self.world = e.mapper.CompactMap(world, policy=self._policy)
+        else:
+            self.world = e.mapper.Map(world, cache=True, policy=self._policy)
+
+        if not config.get(" ", False):
+            self.player = e.mobs.Player(e.triDobjects.FireFighter(scale=2.0))
+            # self.player = e.mobs.Player(e.triDobjects.Pika(scale=3.0))
+        else:
+            self.player = e.mobs.Player(e.triDobjects.Lander(scale=1.0))
+        self.player.model.random = self._random["player"]
+
+        self.player.position = (np.array([64.0, 64.0, 5.0]))
+        self._previous_position = self.player.position.copy()
+
+        self._populate_world()
+        self.house_index = e.broadphase.SpatialHash(self.world.shape,
+                                                    policy=self._policy)
+        self.particles = e.particles.ParticleEngine(
+            fade_step=frame_time, random=self._random["particles"],
+            policy=self._policy)
+
+    @property
+    def config(self):
+        return self._config
+
+    @property
+    def seed(self):
+        return self._seed
+
+    @property
+    def policy(self):
+        """
+        The dtype policy of the simulation (see dtypes), from the "dtypes"
+        entry of the config.
+        """
+
+        return self._policy
+
+    @property
+    def dt(self):
+        return self._dt
+
+    @property
+    def time(self):
+        return self._time
+
+    @property
+    def points(self):
+        return self._points
+
+    @property
+    def previous_position(self):
+        """
+        Returns the position of the player before the last step.
+        """
+
+        return self._previous_position
+
+    @property
+    def gameover(self):
+        return (self._exploded_at is not None and
+                self._time - self._exploded_at > self.GAMEOVER_TIME)
+
+    def _populate_world(self):
+        random = self._random["world"]
+        n_houses = 42
+        settlements = e.triDobjects.TriDGroup(
+            model=e.triDobjects.House(scale=0.618),
+            timeout=0.5,
+            policy=self._policy,
+        )
+        settlements.random = self._random["houses"]
+        angles = 2 * np.pi * random.random(n_houses)
+        candidates = np.array(self.world.heights)
+
+        for n in range(n_houses):
+            x, y = (random.random(2) * self.world.shape).astype(int)
+            X, Y = np.mgrid[x - 1: x + 2, y - 1: y + 2]
+            X %= self.world.shape[self.X]
+            Y %= self.world.shape[self.Y]
+
+            while((candidates[X, Y] <= 0).any()):
+                x, y = (random.random(2) * self.world.shape).astype(int)
+                X, Y = np.mgrid[x - 1: x + 2, y - 1: y + 2]
+                X %= self.world.shape[self.X]
+                Y %= self.world.shape[self.Y]
+
+            settlements.add_object(
+                position=np.array([x, y, candidates[x, y]]),
+                yaw=angles[n])
+
+            candidates[X, Y] *= 0
+
+        self.houses = settlements
+
+    def apply_actions(self, actions):
+        for name in ("thrust", "fire", "rocket", "yaw", "pitch"):
+            if name in actions:
+                setattr(self.player, name, actions[name])
+
+    def step(self, actions=None):
+        """
+        Applies actions (see Simulation), advances the simulation by one
+        step of dt and returns its state.
+        """
+
+        if actions:
+            self.apply_actions(actions)
+
+        self.simulate(self._dt)
+
+        return self.state()
+
+    def simulate(self, dt):
+        """
+        Advances the simulation by dt seconds.
+        """
+
+        random = self._random["effects"]
+
+        self._previous_position = self.player.position.copy()
+        self._time += dt
+
+        # Handle particles:
+        if self.player.fire and (self.particles.youngest(e.particles.SHOT) >
+                                 self.player.cool_down):
+            self.particles.add_shot(self.player.model.gun,
+                                    self.player.model.orientation[self.V] * 16
+                                    + self.player.velocity)
+
+        if self.player.model.exploding:
+            if not self.player.model.exploded:
+                N = random.integers(144, 233)
+                self.particles.add_exhaust(
+                    self.player.position * np.ones((N, 3)),
+                    (2 * random.random((N, 3)) - 1) * 5
+                    + 0.9 * self.player.velocity * np.ones((N, 3)))
+                self.particles.disturb(self.player.position, 2.0)
+                self.player.model.exploded = True
+                self._exploded_at = self._time
+        elif self.player.thrust:
+            # On average two particles per frame_time:
+            N = random.poisson(2.0 * dt / self._frame_time)
+            self.particles.add_exhaust(
+                self.player.model.engine * np.ones((N, 3)),
+                (2 * random.random((N, 3)) - 1) * 2 *
+                self.player.model.orientation[self.U] +
+                (2 * random.random((N, 3)) - 1) * 2 *
+                self.player.model.orientation[self.V] +
+                -self.player.model.orientation[self.W] *
+                (7 + 2 * random.random((N, 3))) +
+                self.player.velocity * np.ones((N, 3)))
+
+        self.player.move(dt)
+        self.player.impose_boundary_conditions(self.world)
+
+        self.particles.move(dt)
+        self.check_collisions()
+        self.particles.impose_boundary_conditions(
+            self.world, self.player.position)
+        self.remove_houses()
+
+        frames = int(self._time / self._frame_time)
+        if frames != self._frames:
+            self._frames = frames
+            self.animate_houses()
+
+    def animate_houses(self):
+        """
+        Blows exploding houses further apart; simulate does this every
+        frame_time.
+        """
+
+        for ind, t in enumerate(self.houses.exploding):
+            if t:
+                self.houses.explode_object(ind)
+
+    def remove_houses(self):
+        """
+        Deletes the houses that have been exploding for longer than the
+        timeout of the houses.
+        """
+
+        timeout = self.houses.timeout.total_seconds()
+
+        self.houses.delete_objects(
+            [ind for ind, t in enumerate(self.houses.exploding)
+             if t and self._time - t > timeout])
+
+    def check_collisions(self):
+        """
+        Finds shots, shrapnel and the player hitting houses, using the
+        broadphase index of houses. Houses hit by shots or the player
+        explode, the player crashes, and shrapnel bounces off.
+        """
+
+        random = self._random["effects"]
+        houses = self.houses
+
+        if not houses.number:
+            return
+
+        # Houses are hit within the square root of their scale:
+        radius = np.sqrt(houses.model.scale)
+
+        # Houses don't move, and are only ever deleted:
+        if self.house_index.number != houses.number:
+            self.house_index.build(houses.positions)
+
+        particles = self.particles
+        shots = particles.indices(e.particles.SHOT)
+        _, hit = self.house_index.query_pairs(particles.positions[shots],
+                                              radius)
+
+        if not self.player.model.exploding:
+            _, crashed = self.house_index.query_pairs(
+                self.player.position[np.newaxis], radius)
+            if crashed.size:
+                self.player.model.exploding = True
+            hit = np.concatenate((hit, crashed))
+
+        for house_index in np.unique(hit):
+            if not houses.exploding[house_index]:
+                house_position = houses.positions[house_index]
+                N = random.integers(89, 144)
+                offset = np.ones((N, 3))
+                offset[:, self.Z] = 0
+                particles.add_exhaust(
+                    house_position * np.ones((N, 3)),
+                    (2 * random.random((N, 3)) - offset) * 5
+                )
+                particles.disturb(house_position, 2.0)
+                houses.explode_object(house_index, self._time)
+                self._points -= 1
+
+        shrapnel = particles.indices(e.particles.SHRAPNEL)
+        pieces, struck = self.house_index.query_pairs(
+            particles.positions[shrapnel], radius)
+        pieces, first = np.unique(pieces, return_index=True)
+        if pieces.size:
+            particles.deflect(shrapnel[pieces],
+                              houses.positions[struck[first]], radius)
+
+    def snapshot(self):
+        """
+        Returns a Snapshot of the simulation as it is now.
+        """
+
+        return Snapshot(
+            time=self._time,
+            points=self._points,
+            gameover=self.gameover,
+            position=self.player.position.copy(),
+            previous_position=self._previous_position.copy(),
+            velocity=np.array(self.player.velocity, dtype=float),
+            yaw=self.player.yaw,
+            pitch=self.player.pitch,
+            roll=self.player.roll,
+            model=self.player.model.snapshot(),
+            houses=self.houses.snapshot(),
+            particles=self.particles.snapshot(),
+        )
+
+    def state(self):
+        """
+        Returns the state of the simulation as a dict of arrays (copies):
+        * time, points:
+            - the simulated time and the points scored.
+
+        * position, velocity, orientation:
+            - of the player; orientation is yaw, pitch and roll.
+
+        * exploding, gameover:
+            - whether the player has crashed, and whether the game is over.
+
+        * houses, houses exploding:
+            - positions of the houses, and whether they have been hit.
+
+        * particles, types:
+            - positions and kinds of all particles.
+        """
+
+        return {
+            "time": np.array(self._time),
+            "points": np.array(self._points),
+            "position": self.player.position.copy(),
+            "velocity": np.array(self.player.velocity, dtype=float),
+            "orientation": np.array([self.player.yaw, self.player.pitch,
+                                     self.player.roll]),
+            "exploding": np.array(bool(self.player.model.exploding)),
+            "gameover": np.array(self.gameover),
+            "houses": self.houses.positions.copy(),
+            "houses exploding": self.houses.exploding.astype(bool),
+            "particles": self.particles.positions.copy(),
+            "types": self.particles.types.copy(),
+        }
+
+
+class SimulationThread(object):
+    """
+    The SimulationThread runs a Simulation on a thread of its own, in real
+    time: steps of dt are taken as the clock goes, at most max_steps at a
+    time (time beyond that is dropped, as in Game.advance), whatever the
+    thread that draws is doing.
+
+    After the steps due, a Snapshot of the simulation is published. Snapshots
+    never change, and publishing one only replaces a reference, so readers
+    need no locks: latest always returns a whole snapshot. Likewise, act
+    replaces the actions (see Simulation), which apply from the next step
+    on.
+
+    While paused, or once the game is over, no steps are taken. Exceptions
+    raised on the thread are raised again by latest.
+    """
+
+    def __init__(self, simulation, max_steps=5):
+        self._simulation = simulation
+        self._max_steps = max_steps
+        self._actions = {}
+        self._paused = False
+        self._running = False
+        self._steps = 0
+        self._error = None
+        self._thread = None
+        self._published = (simulation.snapshot(), clock())
+
+    @property
+    def simulation(self):
+        return self._simulation
+
+    @property
+    def steps(self):
+        """
+        The number of steps taken so far.
+        """
+
+        return self._steps
+
+    @property
+    def paused(self):
+        return self._paused
+
+    @paused.setter
+    def paused(self, val):
+        self._paused = True if val else False
+
+    @property
+    def running(self):
+        return self._running
+
+    def act(self, actions):
+        self._actions = dict(actions)
+
+    def latest(self):
+        """
+        Returns the latest snapshot and how far (as a fraction of a step)
+        the time now is past its publication.
+        """
+
+        if self._error is not None:
+            raise self._error
+
+        snapshot, published = self._published
+
+        if self._paused or snapshot.gameover:
+            return snapshot, 1.0
+
+        return snapshot, min(1.0, (clock() - published) /
+                             self._simulation.dt)
+
+    def start(self):
+        if self._running:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name="simulation")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        try:
+            self._loop()
+        except Exception as error:
+            self._error = error
+            self._running = False
+
+    def _loop(self):
+        simulation = self._simulation
+        dt = simulation.dt
+        next_step = clock()
+
+        while self._running:
+            now = clock()
+
+            if self._paused or simulation.gameover:
+                next_step = now + dt
+                time.sleep(dt)
+                continue
+
+            if now < next_step:
+                time.sleep(next_step - now)
+                continue
+
+            steps = 0
+            while next_step <= now:
+                if steps == self._max_steps:
+                    next_step = now + dt
+                    break
+                simulation.apply_actions(self._actions)
+                simulation.simulate(dt)
+                self._steps += 1
+                next_step += dt
+                steps += 1
+
+            self._published = (simulation.snapshot(), clock())